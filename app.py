@@ -1,36 +1,31 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import csv
-import os
-import openpyxl
-from openpyxl.styles import PatternFill
+import io
 from PIL import Image
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from thefuzz import fuzz  # Import para fuzzy matching
-import sys # Importado para ajustar o limite do campo CSV
-
-CONFIG_FILE = 'configuracoes.csv'
+import time
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from armazenamento import (BINARY_CONFIG_FILE, CONFIG_FILE, EXCEL_CONFIG_FILE, BaseStorage, file_signature, load_base,
+                           write_configurations_csv)
+from busca import SearchIndex
+from metricas import AuditMetrics
+from exportacao import PDF_ROWS_PER_PART, excel_download, pdf_download
+from tarefas import JOB_CANCELLED, JOB_DONE, JOB_PROCESSES, JOB_QUEUED, JobCancelled, JobQueue, ReadWriteLock
+from ingestao import (BASE_COLUMNS, BASE_REQUIRED_COLUMNS, SUPPORTED_EXTENSIONS, base_records, read_table,
+                      upsert_records)
+from auditoria import (ALTERNATIVES_K, LOW_CONFIDENCE_TYPES, SIMILARITY_FUZZY, SIMILARITY_TFIDF, AuditState,
+                       BaseIndex, concat_results, export_frame, iter_process_planilha, match_alternatives,
+                       reaudit_planilha, MATCH_EXATO, MATCH_PALAVRAS, MATCH_SIMILARIDADE, MATCH_NENHUM)
 
 st.set_page_config(page_title="Sistema de Auditoria Tributária - Escritório Contábil Sigilo", layout="centered")
 
-# --- Correção do Limite de Campo CSV ---
-# Aumenta o limite do tamanho do campo para evitar erros com células grandes no CSV.
-# Usar sys.maxsize pode consumir muita memória se um campo for extremamente grande.
-# Um limite grande e fixo pode ser uma alternativa, mas sys.maxsize é a abordagem comum.
-try:
-    max_int = sys.maxsize
-    decrement = True
-    while decrement:
-        # Diminui o max_int até que funcione
-        try:
-            csv.field_size_limit(max_int)
-            decrement = False
-        except OverflowError:
-            max_int = int(max_int / 10)
-except Exception as e:
-    st.warning(f"Não foi possível ajustar o limite do campo CSV dinamicamente: {e}. Usando limite padrão.")
-
 # Carregar logo (se presente)
 try:
     logo = Image.open("logo.png")
@@ -40,419 +35,404 @@ except FileNotFoundError:
 
 st.title("📊 Sistema de Auditoria Tributária de Produtos - Escritório Contábil Sigilo")
 
-def clean_cest(cest_value):
-    """Limpa o valor do CEST, removendo '.0' e garantindo que seja uma string."""
-    if pd.isna(cest_value):
-        return '0'
-    cest_str = str(cest_value).strip()
-    if cest_str.endswith('.0'):
-        cest_str = cest_str[:-2] # Remove '.0'
-    # Tenta converter para int para remover quaisquer outros decimais e depois para str
-    try:
-        return str(int(cest_str))
-    except ValueError:
-        # Se não for um número válido após remover .0, retorna a string limpa
-        return cest_str if cest_str else '0'
-
-def get_keywords(text):
-    stopwords = {'de', 'da', 'do', 'e', 'em', 'com', 'ml'}
-    return set(word.lower() for word in str(text).split() if word.lower() not in stopwords and len(word) > 2)
-
-def load_configurations():
-    configs = {}
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    sample = f.read(2048) # Ler uma amostra maior pode ajudar
-                    dialect = csv.Sniffer().sniff(sample)
-                    f.seek(0)
-                except csv.Error:
-                    f.seek(0)
-                    dialect = csv.excel # Usa um dialeto padrão
-                    st.sidebar.warning("Não foi possível detectar o delimitador do CSV automaticamente, tentando com vírgula.")
-
-                reader = csv.reader(f, dialect)
-                header = next(reader, None) # Pula o cabeçalho se existir
-
-                for row_num, row in enumerate(reader, start=2): # start=2 para contar cabeçalho
-                    try:
-                        if len(row) >= 5: # Espera 5 colunas: Desc, NCM, ALIQ, TRIB, CEST
-                            desc_val = str(row[0]).strip()
-                            ncm_val = str(row[1]).strip()
-                            aliq_val = str(row[2]).strip()
-                            trib_val = str(row[3]).strip() # Nome interno sem Ç
-                            cest_val = clean_cest(row[4])
-                            configs[desc_val] = {
-                                'NCM': ncm_val,
-                                'ALIQ_ICMS': aliq_val,
-                                'TRIBUTACAO': trib_val, # Padronizado sem Ç
-                                'CEST': cest_val
-                            }
-                        elif len(row) == 4: # Caso antigo sem CEST explícito
-                             desc_val = str(row[0]).strip()
-                             ncm_val = str(row[1]).strip()
-                             aliq_val = str(row[2]).strip()
-                             trib_val = str(row[3]).strip()
-                             configs[desc_val] = {
-                                'NCM': ncm_val,
-                                'ALIQ_ICMS': aliq_val,
-                                'TRIBUTACAO': trib_val, # Padronizado sem Ç
-                                'CEST': '0'
-                            }
-                        # Ignora linhas com menos de 4 colunas silenciosamente ou adiciona um aviso
-                        # else:
-                        #     st.sidebar.warning(f"Linha {row_num} no CSV ignorada: número inesperado de colunas ({len(row)}).")
-                    except IndexError as ie:
-                         st.sidebar.error(f"Erro de índice ao processar linha {row_num} do CSV: {ie}. Verifique a estrutura do arquivo.")
-                         continue # Pula para a próxima linha
-
-            if configs:
-                 st.sidebar.success(f"✅ Arquivo CSV '{CONFIG_FILE}' carregado com sucesso! {len(configs)} itens encontrados.")
-            else:
-                 st.sidebar.warning(f"Arquivo CSV '{CONFIG_FILE}' carregado, mas nenhum item válido encontrado.")
-
-        except Exception as e:
-            # Verifica se o erro é o de limite de campo, mesmo com o ajuste (pode indicar outros problemas)
-            if 'field larger than field limit' in str(e):
-                 st.sidebar.error(f"Erro ao carregar CSV '{CONFIG_FILE}': O arquivo contém um campo excessivamente grande, mesmo após tentar ajustar o limite. Verifique o arquivo. Detalhe: {str(e)}")
-            else:
-                 st.sidebar.error(f"Erro ao carregar arquivo CSV '{CONFIG_FILE}': {str(e)}")
-
-    # Se o CSV estava vazio ou não existe, tenta carregar do Excel
-    if not configs and os.path.exists('configuracoes.xlsx'):
-        st.sidebar.info("Arquivo CSV não encontrado ou vazio. Tentando carregar de 'configuracoes.xlsx'...")
-        try:
-            df = pd.read_excel('configuracoes.xlsx', dtype={'NCM': str, 'CEST': str})
-            # Limpeza robusta de nomes de coluna
-            df.columns = df.columns.str.strip().str.replace('"', '', regex=False).str.replace('\n', '', regex=False).str.replace('\r', '', regex=False).str.upper()
-            df.columns = df.columns.str.replace('.', '', regex=False) # Remove pontos comuns em nomes de coluna
-
-            # Mapeamento flexível de nomes de coluna (ajuste conforme variações comuns)
-            col_mapping = {
-                'DESCRIÇÃO ITEM': 'Descrição item', 'DESCRICAO ITEM': 'Descrição item',
-                'NCM': 'NCM',
-                'ALIQ ICMS': 'Aliq. ICMS', 'ALIQUOTA ICMS': 'Aliq. ICMS',
-                'TRIBUTAÇÃO': 'TRIBUTACAO', 'TRIBUTACAO': 'TRIBUTACAO',
-                'CEST': 'CEST'
-            }
-            df.rename(columns=col_mapping, inplace=True)
-
-            required_cols = ['Descrição item', 'NCM', 'Aliq. ICMS']
-            missing_cols = [col for col in required_cols if col not in df.columns]
-            if missing_cols:
-                st.sidebar.error(f"Erro: O arquivo Excel deve conter as colunas: {', '.join(required_cols)}. Colunas ausentes ou não reconhecidas: {', '.join(missing_cols)}")
-                return {}
-
-            for _, row in df.iterrows():
-                desc = str(row['Descrição item']).strip()
-                if not desc: continue
+def export_configurations_csv(configs):
+    """Retorna a base em CSV (bytes UTF-8), no mesmo layout de 'configuracoes.csv'."""
+    buffer = io.StringIO(newline='')
+    write_configurations_csv(configs, buffer)
+    return buffer.getvalue().encode('utf-8')
 
-                ncm = str(row['NCM']).strip() if pd.notna(row['NCM']) else ''
-                aliq = str(row['Aliq. ICMS']).strip()
-                # Usa .get com o nome padronizado sem Ç e fallback para Aliq. ICMS
-                trib = str(row.get('TRIBUTACAO', aliq)).strip()
-                cest = clean_cest(row.get('CEST', '0'))
+# --- Interface Streamlit --- 
 
-                configs[desc] = {'NCM': ncm, 'ALIQ_ICMS': aliq, 'TRIBUTACAO': trib, 'CEST': cest}
+IMPORT_SOURCES = (CONFIG_FILE, EXCEL_CONFIG_FILE) # Arquivos de importação da base (CSV/Excel)
 
-            if configs:
-                save_all_configurations(configs) # Salva no formato CSV padrão
-                st.sidebar.success(f"✅ Base carregada do arquivo Excel 'configuracoes.xlsx' e salva em '{CONFIG_FILE}'. {len(configs)} itens encontrados.")
+def _hash_arquivo(path):
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(bloco)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+def carregar_base(storage):
+    """Carrega a base (armazenamento.load_base) mostrando as mensagens na barra lateral."""
+    avisos = []
+    configs, base_index = load_base(storage, avisos=avisos)
+    for nivel, mensagem in avisos:
+        getattr(st.sidebar, nivel)(mensagem)
+    return configs, base_index
+
+class ConfigStore:
+    """Base de configurações e seus índices, carregados uma vez por processo e compartilhados entre sessões.
+
+    A cada execução do script só é feito um os.stat dos arquivos da base; a base é
+    recarregada quando o armazenamento binário foi alterado por outro processo, ou
+    quando o CSV/Excel de importação mudou de conteúdo (SHA-256).
+    Alterações feitas pela Aba 1 devem ocorrer sob `lock` e ser gravadas com
+    storage.append(), que só acrescenta os itens alterados ao journal. Como as
+    auditorias em segundo plano leem o BaseIndex sem o `lock`, durante todo o
+    processamento sob base_lock.reading(), as alterações também usam base_lock.writing().
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.base_lock = ReadWriteLock() # Auditorias (leitura) x alterações da base (escrita)
+        self.storage = BaseStorage(BINARY_CONFIG_FILE, self.lock)
+        self.configs = {}
+        self.base_index = BaseIndex()
+        self._assinaturas = None
+        self._hashes = None
+        self._search_index = None
+
+    def get(self):
+        """Retorna (configs, base_index), recarregando a base se os arquivos mudaram."""
+        assinaturas = tuple(file_signature(path) for path in IMPORT_SOURCES)
+        with self.lock:
+            recarregar = self._assinaturas is None or self.storage.changed_externally()
+            if not recarregar and assinaturas != self._assinaturas:
+                recarregar = tuple(_hash_arquivo(path) for path in IMPORT_SOURCES) != self._hashes
+            if recarregar:
+                self.configs, self.base_index = carregar_base(self.storage)
+                self.storage.mark_synced() # Inclusive quando a base veio do CSV sem gerar o binário
+            if recarregar or assinaturas != self._assinaturas:
+                self._registrar_arquivos()
+            return self.configs, self.base_index
+
+    def search_index(self):
+        """Índice de pesquisa da base atual: montado uma vez por base carregada e sincronizado a cada uso."""
+        with self.lock:
+            if self._search_index is None or self._search_index.base_index is not self.base_index:
+                self._search_index = SearchIndex(self.base_index)
             else:
-                 st.sidebar.warning("Nenhum item válido encontrado no arquivo Excel 'configuracoes.xlsx'.")
-
-        except Exception as e:
-            st.sidebar.error(f"Erro ao carregar arquivo Excel 'configuracoes.xlsx': {str(e)}")
-
-    return configs
-
-def save_all_configurations(configs):
-    """Salva todas as configurações no arquivo CSV, garantindo que CEST esteja limpo."""
+                self._search_index.sync()
+            return self._search_index
+
+    def _registrar_arquivos(self):
+        self._assinaturas = tuple(file_signature(path) for path in IMPORT_SOURCES)
+        self._hashes = tuple(_hash_arquivo(path) for path in IMPORT_SOURCES)
+
+@st.cache_resource
+def get_config_store():
+    return ConfigStore()
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def csv_da_base(fingerprint, _configs):
+    """CSV da base `_configs` para exportação, refeito só quando a impressão digital da base muda."""
+    return export_configurations_csv(_configs)
+
+AUDIT_CACHE_MAX_ENTRIES = 8 # Auditorias mantidas em cache (todas as sessões)
+AUDIT_CACHE_MAX_BYTES = 512 * 1024 * 1024 # Limite de memória do cache de auditorias
+
+class AuditCache:
+    """Cache LRU dos resultados de auditoria (DataFrame, Excel e PDF), compartilhado entre sessões.
+
+    Limitado em número de entradas e em bytes; a entrada menos usada recentemente
+    é descartada primeiro. A chave inclui a impressão digital da base, então uma
+    base alterada nunca reaproveita resultados antigos.
+    """
+
+    def __init__(self, max_entries=AUDIT_CACHE_MAX_ENTRIES, max_bytes=AUDIT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict() # chave -> (resultado, tamanho em bytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            if chave not in self._entradas:
+                return None
+            self._entradas.move_to_end(chave)
+            return self._entradas[chave][0]
+
+    def put(self, chave, resultado):
+        """Guarda (ou atualiza) o resultado; o tamanho inclui as exportações já concluídas."""
+        exportacoes = [resultado['excel'], *resultado['pdfs'].values()]
+        tamanho = resultado['tamanho'] + sum(
+            len(futuro.result()[0]) for futuro in exportacoes if futuro.done() and futuro.exception() is None
+        )
+        with self._lock:
+            if chave in self._entradas:
+                self._total_bytes -= self._entradas.pop(chave)[1]
+            self._entradas[chave] = (resultado, tamanho)
+            self._total_bytes += tamanho
+            while len(self._entradas) > 1 and (len(self._entradas) > self.max_entries
+                                               or self._total_bytes > self.max_bytes):
+                _, (_, tamanho_removido) = self._entradas.popitem(last=False)
+                self._total_bytes -= tamanho_removido
+
+    def find_previous(self, hash_arquivo, base_index, similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+        """Resultado mais recente da mesma planilha que pode ser reauditado sobre `base_index`, ou None."""
+        with self._lock:
+            candidatos = [resultado for (hash_resultado, *_), (resultado, _) in self._entradas.items()
+                          if hash_resultado == hash_arquivo
+                          and resultado['estado'].can_reaudit(base_index, similarity_method=similarity_method,
+                                                              ncm_prefix=ncm_prefix)]
+        return max(candidatos, key=lambda resultado: resultado['estado'].versao, default=None)
+
+    def clear(self):
+        with self._lock:
+            self._entradas.clear()
+            self._total_bytes = 0
+
+@st.cache_resource
+def get_audit_cache():
+    return AuditCache()
+
+EXPORT_WORKERS = 4 # Threads para gerar Excel/PDF em segundo plano (compartilhadas entre sessões)
+
+@st.cache_resource
+def get_export_pool():
+    return ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='exportacao')
+
+@st.cache_resource
+def get_job_queue():
+    return JobQueue()
+
+def _solicitar_pdf(chave_cache):
+    st.session_state['pdf_solicitado'] = chave_cache
+
+METRICS_LOG_FILE = 'auditorias_metricas.jsonl' # Uma linha JSON por evento (auditoria, Excel, PDF)
+
+def _registrar_metricas(metricas, evento, **extra):
+    """Acrescenta as métricas ao log; roda também nas threads de exportação, sem acesso à interface."""
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            # Escreve o cabeçalho (usando nomes consistentes)
-            writer.writerow(['Descrição item', 'NCM', 'Aliq. ICMS', 'TRIBUTACAO', 'CEST'])
-            for desc, values in configs.items():
-                ncm = str(values.get('NCM', '')).strip()
-                aliq = str(values.get('ALIQ_ICMS', '')).strip()
-                trib = str(values.get('TRIBUTACAO', '')).strip() # Salva sem Ç
-                cest = clean_cest(values.get('CEST', '0'))
-                writer.writerow([desc, ncm, aliq, trib, cest])
-        # st.sidebar.info(f"Configurações salvas em {CONFIG_FILE}") # Opcional
-    except Exception as e:
-        st.sidebar.error(f"Erro ao salvar configurações em '{CONFIG_FILE}': {str(e)}")
-
-def process_planilha(df, configs):
-    """Processa a planilha de auditoria comparando com as configurações."""
-    # Garante a existência e limpeza inicial das colunas no DataFrame de entrada
-    if 'NCM' not in df.columns:
-        df['NCM'] = ''
-    else:
-        df['NCM'] = df['NCM'].astype(str).str.replace('\.0$', '', regex=True).str.strip()
-
-    # Padroniza nomes de coluna de entrada (exemplo)
-    df.columns = df.columns.str.strip().str.upper().str.replace('.', '', regex=False)
-    col_mapping_audit = {
-        'DESCRIÇÃO ITEM': 'Descrição item', 'DESCRICAO ITEM': 'Descrição item',
-        'NCM': 'NCM',
-        'ALIQ ICMS': 'Aliq. ICMS', 'ALIQUOTA ICMS': 'Aliq. ICMS',
-        'TRIBUTAÇÃO': 'TRIBUTACAO', 'TRIBUTACAO': 'TRIBUTACAO',
-        'CEST': 'CEST'
-    }
-    df.rename(columns=col_mapping_audit, inplace=True)
-
-    if 'Aliq. ICMS' not in df.columns:
-        df['Aliq. ICMS'] = ''
-    else:
-        df['Aliq. ICMS'] = df['Aliq. ICMS'].astype(str).str.strip()
-
-    # Usa o nome padronizado sem Ç
-    if 'TRIBUTACAO' not in df.columns:
-        df['TRIBUTACAO'] = ''
-    else:
-        df['TRIBUTACAO'] = df['TRIBUTACAO'].astype(str).str.strip()
-
-    if 'CEST' not in df.columns:
-        df['CEST'] = '0'
-    df['CEST'] = df['CEST'].apply(clean_cest)
-
-    # Inicializa colunas de controle
-    df['NCM Alterado'] = False
-    df['Aliq. ICMS Alterado'] = False
-    df['TRIBUTACAO Alterado'] = False # Nome interno sem Ç
-    df['CEST Alterado'] = False
-    df['ITEM CONSIDERADO'] = ''
-    df['SIMILARIDADE'] = 0.0
-
-    # Itera sobre cada linha da planilha de auditoria
-    for i, row in df.iterrows():
-        desc_item = str(row.get('Descrição item', '')).strip().lower()
-        if not desc_item:
-            continue
-
-        ncm_item = str(row.get('NCM', '')).strip()
-        aliq_item = str(row.get('Aliq. ICMS', '')).strip()
-        trib_item = str(row.get('TRIBUTACAO', '')).strip() # Usa nome sem Ç
-        cest_item = str(row.get('CEST', '0')).strip()
-
-        palavras_item = get_keywords(desc_item)
-        melhor_match = None
-        max_score = -1
-        match_type = "Nenhum"
-
-        # 1. Procura por correspondência exata na descrição (case-insensitive)
-        # Cria um mapeamento desc_lower -> desc_original para buscar
-        configs_lower = {k.lower(): k for k in configs.keys()}
-        if desc_item in configs_lower:
-             original_desc = configs_lower[desc_item]
-             melhor_match = original_desc
-             max_score = 100
-             match_type = "Descrição Exata"
-
-        # 2. Se não encontrou exata, procura por palavras-chave ou NCM
-        if not melhor_match:
-            for desc_base, values in configs.items():
-                desc_base_clean = desc_base.strip().lower()
-                palavras_base = get_keywords(desc_base_clean)
-                palavras_iguais = palavras_item & palavras_base
-                ncm_base = str(values.get('NCM', '')).strip()
-
-                # Considera match se tiver >= 2 palavras iguais OU NCM igual (e não vazio)
-                if len(palavras_iguais) >= 2 or (ncm_base and ncm_base == ncm_item):
-                    score_atual = len(palavras_iguais) * 10 + (50 if ncm_base and ncm_base == ncm_item else 0)
-                    if score_atual > max_score:
-                        max_score = score_atual
-                        melhor_match = desc_base
-                        match_type = "Palavras/NCM"
-
-        # 3. Se ainda não encontrou, usa fuzzy matching
-        if not melhor_match:
-            for desc_base, values in configs.items():
-                desc_base_clean = desc_base.strip().lower()
-                score = fuzz.ratio(desc_item, desc_base_clean)
-                # Limiar de similaridade - pode ser ajustado
-                similarity_threshold = 70
-                if score >= similarity_threshold and score > max_score:
-                    max_score = score
-                    melhor_match = desc_base
-                    match_type = f"Similaridade ({score}%)"
-
-        # Se encontrou um melhor match por qualquer método
-        if melhor_match:
-            valores_base = configs[melhor_match]
-            ncm_base = str(valores_base.get('NCM', '')).strip()
-            aliq_base = str(valores_base.get('ALIQ_ICMS', '')).strip()
-            trib_base = str(valores_base.get('TRIBUTACAO', '')).strip() # Usa nome sem Ç
-            cest_base = clean_cest(valores_base.get('CEST', '0'))
-
-            # Compara e atualiza os campos, marcando as alterações
-            if ncm_item != ncm_base:
-                df.at[i, 'NCM'] = ncm_base
-                df.at[i, 'NCM Alterado'] = True
-            if aliq_item != aliq_base:
-                df.at[i, 'Aliq. ICMS'] = aliq_base
-                df.at[i, 'Aliq. ICMS Alterado'] = True
-            if trib_item != trib_base:
-                df.at[i, 'TRIBUTACAO'] = trib_base # Atualiza coluna sem Ç
-                df.at[i, 'TRIBUTACAO Alterado'] = True
-            if cest_item != cest_base:
-                df.at[i, 'CEST'] = cest_base
-                df.at[i, 'CEST Alterado'] = True
-
-            df.at[i, 'ITEM CONSIDERADO'] = f'{match_type}: {melhor_match}'
-            df.at[i, 'SIMILARIDADE'] = max_score
+        metricas.log(METRICS_LOG_FILE, evento=evento, **extra)
+    except OSError as e:
+        logging.getLogger(__name__).warning("Não foi possível gravar as métricas em '%s': %s", METRICS_LOG_FILE, e)
+
+def _exportar_resultado(funcao, result_df, base_index, *args):
+    """Gera a exportação a partir do resultado compacto; os textos (export_frame) são montados na thread."""
+    return funcao(export_frame(result_df, base_index), *args)
+
+def _exportar_medindo(metricas, etapa, funcao, *args, **extra):
+    """Submete a exportação ao pool medindo seu tempo e registrando as métricas ao terminar."""
+    futuro = export_pool.submit(metricas.timed, etapa, funcao, *args)
+    futuro.add_done_callback(lambda _: _registrar_metricas(metricas, etapa, **extra))
+    return futuro
+
+ROTULOS_METRICAS = {
+    'espera_fila': "Espera na fila",
+    'leitura_planilha': "Leitura da planilha",
+    'indice_base': "Índice da base",
+    'indice_similaridade': "Índice TF-IDF",
+    'indice_ncm': "Índice de prefixos de NCM",
+    'preparacao': "Preparação das colunas",
+    'exata': "Correspondência exata",
+    'palavras_ncm': "Palavras/NCM",
+    'similaridade': "Similaridade",
+    'gravacao_resultados': "Gravação dos resultados",
+    'auditoria': "Auditoria (total)",
+    'exportacao_excel': "Exportação Excel",
+    'exportacao_pdf': "Exportação PDF",
+    'exportacao_pdf_alterados': "Exportação PDF (só alteradas)",
+}
+
+def mostrar_metricas(metricas):
+    """Painel com o tempo por etapa, os contadores e as linhas mais lentas da auditoria."""
+    dados = metricas.to_dict()
+    with st.expander("⏱️ Métricas da auditoria"):
+        st.markdown("**Tempo por etapa**")
+        st.dataframe(pd.DataFrame({
+            'Etapa': [ROTULOS_METRICAS.get(etapa, etapa) for etapa in dados['etapas']],
+            'Segundos': [round(segundos, 4) for segundos in dados['etapas'].values()],
+        }), hide_index=True, use_container_width=True)
+        st.caption("As etapas de correspondência somam o tempo de cada linha (no modo paralelo, de todos os processos).")
+        st.markdown("**Contadores**")
+        st.dataframe(pd.DataFrame({'Contador': list(dados['contadores']), 'Valor': list(dados['contadores'].values())}),
+                     hide_index=True, use_container_width=True)
+        if dados['linhas_mais_lentas']:
+            st.markdown("**Linhas mais lentas**")
+            st.dataframe(pd.DataFrame({
+                'Linha na planilha': [linha['linha'] + 2 for linha in dados['linhas_mais_lentas']], # +1 cabeçalho, +1 base 1
+                'Milissegundos': [round(linha['segundos'] * 1000, 3) for linha in dados['linhas_mais_lentas']],
+                'Descrição': [linha['descricao'] for linha in dados['linhas_mais_lentas']],
+            }), hide_index=True, use_container_width=True)
+        st.download_button("📥 Baixar métricas (JSON)", data=json.dumps(dados, ensure_ascii=False, indent=2),
+                           file_name="metricas_auditoria.json", mime="application/json", key='download_metricas')
+
+ROTULOS_ETAPAS = {
+    MATCH_EXATO: "Exata",
+    MATCH_PALAVRAS: "Palavras/NCM",
+    MATCH_SIMILARIDADE: "Similaridade",
+    MATCH_NENHUM: "Sem correspondência",
+}
+
+METODOS_SIMILARIDADE = {"Fuzzy (fuzz.ratio)": SIMILARITY_FUZZY, "TF-IDF de n-gramas": SIMILARITY_TFIDF}
+
+def tabela_alternativas(estado, result_df, k=ALTERNATIVES_K):
+    """Linhas sem correspondência exata com os `k` itens da base mais próximos (cosseno TF-IDF).
+
+    O item já considerado na linha não é repetido entre as alternativas. A descrição
+    exibida é a da planilha, como em `result_df`; `estado` guarda só a forma em minúsculas.
+    """
+    base = estado.base_index
+    linhas = np.flatnonzero(np.isin(estado.tipos, LOW_CONFIDENCE_TYPES))
+    descs, inverso = np.unique(np.array([estado.descs_item[i] for i in linhas], dtype=object), return_inverse=True)
+    posicoes, scores = match_alternatives(descs.tolist(), base, k + 1) # Cada descrição distinta uma vez
+    posicoes, scores = posicoes[inverso], scores[inverso]
+    escolhidas = estado.posicoes[linhas]
+    alternativas = {f'Alternativa {n}': [] for n in range(1, k + 1)}
+    for pos_linha, scores_linha, escolhida in zip(posicoes.tolist(), scores.tolist(), escolhidas.tolist()):
+        textos = [f'{base.descs[pos]} ({score}%)' for pos, score in zip(pos_linha, scores_linha)
+                  if pos >= 0 and pos != escolhida][:k]
+        for n, coluna in enumerate(alternativas.values()):
+            coluna.append(textos[n] if n < len(textos) else '')
+    return pd.DataFrame({
+        'Linha na planilha': linhas + 2, # +1 cabeçalho, +1 base 1
+        'Descrição item': result_df['Descrição item'].to_numpy()[linhas],
+        'Correspondência': [ROTULOS_ETAPAS[tipo] for tipo in estado.tipos[linhas].tolist()],
+        'Item considerado': [base.descs[pos] if pos >= 0 else '' for pos in escolhidas.tolist()],
+        **alternativas,
+    })
+
+def auditar_em_segundo_plano(job, planilha, nome, chave_cache, workers, similarity_method, ncm_prefix):
+    """Tarefa da fila: lê e audita a planilha, inicia a exportação Excel e guarda o resultado no cache.
+
+    Roda em uma thread de trabalho, sem acesso à interface: o andamento vai para
+    job.report(). Cancelada, levanta JobCancelled com o resultado parcial (blocos já
+    auditados). O resultado vai para o cache com a impressão digital da base auditada;
+    só é devolvido se ela não for a de `chave_cache` (a base mudou enquanto a tarefa
+    esperava na fila), senão None: o histórico da fila não segura cópias fora do
+    limite de bytes do cache.
+    """
+    workers = min(workers, JOB_PROCESSES) # O limite vale mesmo para um valor vindo de fora do campo da interface
+    metricas = AuditMetrics()
+    metricas.add_time('espera_fila', job.iniciada - job.criada)
+    with metricas.stage('leitura_planilha'):
+        audit_df = read_table(planilha, nome)
+    if 'Descrição item' not in audit_df.columns:
+        raise ValueError("A planilha de auditoria deve conter a coluna 'Descrição item'.")
+
+    # A base é compartilhada entre sessões: as alterações da Aba 1 esperam o fim desta auditoria
+    with config_store.base_lock.reading():
+        # Difere de chave_cache[1] se a base mudou enquanto a tarefa esperava na fila
+        auditada = base_index.fingerprint()
+        anterior = audit_cache.find_previous(chave_cache[0], base_index, similarity_method, ncm_prefix)
+        if anterior is not None:
+            # Mesma planilha já auditada antes de alterações na base: só as linhas afetadas
+            with metricas.stage('auditoria'):
+                result_df, estado, reprocessadas = reaudit_planilha(audit_df, anterior['result_df'],
+                                                                    anterior['estado'], metricas)
         else:
-            df.at[i, 'ITEM CONSIDERADO'] = 'Nenhuma correspondência encontrada'
-            df.at[i, 'SIMILARIDADE'] = 0
-
-    return df
-
-def aplicar_destaque_excel(df, filename):
-    """Salva o DataFrame em Excel com destaque nas células alteradas."""
-    try:
-        # Cria uma cópia para não modificar o DataFrame original que pode ser usado em outro lugar
-        df_copy = df.copy()
-
-        # Renomeia a coluna de tributação para exibição no Excel (com Ç)
-        if 'TRIBUTACAO' in df_copy.columns:
-             df_copy.rename(columns={'TRIBUTACAO': 'TRIBUTAÇÃO'}, inplace=True)
-
-        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-            # Remove colunas de controle antes de salvar no Excel
-            cols_to_drop = ['NCM Alterado', 'Aliq. ICMS Alterado', 'TRIBUTACAO Alterado', 'CEST Alterado', 'SIMILARIDADE']
-            df_final_excel = df_copy.drop(columns=[col for col in cols_to_drop if col in df_copy.columns], errors='ignore')
-
-            df_final_excel.to_excel(writer, index=False, sheet_name='Resultado Auditoria')
-            workbook = writer.book
-            worksheet = writer.sheets['Resultado Auditoria']
-
-            yellow_fill = PatternFill(start_color='FFFFFF00', end_color='FFFFFF00', fill_type='solid')
-
-            # Encontra os índices das colunas pelo nome *no DataFrame original* (df)
-            # porque precisamos dos dados das colunas 'Alterado'
-            cols_orig = {col_name: idx + 1 for idx, col_name in enumerate(df.columns)}
-            # Encontra os índices das colunas *no DataFrame final do Excel* (df_final_excel)
-            cols_excel = {col_name: idx + 1 for idx, col_name in enumerate(df_final_excel.columns)}
-
-            # Itera pelas linhas do DataFrame original (df) para checar alterações
-            for row_idx, row_data in df.iterrows():
-                excel_row = row_idx + 2 # +1 para 1-based index, +1 para pular cabeçalho
-
-                if row_data.get('NCM Alterado', False):
-                    if 'NCM' in cols_excel:
-                        worksheet.cell(row=excel_row, column=cols_excel['NCM']).fill = yellow_fill
-                if row_data.get('Aliq. ICMS Alterado', False):
-                    if 'Aliq. ICMS' in cols_excel:
-                        worksheet.cell(row=excel_row, column=cols_excel['Aliq. ICMS']).fill = yellow_fill
-                if row_data.get('TRIBUTACAO Alterado', False):
-                    # Destaca a coluna 'TRIBUTAÇÃO' (com Ç) no Excel
-                    if 'TRIBUTAÇÃO' in cols_excel:
-                        worksheet.cell(row=excel_row, column=cols_excel['TRIBUTAÇÃO']).fill = yellow_fill
-                if row_data.get('CEST Alterado', False):
-                    if 'CEST' in cols_excel:
-                        worksheet.cell(row=excel_row, column=cols_excel['CEST']).fill = yellow_fill
-
-        st.info(f"Arquivo Excel '{filename}' gerado com destaque.")
-    except Exception as e:
-        st.error(f"Erro ao gerar arquivo Excel com destaque: {str(e)}")
-
-def export_to_pdf(df, filename):
-    """Exporta o DataFrame para um arquivo PDF simples."""
-    try:
-        # Cria uma cópia e renomeia TRIBUTACAO para TRIBUTAÇÃO para o PDF
-        df_pdf = df.copy()
-        if 'TRIBUTACAO' in df_pdf.columns:
-            df_pdf.rename(columns={'TRIBUTACAO': 'TRIBUTAÇÃO'}, inplace=True)
-
-        c = canvas.Canvas(filename, pagesize=letter)
-        width, height = letter
-        margin = 40 # Reduzido um pouco a margem
-        y_position = height - margin
-        line_height = 11 # Reduzido um pouco
-
-        # Cabeçalho do PDF
-        c.setFont("Helvetica-Bold", 9)
-        x_offset = margin
-
-        # Colunas a serem exibidas no PDF (exclui controle)
-        header_names = [col for col in df_pdf.columns if not col.endswith('Alterado') and col != 'SIMILARIDADE']
-
-        # Cálculo dinâmico (e simples) das larguras das colunas
-        available_width = width - 2 * margin
-        # Pesos estimados (ajustar conforme necessidade)
-        weights = {'Descrição item': 3, 'NCM': 1.5, 'CEST': 1, 'Aliq. ICMS': 1, 'TRIBUTAÇÃO': 1, 'ITEM CONSIDERADO': 2.5}
-        total_weight = sum(weights.get(col, 1) for col in header_names)
-        col_widths = {col: (weights.get(col, 1) / total_weight) * available_width for col in header_names}
-
-        # Desenha cabeçalho da tabela
-        current_x = x_offset
-        for col_name in header_names:
-            c.drawString(current_x + 2, y_position, col_name) # Adiciona pequeno padding
-            current_x += col_widths[col_name]
-        y_position -= line_height * 1.5
-
-        # Desenha linhas da tabela
-        c.setFont("Helvetica", 7) # Fonte menor para caber mais
-        for _, row in df_pdf.iterrows():
-            if y_position < margin + line_height:
-                c.showPage()
-                c.setFont("Helvetica-Bold", 9)
-                y_position = height - margin
-                # Redesenha cabeçalho na nova página
-                current_x = x_offset
-                for col_name in header_names:
-                    c.drawString(current_x + 2, y_position, col_name)
-                    current_x += col_widths[col_name]
-                y_position -= line_height * 1.5
-                c.setFont("Helvetica", 7)
-
-            current_x = x_offset
-            max_lines_per_row = 1
-            row_lines_content = {} # Armazena linhas quebradas por coluna
-
-            # Prepara o conteúdo das células, quebrando linhas se necessário
-            for col_name in header_names:
-                cell_value = str(row.get(col_name, ''))
-                col_width_pixels = col_widths[col_name] - 4 # Largura útil com padding
-                avg_char_width = 4 # Estimativa grosseira da largura do caractere
-                max_chars_per_line = int(col_width_pixels / avg_char_width)
-
-                lines = []
-                if max_chars_per_line > 0:
-                    import textwrap
-                    lines = textwrap.wrap(cell_value, width=max_chars_per_line, break_long_words=True, max_lines=5) # Limita a 5 linhas por célula
-                else:
-                    lines = [cell_value[:10] + '...' if len(cell_value) > 10 else cell_value] # Fallback
-
-                row_lines_content[col_name] = lines
-                max_lines_per_row = max(max_lines_per_row, len(lines))
-
-            # Desenha as linhas da célula atual (pode ocupar múltiplas linhas no PDF)
-            initial_y = y_position
-            for line_num in range(max_lines_per_row):
-                current_x = x_offset
-                y_line_pos = initial_y - (line_num * line_height * 0.9) # Espaçamento entre linhas dentro da célula
-                for col_name in header_names:
-                    lines = row_lines_content[col_name]
-                    if line_num < len(lines):
-                        c.drawString(current_x + 2, y_line_pos, lines[line_num])
-                    current_x += col_widths[col_name]
-
-            y_position = initial_y - (max_lines_per_row * line_height * 0.9) - (line_height * 0.3) # Espaço extra entre linhas da tabela
-
-        c.save()
-        st.info(f"Arquivo PDF '{filename}' gerado.")
-    except ImportError:
-        st.error("Erro ao gerar PDF: A biblioteca 'textwrap' não foi encontrada. PDF não gerado.")
-    except Exception as e:
-        st.error(f"Erro ao gerar arquivo PDF: {str(e)}")
-
-# --- Interface Streamlit --- 
-
-# Carregar configurações iniciais
-configs = load_configurations()
+            estado = AuditState()
+            reprocessadas = None
+            blocos = []
+            with metricas.stage('auditoria'), \
+                    closing(iter_process_planilha(audit_df, configs, base_index, workers=workers, metricas=metricas,
+                                                  estado=estado, similarity_method=similarity_method,
+                                                  ncm_prefix=ncm_prefix)) as progresso_auditoria:
+                for progresso in progresso_auditoria:
+                    blocos.append(progresso.bloco)
+                    job.report(progresso)
+                    if job.cancel_requested:
+                        # Só para a prévia e o download: já no layout de exportação
+                        raise JobCancelled({'parcial': export_frame(concat_results(blocos), base_index),
+                                            'processadas': progresso.processadas,
+                                            'total': progresso.total})
+            result_df = concat_results(blocos)
+        _registrar_metricas(metricas, 'auditoria', arquivo=nome, linhas=len(result_df), processos=workers)
+
+        # O Excel é gerado em memória, em segundo plano, enquanto a prévia é exibida
+        resultado = {
+            'result_df': result_df,
+            'tamanho': int(result_df.memory_usage(deep=True).sum()) + estado.memory_usage(),
+            'excel': _exportar_medindo(metricas, 'exportacao_excel', _exportar_resultado, excel_download, result_df,
+                                       estado.base_index, arquivo=nome),
+            'pdfs': {}, # Modo do PDF (só linhas alteradas?) -> Future, gerado sob demanda
+            'metricas': metricas,
+            'arquivo': nome,
+            'estado': estado, # Permite reauditar só as linhas afetadas após alterações na base
+            'reprocessadas': reprocessadas, # None: auditoria completa
+            'alternativas': None, # DataFrame de tabela_alternativas, montado sob demanda
+            'base': auditada, # Impressão digital da base auditada
+        }
+    # Guardado com a impressão digital da base realmente auditada
+    chave_auditada = (chave_cache[0], auditada, *chave_cache[2:])
+    audit_cache.put(chave_auditada, resultado)
+    return None if chave_auditada == chave_cache else resultado # Senão a interface não o acharia pela chave da tarefa
+
+TASK_REFRESH_SECONDS = 1.0 # Intervalo de atualização do andamento de uma auditoria em segundo plano
+
+@st.fragment(run_every=TASK_REFRESH_SECONDS)
+def acompanhar_tarefa(job_id):
+    """Andamento da auditoria em segundo plano; recarrega a página quando ela termina."""
+    tarefa = job_queue.get(job_id)
+    if tarefa is None or tarefa.finished:
+        st.rerun()
+    if tarefa.status == JOB_QUEUED:
+        posicao = job_queue.position(tarefa)
+        st.info(f"⏳ Auditoria na fila: {posicao} tarefa(s) antes desta." if posicao
+                else "⏳ Auditoria na fila: será a próxima a ser iniciada.")
+    elif tarefa.progresso is None:
+        st.progress(0.0, text="Processando auditoria...")
+    else:
+        progresso = tarefa.progresso
+        decorrido = time.time() - tarefa.iniciada
+        linhas_por_segundo = progresso.processadas / decorrido if decorrido > 0 else 0.0
+        restante = (progresso.total - progresso.processadas) / linhas_por_segundo if linhas_por_segundo else 0.0
+        fracao = progresso.processadas / progresso.total if progresso.total else 1.0
+        st.progress(fracao, text=f"Processando auditoria... {progresso.processadas}/{progresso.total} linhas")
+        etapas = " · ".join(f"{rotulo}: {progresso.contagens[tipo]}" for tipo, rotulo in ROTULOS_ETAPAS.items())
+        st.markdown(f"⏱️ {linhas_por_segundo:,.0f} linhas/s · tempo restante estimado: {restante:,.0f} s  \n{etapas}")
+    st.button("⏹️ Cancelar auditoria", key='cancelar_auditoria', on_click=job_queue.cancel, args=(job_id,))
+    st.caption("A auditoria roda em segundo plano: é possível recarregar a página, que o andamento e o "
+               "resultado continuam disponíveis neste endereço.")
+
+def _reiniciar_auditoria():
+    st.query_params.pop('tarefa', None)
+
+def mostrar_auditoria_cancelada(tarefa):
+    """Mostra o resultado parcial de uma auditoria cancelada e permite baixá-lo ou reiniciar."""
+    parcial = tarefa.resultado or {'parcial': None, 'processadas': 0, 'total': 0}
+    st.warning(f"⏹️ Auditoria cancelada: {parcial['processadas']} de {parcial['total']} linhas processadas.")
+    if parcial['parcial'] is not None:
+        partial_df = parcial['parcial']
+        st.dataframe(partial_df.head(50), use_container_width=True)
+        st.caption("Prévia das primeiras 50 linhas do resultado parcial.")
+        try:
+            dados, nome, mime = excel_download(partial_df, "resultado_auditoria_parcial.xlsx")
+            st.download_button(
+                label="📥 Baixar Resultado Parcial (Excel)",
+                data=dados,
+                file_name=nome,
+                mime=mime,
+                key='download_excel_parcial'
+            )
+        except Exception as e:
+            st.error(f"Erro ao gerar arquivo Excel com destaque: {str(e)}")
+    st.button("🔄 Reiniciar auditoria", key='reiniciar_auditoria', on_click=_reiniciar_auditoria)
+
+def sessao_navegador():
+    """Id da sessão do navegador, guardado na URL para sobreviver ao recarregamento da página."""
+    if 'sessao' not in st.query_params:
+        st.query_params['sessao'] = uuid.uuid4().hex
+    return st.query_params['sessao']
+
+
+MODOS_BUSCA = {"Contém": 'contains', "Começa com": 'prefix', "Prefixo de NCM": 'ncm_prefix',
+               "Faixa de NCM": 'ncm_range'} # Rótulo -> método do SearchIndex
+ITENS_POR_PAGINA = 100
+
+def base_page_frame(base_index, posicoes):
+    """DataFrame só com os itens `posicoes` da base, com os nomes de coluna da interface."""
+    posicoes = posicoes.tolist()
+    return pd.DataFrame({
+        'Descrição item': [base_index.descs[pos] for pos in posicoes],
+        'NCM': [base_index.ncms[pos] for pos in posicoes],
+        'CEST': [base_index.cests[pos] for pos in posicoes],
+        'Aliq. ICMS': [base_index.aliqs[pos] for pos in posicoes],
+        'TRIBUTAÇÃO': [base_index.tributacoes[pos] for pos in posicoes],
+    })
+
+
+# Base de configurações e índices: carregados uma vez por processo e recarregados só se o arquivo mudar
+config_store = get_config_store()
+configs, base_index = config_store.get()
+audit_cache = get_audit_cache()
+export_pool = get_export_pool()
+job_queue = get_job_queue()
 
 # Informações de status na barra lateral
 st.sidebar.write("### Status do Sistema")
@@ -468,53 +448,35 @@ tab1, tab2, tab3 = st.tabs(["🟩 1. Adicionar/Atualizar Base", "📋 2. Ver Bas
 # Aba 1 - Adicionar/Atualizar Base Auditada
 with tab1:
     st.header("1. Adicionar ou Atualizar Base de Configurações")
-    st.markdown("Envie uma planilha Excel (`.xlsx`) auditada para adicionar novos itens ou atualizar existentes na base de configurações.")
-    uploaded_base = st.file_uploader("Selecione a planilha auditada", type=['xlsx'], key='base_uploader')
+    st.markdown("Envie uma planilha (`.xlsx`, `.csv` ou `.parquet`) auditada para adicionar novos itens ou atualizar existentes na base de configurações.")
+    uploaded_base = st.file_uploader("Selecione a planilha auditada", type=SUPPORTED_EXTENSIONS, key='base_uploader')
 
-    if uploaded_base:
+    if 'mensagem_base' in st.session_state:
+        st.success(st.session_state.pop('mensagem_base'))
+
+    # O arquivo continua no uploader após o st.rerun(): processa cada upload uma única vez
+    if uploaded_base and st.session_state.get('base_processada') != uploaded_base.file_id:
         try:
-            base_df = pd.read_excel(uploaded_base, dtype={'NCM': str, 'CEST': str})
-            # Padroniza nomes de coluna do upload
-            base_df.columns = base_df.columns.str.strip().str.replace('"', '', regex=False).str.replace('\n', '', regex=False).str.replace('\r', '', regex=False).str.upper()
-            base_df.columns = base_df.columns.str.replace('.', '', regex=False)
-            col_mapping_upload = {
-                'DESCRIÇÃO ITEM': 'Descrição item', 'DESCRICAO ITEM': 'Descrição item',
-                'NCM': 'NCM',
-                'ALIQ ICMS': 'Aliq. ICMS', 'ALIQUOTA ICMS': 'Aliq. ICMS',
-                'TRIBUTAÇÃO': 'TRIBUTACAO', 'TRIBUTACAO': 'TRIBUTACAO',
-                'CEST': 'CEST'
-            }
-            base_df.rename(columns=col_mapping_upload, inplace=True)
-
-            required_cols = ['Descrição item', 'NCM', 'Aliq. ICMS']
-            missing_cols = [col for col in required_cols if col not in base_df.columns]
+            base_df = read_table(uploaded_base, colunas=BASE_COLUMNS)
+
+            missing_cols = [col for col in BASE_REQUIRED_COLUMNS if col not in base_df.columns]
             if missing_cols:
-                 st.error(f"Erro: A planilha enviada deve conter as colunas: {', '.join(required_cols)}. Colunas ausentes ou não reconhecidas: {', '.join(missing_cols)}")
+                 st.error(f"Erro: A planilha enviada deve conter as colunas: {', '.join(BASE_REQUIRED_COLUMNS)}. Colunas ausentes ou não reconhecidas: {', '.join(missing_cols)}")
             else:
-                itens_adicionados = 0
-                itens_atualizados = 0
-                for _, row in base_df.iterrows():
-                    desc = str(row['Descrição item']).strip()
-                    if not desc: continue
-
-                    ncm = str(row['NCM']).strip() if pd.notna(row['NCM']) else ''
-                    aliq = str(row['Aliq. ICMS']).strip()
-                    trib = str(row.get('TRIBUTACAO', aliq)).strip() # Usa nome sem Ç
-                    cest = clean_cest(row.get('CEST', '0'))
-
-                    if desc in configs:
-                        itens_atualizados += 1
-                    else:
-                        itens_adicionados += 1
-
-                    configs[desc] = {'NCM': ncm, 'ALIQ_ICMS': aliq, 'TRIBUTACAO': trib, 'CEST': cest}
-
-                save_all_configurations(configs)
-                st.success(f"✅ Base atualizada com sucesso! Itens adicionados: {itens_adicionados}, Itens atualizados: {itens_atualizados}. Total na base: {len(configs)}.")
-                st.sidebar.write(f"Itens na base de configurações: {len(configs)}")
-                # Limpa o uploader para permitir novo upload sem recarregar a página manualmente
-                # st.session_state.base_uploader = None # Pode causar problemas dependendo da versão do Streamlit
-                st.rerun()
+                registros = base_records(base_df)
+                # A base é compartilhada entre sessões: atualiza sob o lock do ConfigStore
+                # base_lock antes do lock: à espera das auditorias, não bloqueia as outras sessões (ConfigStore.get)
+                with st.spinner("Atualizando a base (aguarda as auditorias em andamento)..."), \
+                        config_store.base_lock.writing(), config_store.lock:
+                    itens_adicionados, itens_atualizados, alterados = upsert_records(configs, base_index, registros)
+                    if alterados:
+                        # Grava só os itens alterados; a compactação roda em segundo plano
+                        config_store.storage.append(alterados, base_index)
+                        # Os resultados em cache continuam lá: a chave inclui a impressão digital da base,
+                        # e a próxima auditoria da mesma planilha os usa para reprocessar só as linhas afetadas
+                st.session_state['base_processada'] = uploaded_base.file_id
+                st.session_state['mensagem_base'] = f"✅ Base atualizada com sucesso! Itens adicionados: {itens_adicionados}, Itens atualizados: {itens_atualizados}. Total na base: {len(configs)}."
+                st.rerun() # Atualiza a contagem de itens na barra lateral
 
         except Exception as e:
             st.error(f"Erro ao processar a planilha enviada: {str(e)}")
@@ -529,118 +491,187 @@ with tab2:
     else:
         search_term = st.text_input("🔎 Pesquisar por Descrição, NCM, CEST ou Tributação", key='search_base')
         show_all = st.checkbox("👁️ Mostrar toda a base", key='show_all_base')
-
-        if configs:
-            df_base = pd.DataFrame.from_dict(configs, orient='index')
-            df_base = df_base.reset_index().rename(columns={'index': 'Descrição item'})
-            # --- Correção da Exibição da Tributação ---
-            # Garante que a coluna TRIBUTACAO (sem Ç) seja selecionada e renomeada para exibição
-            display_cols_internal = ['Descrição item', 'NCM', 'CEST', 'ALIQ_ICMS', 'TRIBUTACAO']
-            # Seleciona apenas colunas existentes no DataFrame
-            cols_to_display = [col for col in display_cols_internal if col in df_base.columns]
-            df_display = df_base[cols_to_display]
-            # Renomeia TRIBUTACAO para TRIBUTAÇÃO para melhor leitura na interface
-            if 'TRIBUTACAO' in df_display.columns:
-                df_display = df_display.rename(columns={'TRIBUTACAO': 'TRIBUTAÇÃO'})
-            # Renomeia ALIQ_ICMS para Aliq. ICMS
-            if 'ALIQ_ICMS' in df_display.columns:
-                df_display = df_display.rename(columns={'ALIQ_ICMS': 'Aliq. ICMS'})
-
+        with config_store.base_lock.reading():
+            csv_base = csv_da_base(base_index.fingerprint(), configs)
+        st.download_button(
+            label="📤 Exportar base (CSV)",
+            data=csv_base,
+            file_name=CONFIG_FILE,
+            mime="text/csv",
+            key='download_base_csv'
+        )
+
+        col_modo, col_pagina = st.columns([3, 1])
+        modo_busca = col_modo.radio("Tipo de pesquisa", list(MODOS_BUSCA), horizontal=True, key='modo_busca')
+        if modo_busca == "Faixa de NCM":
+            col_ini, col_fim = st.columns(2)
+            ncm_inicio = col_ini.text_input("NCM inicial", key='ncm_inicio', help="Ex.: 8471 (vale como 84710000)")
+            ncm_fim = col_fim.text_input("NCM final", key='ncm_fim', help="Ex.: 8473 (vale como 84739999)")
+            consulta_ativa = bool(ncm_inicio.strip() or ncm_fim.strip())
         else:
-            df_display = pd.DataFrame(columns=['Descrição item', 'NCM', 'CEST', 'Aliq. ICMS', 'TRIBUTAÇÃO'])
-
-        if search_term:
-            search_term_lower = search_term.lower().strip()
-            # Busca em todas as colunas do df_display
-            mask = df_display.apply(lambda row: any(search_term_lower in str(cell).lower() for cell in row), axis=1)
-            df_filtrada = df_display[mask]
-            st.dataframe(df_filtrada, use_container_width=True)
-            st.caption(f"{len(df_filtrada)} itens encontrados para '{search_term}'.")
-        elif show_all:
-            st.dataframe(df_display, use_container_width=True)
-            st.caption(f"Mostrando todos os {len(df_display)} itens da base.")
+            consulta_ativa = bool(search_term.strip())
+
+        if consulta_ativa or show_all:
+            search_index = config_store.search_index()
+            if not consulta_ativa:
+                posicoes = search_index.all()
+            elif modo_busca == "Faixa de NCM":
+                posicoes = search_index.ncm_range(ncm_inicio, ncm_fim)
+            else:
+                posicoes = getattr(search_index, MODOS_BUSCA[modo_busca])(search_term)
+            pagina = col_pagina.number_input("Página", min_value=1, value=1, step=1, key='pagina_base')
+            posicoes_pagina, total_paginas = SearchIndex.page(posicoes, int(pagina), ITENS_POR_PAGINA)
+            st.dataframe(base_page_frame(base_index, posicoes_pagina), use_container_width=True)
+            if consulta_ativa:
+                st.caption(f"{len(posicoes)} itens encontrados · página {min(int(pagina), total_paginas)} de {total_paginas}.")
+            else:
+                st.caption(f"Mostrando todos os {len(posicoes)} itens da base · página {min(int(pagina), total_paginas)} de {total_paginas}.")
         else:
             st.info("Digite um termo de pesquisa ou marque 'Mostrar toda a base' para ver os dados.")
 
 # Aba 3 - Realizar Auditoria
 with tab3:
     st.header("3. Realizar Auditoria")
-    st.markdown("Envie uma planilha Excel (`.xlsx`) para ser auditada com base nas configurações atuais.")
+    st.markdown("Envie uma planilha (`.xlsx`, `.csv` ou `.parquet`) para ser auditada com base nas configurações atuais.")
 
     if not configs:
         st.warning("⚠️ A base de configurações está vazia. Adicione uma base na Aba 1 primeiro.")
     else:
-        uploaded_audit = st.file_uploader("Selecione a planilha para auditoria", type=['xlsx'], key='audit_uploader')
-
+        uploaded_audit = st.file_uploader("Selecione a planilha para auditoria", type=SUPPORTED_EXTENSIONS, key='audit_uploader')
+        # Processos paralelos para planilhas grandes (1 = modo serial)
+        # Limite por auditoria: as auditorias simultâneas da fila (todas as sessões) dividem as CPUs
+        workers = st.number_input("⚙️ Processos paralelos", min_value=1, max_value=JOB_PROCESSES, value=1,
+                                  step=1, key='audit_workers',
+                                  help="Divide a planilha em blocos processados em paralelo. Use 1 para o modo serial. "
+                                       f"Até {JOB_PROCESSES} por auditoria: as auditorias simultâneas dividem as CPUs.")
+        metodo_similaridade = METODOS_SIMILARIDADE[st.radio(
+            "🧮 Etapa de similaridade", list(METODOS_SIMILARIDADE), horizontal=True, key='metodo_similaridade',
+            help="Como comparar as linhas sem correspondência exata nem por palavras/NCM: fuzz.ratio com cada item "
+                 "da base ou o cosseno TF-IDF de trechos de 3 caracteres, calculado para toda a base de uma vez.")]
+        prefixo_ncm = st.checkbox("🧭 Procurar primeiro entre os itens do mesmo NCM", key='prefixo_ncm',
+                                  help="As etapas Palavras/NCM e de similaridade comparam a linha primeiro com os "
+                                       "itens do mesmo NCM e, sem correspondência, com os da mesma subposição, "
+                                       "posição e capítulo, antes da base inteira.")
+        pdf_somente_alterados = st.checkbox("📄 PDF apenas com as linhas alteradas (resumo)", key='pdf_somente_alterados',
+                                            help=f"Relatórios com mais de {PDF_ROWS_PER_PART} linhas são divididos em partes (.zip).")
+
+        # A auditoria roda na fila de tarefas; o id da tarefa fica na URL para sobreviver ao recarregamento
+        sessao = sessao_navegador()
+        tarefa = job_queue.get(st.query_params.get('tarefa'))
         if uploaded_audit:
+            st.session_state['planilha_enviada'] = True
+        elif st.session_state.pop('planilha_enviada', False):
+            st.query_params.pop('tarefa', None) # Planilha removida do envio nesta sessão
+            tarefa = None
+        if uploaded_audit or tarefa is not None:
             try:
-                audit_df = pd.read_excel(uploaded_audit, dtype={'NCM': str, 'CEST': str})
-                # Padroniza nomes de coluna da auditoria
-                audit_df.columns = audit_df.columns.str.strip().str.replace('"', '', regex=False).str.replace('\n', '', regex=False).str.replace('\r', '', regex=False).str.upper()
-                audit_df.columns = audit_df.columns.str.replace('.', '', regex=False)
-                col_mapping_audit_upload = {
-                    'DESCRIÇÃO ITEM': 'Descrição item', 'DESCRICAO ITEM': 'Descrição item',
-                    'NCM': 'NCM',
-                    'ALIQ ICMS': 'Aliq. ICMS', 'ALIQUOTA ICMS': 'Aliq. ICMS',
-                    'TRIBUTAÇÃO': 'TRIBUTACAO', 'TRIBUTACAO': 'TRIBUTACAO',
-                    'CEST': 'CEST'
-                }
-                audit_df.rename(columns=col_mapping_audit_upload, inplace=True)
-
-                if 'Descrição item' not in audit_df.columns:
-                    st.error("Erro: A planilha de auditoria deve conter a coluna 'Descrição item'.")
+                resultado = None
+                if uploaded_audit:
+                    # Chave do cache: conteúdo do arquivo enviado + impressão digital da base + opções do matching
+                    chave_cache = (hashlib.sha256(uploaded_audit.getvalue()).hexdigest(), base_index.fingerprint(),
+                                   metodo_similaridade, prefixo_ncm)
+                    if tarefa is None or tarefa.chave != chave_cache:
+                        tarefa = job_queue.find(sessao, chave_cache)
+                    concluida = tarefa is not None and tarefa.status == JOB_DONE # Antes de consultar o cache
+                    resultado = audit_cache.get(chave_cache)
+                    if resultado is None and concluida and tarefa.resultado is None:
+                        tarefa = None # Resultado já descartado do cache: audita de novo
+                    if tarefa is None and resultado is None:
+                        tarefa = job_queue.submit(sessao, auditar_em_segundo_plano,
+                                                  io.BytesIO(uploaded_audit.getvalue()), uploaded_audit.name,
+                                                  chave_cache, int(workers), metodo_similaridade, prefixo_ncm,
+                                                  chave=chave_cache)
+                    if tarefa is not None:
+                        st.query_params['tarefa'] = tarefa.id
+                    else:
+                        st.query_params.pop('tarefa', None)
                 else:
-                    progress_bar = st.progress(0, text="Processando auditoria...")
-                    # Processa a planilha (passa a barra de progresso se a função suportar)
-                    # Nota: A função process_planilha atual não tem suporte a barra de progresso.
-                    # Para adicionar, seria necessário passar a barra e atualizá-la dentro do loop.
-                    result_df = process_planilha(audit_df.copy(), configs)
-                    progress_bar.progress(100, text="Auditoria concluída!")
-                    st.success("✅ Auditoria concluída com sucesso!")
-
-                    output_excel_file = "resultado_auditoria.xlsx"
-                    output_pdf_file = "resultado_auditoria.pdf"
-
-                    # Gera Excel com destaque
-                    aplicar_destaque_excel(result_df.copy(), output_excel_file)
-                    # Gera PDF (versão melhorada)
-                    export_to_pdf(result_df.copy(), output_pdf_file)
+                    # Página recarregada: o envio se perdeu, mas a tarefa continua na fila
+                    chave_cache = tarefa.chave
+                    resultado = audit_cache.get(chave_cache)
+
+                if resultado is None:
+                    if not tarefa.finished:
+                        acompanhar_tarefa(tarefa.id)
+                    elif tarefa.status == JOB_DONE:
+                        # Concluída depois da consulta acima: o resultado já foi para o cache
+                        resultado = tarefa.resultado if tarefa.resultado is not None else audit_cache.get(chave_cache)
+                        if resultado is None: # Já saiu do cache; sem o envio, não há o que reauditar
+                            st.query_params.pop('tarefa', None)
+                            st.info("O resultado desta auditoria não está mais em memória. "
+                                    "Envie a planilha novamente para auditá-la.")
+                    elif tarefa.status == JOB_CANCELLED:
+                        mostrar_auditoria_cancelada(tarefa)
+                    else:
+                        st.error(f"Erro ao processar a auditoria: {str(tarefa.erro)}")
+
+                if resultado is not None:
+                    result_df = resultado['result_df']
+                    # PDF só quando pedido; roda no pool junto com o Excel, se este ainda não terminou
+                    pdf_futuro = resultado['pdfs'].get(pdf_somente_alterados)
+                    if pdf_futuro is None and st.session_state.get('pdf_solicitado') == chave_cache:
+                        etapa_pdf = 'exportacao_pdf_alterados' if pdf_somente_alterados else 'exportacao_pdf'
+                        pdf_futuro = _exportar_medindo(resultado['metricas'], etapa_pdf, _exportar_resultado,
+                                                       pdf_download, result_df, resultado['estado'].base_index,
+                                                       pdf_somente_alterados, arquivo=resultado['arquivo'])
+                        resultado['pdfs'][pdf_somente_alterados] = pdf_futuro
 
-                    st.dataframe(result_df.head(50), use_container_width=True)
+                    st.success("✅ Auditoria concluída com sucesso!")
+                    if resultado['base'] != base_index.fingerprint():
+                        st.warning("⚠️ A base de configurações foi alterada depois desta auditoria: o resultado usa "
+                                   "a base anterior. Envie a planilha novamente para auditá-la com a base atual.")
+                    if resultado['reprocessadas'] is not None:
+                        st.caption(f"♻️ Reauditoria incremental: {resultado['reprocessadas']} de {len(result_df)} "
+                                   "linhas reprocessadas após as alterações na base; as demais foram reaproveitadas.")
+
+                    st.dataframe(export_frame(result_df.head(50), resultado['estado'].base_index),
+                                 use_container_width=True)
                     st.caption("Prévia das primeiras 50 linhas do resultado.")
 
                     col1, col2 = st.columns(2)
                     try:
-                        with open(output_excel_file, 'rb') as f_excel:
-                            col1.download_button(
-                                label="📥 Baixar Resultado (Excel)",
-                                data=f_excel,
-                                file_name=output_excel_file,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                key='download_excel'
-                            )
-                    except FileNotFoundError:
-                        col1.error(f"Erro: Não foi possível encontrar {output_excel_file}")
+                        dados, nome, mime = resultado['excel'].result()
+                        col1.download_button(
+                            label="📥 Baixar Resultado (Excel)",
+                            data=dados,
+                            file_name=nome,
+                            mime=mime,
+                            key='download_excel'
+                        )
                     except Exception as e:
-                         col1.error(f"Erro ao preparar download Excel: {e}")
+                        col1.error(f"Erro ao gerar arquivo Excel com destaque: {str(e)}")
 
-                    try:
-                        with open(output_pdf_file, 'rb') as f_pdf:
+                    if pdf_futuro is None:
+                        col2.button("📄 Gerar PDF", key='gerar_pdf', on_click=_solicitar_pdf, args=(chave_cache,))
+                    else:
+                        try:
+                            with st.spinner("Gerando PDF..."):
+                                dados, nome, mime = pdf_futuro.result()
                             col2.download_button(
-                                label="📥 Baixar Resultado (PDF)",
-                                data=f_pdf,
-                                file_name=output_pdf_file,
-                                mime="application/pdf",
+                                label="📥 Baixar Resultado (PDF em partes, .zip)" if nome.endswith('.zip') else "📥 Baixar Resultado (PDF)",
+                                data=dados,
+                                file_name=nome,
+                                mime=mime,
                                 key='download_pdf'
                             )
-                    except FileNotFoundError:
-                        col2.error(f"Erro: Não foi possível encontrar {output_pdf_file}")
-                    except Exception as e:
-                         col2.error(f"Erro ao preparar download PDF: {e}")
+                        except Exception as e:
+                            col2.error(f"Erro ao gerar arquivo PDF: {str(e)}")
+
+                    with st.expander("🔎 Alternativas para as linhas sem correspondência exata"):
+                        st.caption(f"Os {ALTERNATIVES_K} itens da base mais parecidos com cada linha (cosseno TF-IDF), "
+                                   "além do item considerado, para revisar as correspondências de baixa confiança.")
+                        if resultado['alternativas'] is None and st.button("Buscar alternativas",
+                                                                           key='buscar_alternativas'):
+                            with st.spinner("Buscando alternativas..."), config_store.base_lock.reading():
+                                resultado['alternativas'] = tabela_alternativas(resultado['estado'], result_df)
+                        if resultado['alternativas'] is not None:
+                            st.dataframe(resultado['alternativas'], hide_index=True, use_container_width=True)
+
+                    mostrar_metricas(resultado['metricas'])
+
+                    # Atualiza o tamanho com as exportações concluídas (chave da base auditada)
+                    audit_cache.put((chave_cache[0], resultado['base'], *chave_cache[2:]), resultado)
 
             except Exception as e:
                 st.error(f"Erro ao processar a auditoria: {str(e)}")
-                # Limpa a barra de progresso em caso de erro
-                if 'progress_bar' in locals():
-                    progress_bar.empty()
 
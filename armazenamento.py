@@ -0,0 +1,441 @@
+"""Armazenamento binário da base de configurações.
+
+A base é gravada como um arquivo .npz colunar: descrições em tabela de strings
+(UTF-8 + offsets), NCM/alíquota/tributação/CEST codificados em dicionário e os
+dados derivados do BaseIndex (descrições normalizadas e palavras-chave) já
+prontos, de modo que a carga não precisa reprocessar o texto de cada item.
+O CSV continua sendo o formato de importação/exportação.
+
+As gravações do dia a dia são incrementais (BaseStorage): cada upsert é
+acrescentado a um journal (JSON lines) ao lado do snapshot, e o snapshot é
+regravado (compactação) em segundo plano quando o journal cresce.
+"""
+import csv
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+from auditoria import BaseIndex, ConfigsView, clean_cest, normalize_description
+
+BINARY_FORMAT_VERSION = 1
+JOURNAL_SUFFIX = '.log' # Journal de upserts gravado ao lado do snapshot
+COMPACTION_MIN_ENTRIES = 2000 # Entradas mínimas no journal para disparar a compactação
+COMPACTION_RATIO = 0.2 # ... e proporção mínima em relação ao tamanho da base
+
+logger = logging.getLogger(__name__)
+
+# --- Correção do Limite de Campo CSV ---
+# Aumenta o limite do tamanho do campo para evitar erros com células grandes no CSV.
+# Usar sys.maxsize pode consumir muita memória se um campo for extremamente grande.
+# Um limite grande e fixo pode ser uma alternativa, mas sys.maxsize é a abordagem comum.
+def _ajustar_limite_csv():
+    max_int = sys.maxsize
+    while True:
+        # Diminui o max_int até que funcione
+        try:
+            csv.field_size_limit(max_int)
+            return
+        except OverflowError:
+            max_int = int(max_int / 10)
+
+_ajustar_limite_csv()
+
+def read_configurations_csv(path):
+    """Lê a base no layout de 'configuracoes.csv' (Descrição, NCM, Aliq. ICMS, Tributação[, CEST]).
+
+    Retorna (configs, delimitador_detectado). A primeira linha é o cabeçalho; linhas
+    com menos de 4 colunas são ignoradas e, sem a coluna CEST, o CEST é '0'.
+    """
+    configs = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            sample = f.read(2048) # Ler uma amostra maior pode ajudar
+            dialect = csv.Sniffer().sniff(sample)
+            delimitador_detectado = True
+        except csv.Error:
+            dialect = csv.excel # Usa um dialeto padrão
+            delimitador_detectado = False
+        f.seek(0)
+
+        reader = csv.reader(f, dialect)
+        next(reader, None) # Pula o cabeçalho se existir
+        for row in reader:
+            if len(row) >= 5: # Espera 5 colunas: Desc, NCM, ALIQ, TRIB, CEST
+                cest_val = clean_cest(row[4])
+            elif len(row) == 4: # Caso antigo sem CEST explícito
+                cest_val = '0'
+            else:
+                continue
+            configs[row[0].strip()] = {
+                'NCM': row[1].strip(),
+                'ALIQ_ICMS': row[2].strip(),
+                'TRIBUTACAO': row[3].strip(), # Padronizado sem Ç
+                'CEST': cest_val
+            }
+    return configs, delimitador_detectado
+
+def write_configurations_csv(configs, f):
+    """Escreve as configurações em formato CSV no arquivo aberto `f`, garantindo que CEST esteja limpo."""
+    writer = csv.writer(f)
+    # Escreve o cabeçalho (usando nomes consistentes)
+    writer.writerow(['Descrição item', 'NCM', 'Aliq. ICMS', 'TRIBUTACAO', 'CEST'])
+    for desc, values in configs.items():
+        ncm = str(values.get('NCM', '')).strip()
+        aliq = str(values.get('ALIQ_ICMS', '')).strip()
+        trib = str(values.get('TRIBUTACAO', '')).strip() # Salva sem Ç
+        cest = clean_cest(values.get('CEST', '0'))
+        writer.writerow([desc, ncm, aliq, trib, cest])
+
+def _tabela_strings(valores):
+    """Codifica uma lista de strings como (bytes UTF-8 concatenados, offsets)."""
+    codificados = [valor.encode('utf-8') for valor in valores]
+    offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, codificados), dtype=np.int64, count=len(codificados)), out=offsets[1:])
+    return np.frombuffer(b''.join(codificados), dtype=np.uint8), offsets
+
+def _ler_tabela_strings(dados, offsets):
+    bruto = dados.tobytes()
+    limites = offsets.tolist()
+    return [bruto[inicio:fim].decode('utf-8') for inicio, fim in zip(limites[:-1], limites[1:])]
+
+def _coluna_dicionario(valores):
+    """Codifica uma coluna de baixa cardinalidade como (códigos int32, valores distintos)."""
+    distintos = {}
+    codigos = np.fromiter((distintos.setdefault(valor, len(distintos)) for valor in valores),
+                          dtype=np.int32, count=len(valores))
+    return codigos, list(distintos)
+
+def save_base_binary(base_index, path):
+    """Grava a base indexada em `path` de forma atômica (arquivo temporário + os.replace)."""
+    arrays = {
+        'versao': np.array([BINARY_FORMAT_VERSION], dtype=np.int64),
+        'assinatura': np.array([base_index._assinatura], dtype=np.uint64),
+    }
+    arrays['desc_dados'], arrays['desc_offsets'] = _tabela_strings(base_index.descs)
+    normalizadas = [normalize_description(desc) for desc in base_index.descs]
+    arrays['norm_dados'], arrays['norm_offsets'] = _tabela_strings(normalizadas)
+
+    colunas = {'ncm': base_index.ncms, 'aliq': base_index.aliqs, 'trib': base_index.tributacoes,
+               'cest': base_index.cests}
+    for nome, valores in colunas.items():
+        codigos, distintos = _coluna_dicionario(valores)
+        arrays[f'{nome}_codigos'] = codigos
+        arrays[f'{nome}_dados'], arrays[f'{nome}_offsets'] = _tabela_strings(distintos)
+
+    # Palavras-chave em formato CSR: vocabulário + ids das palavras de cada item
+    vocabulario = {}
+    ids = [vocabulario.setdefault(palavra, len(vocabulario)) for palavras in base_index.palavras for palavra in palavras]
+    arrays['palavras_ids'] = np.asarray(ids, dtype=np.int32)
+    arrays['palavras_ptr'] = np.zeros(len(base_index.palavras) + 1, dtype=np.int64)
+    np.cumsum([len(palavras) for palavras in base_index.palavras], out=arrays['palavras_ptr'][1:])
+    arrays['vocab_dados'], arrays['vocab_offsets'] = _tabela_strings(list(vocabulario))
+
+    _gravar_atomico(path, lambda f: np.savez(f, **arrays))
+
+def _gravar_atomico(path, escrever):
+    """Grava via `escrever(f)` em um temporário no mesmo diretório, faz fsync e substitui `path`."""
+    diretorio = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.base-', suffix='.tmp', dir=diretorio)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            escrever(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def load_base_binary(path):
+    """Lê a base gravada por save_base_binary e retorna (configs, base_index); `configs` é um ConfigsView."""
+    with np.load(path, allow_pickle=False) as arquivo:
+        versao = int(arquivo['versao'][0])
+        if versao != BINARY_FORMAT_VERSION:
+            raise ValueError(f"Versão do arquivo binário não suportada: {versao}")
+        descs = _ler_tabela_strings(arquivo['desc_dados'], arquivo['desc_offsets'])
+        normalizadas = _ler_tabela_strings(arquivo['norm_dados'], arquivo['norm_offsets'])
+        colunas = {}
+        for nome in ('ncm', 'aliq', 'trib', 'cest'):
+            distintos = _ler_tabela_strings(arquivo[f'{nome}_dados'], arquivo[f'{nome}_offsets'])
+            colunas[nome] = [distintos[codigo] for codigo in arquivo[f'{nome}_codigos'].tolist()]
+        vocabulario = _ler_tabela_strings(arquivo['vocab_dados'], arquivo['vocab_offsets'])
+        ids = arquivo['palavras_ids']
+        ptr = arquivo['palavras_ptr']
+        assinatura = int(arquivo['assinatura'][0])
+
+    ids_lista, ptr_lista = ids.tolist(), ptr.tolist()
+    vocabulario = [sys.intern(palavra) for palavra in vocabulario] # As mesmas strings de get_keywords
+    palavras = [frozenset([vocabulario[i] for i in ids_lista[inicio:fim]])
+                for inicio, fim in zip(ptr_lista[:-1], ptr_lista[1:])]
+    # Índice invertido palavra -> posições montado em bloco a partir do CSR
+    item_de = np.repeat(np.arange(len(descs), dtype=np.int64), np.diff(ptr))
+    ordem = np.argsort(ids, kind='stable')
+    fronteiras = np.searchsorted(ids[ordem], np.arange(len(vocabulario) + 1)).tolist()
+    itens_ordenados = item_de[ordem]
+    por_palavra = {
+        palavra: set(itens_ordenados[fronteiras[i]:fronteiras[i + 1]].tolist())
+        for i, palavra in enumerate(vocabulario)
+    }
+    base_index = BaseIndex.from_columns(descs, colunas['ncm'], colunas['aliq'], colunas['trib'], colunas['cest'],
+                                        palavras, normalizadas, assinatura, por_palavra)
+    return ConfigsView(base_index), base_index
+
+class BaseStorage:
+    """Persistência incremental da base: snapshot binário + journal de upserts.
+
+    append() grava só os itens adicionados/alterados (tempo proporcional às
+    alterações, não ao tamanho da base); load() lê o snapshot e reaplica o journal.
+    Quando o journal fica grande, um snapshot novo é gravado em segundo plano e
+    as entradas já incorporadas saem do journal. Todas as gravações são atômicas
+    ou, no caso do journal, toleram uma última linha incompleta após uma queda.
+    """
+
+    def __init__(self, path, lock=None):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.lock = lock if lock is not None else threading.RLock()
+        self._entradas_journal = 0
+        self._compactacao = None
+        self._geracao = 0 # Incrementada a cada regravação completa; invalida compactações em curso
+        self._assinaturas = None # (mtime, tamanho) dos arquivos após a última leitura/gravação deste objeto
+
+    def changed_externally(self):
+        """True se o snapshot ou o journal foram alterados por outro processo desde a última leitura/gravação."""
+        with self.lock:
+            return self._stat_arquivos() != self._assinaturas
+
+    def _stat_arquivos(self):
+        assinaturas = []
+        for path in (self.path, self.journal_path):
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                assinaturas.append(None)
+            else:
+                assinaturas.append((info.st_mtime_ns, info.st_size))
+        return tuple(assinaturas)
+
+    def mark_synced(self):
+        """Registra o estado atual dos arquivos como já refletido na base em memória."""
+        with self.lock:
+            self._assinaturas = self._stat_arquivos()
+
+    def load(self):
+        """Retorna (configs, base_index) do snapshot (se houver) com o journal reaplicado."""
+        with self.lock:
+            if os.path.exists(self.path):
+                configs, base_index = load_base_binary(self.path)
+            else:
+                base_index = BaseIndex()
+                configs = ConfigsView(base_index)
+            self._entradas_journal = 0
+            for desc, values in self._ler_journal():
+                base_index.add(desc, values) # Aparece também em `configs`, uma visão do índice
+                self._entradas_journal += 1
+            self.mark_synced()
+            return configs, base_index
+
+    def append(self, itens, base_index=None):
+        """Acrescenta ao journal os upserts `itens` [(desc, values), ...] e faz fsync.
+
+        Se `base_index` (já contendo os itens) for informado, dispara a compactação
+        em segundo plano quando o journal passar do limite.
+        """
+        if not itens:
+            return
+        linhas = ''.join(
+            json.dumps({'desc': desc, **{campo: values[campo] for campo in ('NCM', 'ALIQ_ICMS', 'TRIBUTACAO', 'CEST')}},
+                       ensure_ascii=False) + '\n'
+            for desc, values in itens
+        )
+        with self.lock:
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(linhas)
+                f.flush()
+                os.fsync(f.fileno())
+            self._entradas_journal += len(itens)
+            self.mark_synced()
+        if base_index is not None and self._precisa_compactar(len(base_index.descs)):
+            self.compact_async(base_index)
+
+    def write_snapshot(self, base_index):
+        """Regrava a base inteira no snapshot e descarta o journal (ex.: importação de CSV)."""
+        with self.lock:
+            save_base_binary(base_index, self.path)
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._entradas_journal = 0
+            self._geracao += 1
+            self.mark_synced()
+
+    def compact_async(self, base_index):
+        """Inicia a compactação em uma thread de fundo, se nenhuma estiver em andamento."""
+        with self.lock:
+            if self._compactacao is not None and self._compactacao.is_alive():
+                return
+            self._compactacao = threading.Thread(target=self._compactar, args=(base_index,), daemon=True,
+                                                 name='compactacao-base')
+            self._compactacao.start()
+
+    def _precisa_compactar(self, tamanho_base):
+        return self._entradas_journal >= max(COMPACTION_MIN_ENTRIES, COMPACTION_RATIO * tamanho_base)
+
+    def _compactar(self, base_index):
+        tmp_path = self.path + '.compactando'
+        try:
+            # Copia as colunas sob o lock; a gravação (lenta) acontece fora dele
+            with self.lock:
+                copia = base_index.snapshot()
+                geracao = self._geracao
+                incorporado = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            save_base_binary(copia, tmp_path)
+            with self.lock:
+                if geracao != self._geracao:
+                    os.remove(tmp_path) # A base foi regravada por inteiro enquanto compactávamos
+                    return
+                restante = b''
+                if os.path.exists(self.journal_path):
+                    with open(self.journal_path, 'rb') as f:
+                        f.seek(incorporado)
+                        restante = f.read()
+                # Snapshot primeiro, journal depois: se o processo cair entre os dois, o journal
+                # antigo é reaplicado sobre o snapshot novo (upserts idempotentes), sem perda.
+                os.replace(tmp_path, self.path)
+                _gravar_atomico(self.journal_path, lambda f: f.write(restante))
+                self._entradas_journal = restante.count(b'\n')
+                self.mark_synced()
+        except Exception:
+            logger.exception("Falha ao compactar a base '%s'", self.path)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _ler_journal(self):
+        """Lê as entradas do journal; uma última linha incompleta (queda durante a escrita) é descartada."""
+        if not os.path.exists(self.journal_path):
+            return []
+        entradas = []
+        valido = 0
+        with open(self.journal_path, 'rb') as f:
+            for linha in f:
+                if not linha.endswith(b'\n'):
+                    break
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    break
+                desc = registro.pop('desc')
+                entradas.append((desc, registro))
+                valido += len(linha)
+        if valido != os.path.getsize(self.journal_path):
+            logger.warning("Journal '%s' com final incompleto; descartando a partir do byte %d", self.journal_path,
+                           valido)
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(valido)
+        return entradas
+
+# --- Carga da base a partir dos arquivos (usada pela interface e pela linha de comando) ---
+CONFIG_FILE = 'configuracoes.csv'
+EXCEL_CONFIG_FILE = 'configuracoes.xlsx'
+BINARY_CONFIG_FILE = 'configuracoes.npz' # Formato principal da base
+
+def file_signature(path):
+    """(mtime, tamanho) do arquivo, ou None se ele não existir."""
+    try:
+        info = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+def _avisar(avisos, nivel, mensagem):
+    if avisos is not None:
+        avisos.append((nivel, mensagem))
+
+def save_configurations_csv(configs, path=CONFIG_FILE):
+    """Salva todas as configurações no arquivo CSV, garantindo que CEST esteja limpo."""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        write_configurations_csv(configs, f)
+
+def load_configurations(csv_path=CONFIG_FILE, excel_path=EXCEL_CONFIG_FILE, avisos=None):
+    """Carrega a base do CSV ou, se ele estiver vazio ou não existir, do Excel (que é salvo como CSV).
+
+    As mensagens para o usuário vão para a lista `avisos`, como (nível, mensagem),
+    com nível 'success', 'info', 'warning' ou 'error'.
+    """
+    from ingestao import BASE_COLUMNS, BASE_REQUIRED_COLUMNS, base_records, read_table
+
+    configs = {}
+    if os.path.exists(csv_path):
+        try:
+            configs, delimitador_detectado = read_configurations_csv(csv_path)
+            if not delimitador_detectado:
+                _avisar(avisos, 'warning', "Não foi possível detectar o delimitador do CSV automaticamente, tentando com vírgula.")
+
+            if configs:
+                _avisar(avisos, 'success', f"✅ Arquivo CSV '{csv_path}' carregado com sucesso! {len(configs)} itens encontrados.")
+            else:
+                _avisar(avisos, 'warning', f"Arquivo CSV '{csv_path}' carregado, mas nenhum item válido encontrado.")
+
+        except Exception as e:
+            # Verifica se o erro é o de limite de campo, mesmo com o ajuste (pode indicar outros problemas)
+            if 'field larger than field limit' in str(e):
+                _avisar(avisos, 'error', f"Erro ao carregar CSV '{csv_path}': O arquivo contém um campo excessivamente grande, mesmo após tentar ajustar o limite. Verifique o arquivo. Detalhe: {str(e)}")
+            else:
+                _avisar(avisos, 'error', f"Erro ao carregar arquivo CSV '{csv_path}': {str(e)}")
+
+    # Se o CSV estava vazio ou não existe, tenta carregar do Excel
+    if not configs and os.path.exists(excel_path):
+        _avisar(avisos, 'info', f"Arquivo CSV não encontrado ou vazio. Tentando carregar de '{excel_path}'...")
+        try:
+            df = read_table(excel_path, colunas=BASE_COLUMNS)
+            missing_cols = [col for col in BASE_REQUIRED_COLUMNS if col not in df.columns]
+            if missing_cols:
+                _avisar(avisos, 'error', f"Erro: O arquivo Excel deve conter as colunas: {', '.join(BASE_REQUIRED_COLUMNS)}. Colunas ausentes ou não reconhecidas: {', '.join(missing_cols)}")
+                return {}
+
+            configs = dict(base_records(df))
+
+            if configs:
+                try:
+                    save_configurations_csv(configs, csv_path) # Salva no formato CSV padrão
+                except Exception as e:
+                    _avisar(avisos, 'error', f"Erro ao salvar configurações em '{csv_path}': {str(e)}")
+                _avisar(avisos, 'success', f"✅ Base carregada do arquivo Excel '{excel_path}' e salva em '{csv_path}'. {len(configs)} itens encontrados.")
+            else:
+                _avisar(avisos, 'warning', f"Nenhum item válido encontrado no arquivo Excel '{excel_path}'.")
+
+        except Exception as e:
+            _avisar(avisos, 'error', f"Erro ao carregar arquivo Excel '{excel_path}': {str(e)}")
+
+    return configs
+
+def load_base(storage, csv_path=CONFIG_FILE, excel_path=EXCEL_CONFIG_FILE, avisos=None):
+    """Carrega a base e seus índices: do armazenamento binário, se estiver atualizado, ou do CSV/Excel.
+
+    Um CSV mais novo que o binário (snapshot + journal) é tratado como importação:
+    é lido e convertido para o formato binário, que passa a ser usado nas próximas cargas.
+    Retorna (configs, base_index), com `configs` como ConfigsView do índice (os valores ficam
+    só nas colunas do índice); as mensagens vão para `avisos`, como em load_configurations.
+    """
+    assinaturas_binarias = [a for a in (file_signature(storage.path), file_signature(storage.journal_path)) if a]
+    assinatura_csv = file_signature(csv_path)
+    if assinaturas_binarias and (assinatura_csv is None or max(a[0] for a in assinaturas_binarias) >= assinatura_csv[0]):
+        try:
+            configs, base_index = storage.load()
+            _avisar(avisos, 'success', f"✅ Base '{storage.path}' carregada com sucesso! {len(configs)} itens encontrados.")
+            return configs, base_index
+        except Exception as e:
+            _avisar(avisos, 'error', f"Erro ao carregar a base binária '{storage.path}': {str(e)}. Tentando o CSV.")
+
+    base_index = BaseIndex.from_configs(load_configurations(csv_path, excel_path, avisos))
+    if base_index.descs:
+        try:
+            storage.write_snapshot(base_index) # Converte para o formato binário (escrita atômica, descarta o journal)
+        except Exception as e:
+            _avisar(avisos, 'error', f"Erro ao salvar a base em '{storage.path}': {str(e)}")
+    return ConfigsView(base_index), base_index
@@ -0,0 +1,190 @@
+"""Auditoria em lote pela linha de comando, sem a interface Streamlit.
+
+    python auditar.py pasta_de_planilhas/ outra_planilha.xlsx --processos 4 --pdf
+
+A base é carregada uma única vez, com a mesma regra da interface (armazenamento
+binário atualizado ou importação do CSV/Excel), e compartilhada por todas as
+planilhas (.xlsx, .csv, .parquet), auditadas em paralelo, uma por processo. O
+resultado de cada planilha é gravado ao lado dela: <nome>_auditado.xlsx e, com
+--pdf, <nome>_auditado.pdf (ou .zip, se o relatório for dividido em partes).
+Planilhas da mesma pasta com o mesmo nome e extensões diferentes (ex.: notas.xlsx
+e notas.csv) gravariam o mesmo resultado e são recusadas antes da auditoria.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from armazenamento import BINARY_CONFIG_FILE, CONFIG_FILE, EXCEL_CONFIG_FILE, BaseStorage, load_base
+from auditoria import SIMILARITY_FUZZY, SIMILARITY_METHODS, SIMILARITY_TFIDF, export_frame, process_planilha
+from exportacao import EXCEL_HIGHLIGHTS, pdf_download, write_highlighted_excel
+from ingestao import SUPPORTED_EXTENSIONS, read_table
+from metricas import AuditMetrics
+
+OUTPUT_SUFFIX = '_auditado' # Sufixo dos arquivos gerados; entradas com ele são ignoradas
+
+def find_inputs(caminhos, recursivo=False, sufixo=OUTPUT_SUFFIX):
+    """Planilhas a auditar em `caminhos` (arquivos ou pastas), sem os resultados de execuções anteriores.
+
+    Gera ValueError se duas planilhas diferentes gravariam o mesmo arquivo de resultado.
+    """
+    def aceita(nome):
+        raiz, extensao = os.path.splitext(os.path.basename(nome))
+        return (extensao.lower().lstrip('.') in SUPPORTED_EXTENSIONS and not raiz.endswith(sufixo)
+                and not raiz.startswith('~$')) # '~$' são arquivos temporários do Excel
+
+    arquivos = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            if recursivo:
+                for pasta, _, nomes in os.walk(caminho):
+                    arquivos.extend(os.path.join(pasta, nome) for nome in sorted(nomes) if aceita(nome))
+            else:
+                arquivos.extend(os.path.join(caminho, nome) for nome in sorted(os.listdir(caminho))
+                                if aceita(nome) and os.path.isfile(os.path.join(caminho, nome)))
+        elif os.path.isfile(caminho):
+            arquivos.append(caminho) # Arquivo pedido explicitamente: o formato é validado por read_table
+        else:
+            raise FileNotFoundError(f"Arquivo ou pasta não encontrado: '{caminho}'")
+
+    por_saida = {} # Resultado (sem a extensão) -> planilhas distintas que o gravariam
+    for arquivo in arquivos:
+        real = os.path.normcase(os.path.abspath(arquivo))
+        por_saida.setdefault(os.path.splitext(real)[0], {}).setdefault(real, arquivo)
+    repetidos = [list(grupo.values()) for grupo in por_saida.values() if len(grupo) > 1]
+    if repetidos:
+        lista = '; '.join(' e '.join(grupo) for grupo in repetidos)
+        raise ValueError(f"Planilhas com o mesmo nome gravariam o mesmo resultado (<nome>{sufixo}.xlsx): {lista}. "
+                         "Renomeie uma delas ou audite-as separadamente.")
+    return [arquivo for grupo in por_saida.values() for arquivo in grupo.values()] # Cada arquivo uma vez só
+
+def audit_file(caminho, base_index, pdf=False, only_changed=False, sufixo=OUTPUT_SUFFIX,
+               similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+    """Audita a planilha `caminho` e grava os resultados ao lado dela.
+
+    Retorna um resumo: arquivo, linhas, linhas alteradas, arquivos gerados, segundos e métricas.
+    """
+    inicio = time.perf_counter()
+    metricas = AuditMetrics()
+    with metricas.stage('leitura_planilha'):
+        audit_df = read_table(caminho)
+    if 'Descrição item' not in audit_df.columns:
+        raise ValueError("A planilha de auditoria deve conter a coluna 'Descrição item'.")
+    with metricas.stage('auditoria'):
+        result_df = process_planilha(audit_df, None, base_index, metricas=metricas,
+                                     similarity_method=similarity_method, ncm_prefix=ncm_prefix)
+
+    raiz = os.path.splitext(caminho)[0] + sufixo
+    saidas = [raiz + '.xlsx']
+    with metricas.stage('exportacao_excel'):
+        saida_df = export_frame(result_df, base_index) # Textos de 'ITEM CONSIDERADO' só na exportação
+        write_highlighted_excel(saida_df, saidas[0])
+    if pdf:
+        with metricas.stage('exportacao_pdf_alterados' if only_changed else 'exportacao_pdf'):
+            dados, nome, _ = pdf_download(saida_df, only_changed, os.path.basename(raiz) + '.pdf')
+            saidas.append(os.path.join(os.path.dirname(raiz), nome))
+            with open(saidas[-1], 'wb') as f:
+                f.write(dados)
+
+    flags = [flag for flag in EXCEL_HIGHLIGHTS.values() if flag in result_df.columns]
+    return {
+        'arquivo': caminho,
+        'linhas': len(result_df),
+        'alteradas': int(result_df[flags].any(axis=1).sum()) if flags else 0,
+        'saidas': saidas,
+        'segundos': time.perf_counter() - inicio,
+        'metricas': metricas,
+    }
+
+# Índice da base recebido por cada processo auxiliar (enviado uma vez, no initializer)
+_worker_index = None
+
+def _init_worker(base_index):
+    global _worker_index
+    _worker_index = base_index
+
+def _audit_worker(caminho, opcoes):
+    return audit_file(caminho, _worker_index, **opcoes)
+
+def audit_files(arquivos, base_index, processos=1, **opcoes):
+    """Audita `arquivos` com `processos` processos, gerando (arquivo, resumo, erro) à medida que terminam.
+
+    `opcoes` são repassadas a audit_file. O erro de uma planilha não interrompe as demais.
+    """
+    if processos <= 1 or len(arquivos) <= 1:
+        for caminho in arquivos:
+            try:
+                yield caminho, audit_file(caminho, base_index, **opcoes), None
+            except Exception as e:
+                yield caminho, None, e
+        return
+
+    with ProcessPoolExecutor(max_workers=min(processos, len(arquivos)), initializer=_init_worker,
+                             initargs=(base_index,)) as pool:
+        futuros = {pool.submit(_audit_worker, caminho, opcoes): caminho for caminho in arquivos}
+        for futuro in as_completed(futuros):
+            try:
+                yield futuros[futuro], futuro.result(), None
+            except Exception as e:
+                yield futuros[futuro], None, e
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Audita planilhas em lote com a base de configurações, sem a interface.")
+    parser.add_argument('caminhos', nargs='+', help="Planilhas (.xlsx, .csv, .parquet) ou pastas com planilhas.")
+    parser.add_argument('-r', '--recursivo', action='store_true', help="Procura planilhas também nas subpastas.")
+    parser.add_argument('-p', '--processos', type=int, default=os.cpu_count() or 1,
+                        help="Planilhas auditadas em paralelo (padrão: número de CPUs).")
+    parser.add_argument('--pdf', action='store_true', help="Gera também o relatório PDF.")
+    parser.add_argument('--pdf-alterados', action='store_true', help="PDF só com as linhas alteradas (implica --pdf).")
+    parser.add_argument('--similaridade', choices=SIMILARITY_METHODS, default=SIMILARITY_FUZZY,
+                        help="Etapa de similaridade: fuzz.ratio com cada item (fuzzy) ou cosseno TF-IDF de n-gramas (tfidf).")
+    parser.add_argument('--prefixo-ncm', action='store_true',
+                        help="Procura primeiro entre os itens do mesmo NCM (depois subposição, posição e capítulo).")
+    parser.add_argument('--base', default=BINARY_CONFIG_FILE, help=f"Base binária (padrão: {BINARY_CONFIG_FILE}).")
+    parser.add_argument('--base-csv', default=CONFIG_FILE, help=f"CSV de importação da base (padrão: {CONFIG_FILE}).")
+    parser.add_argument('--base-excel', default=EXCEL_CONFIG_FILE,
+                        help=f"Excel de importação da base (padrão: {EXCEL_CONFIG_FILE}).")
+    parser.add_argument('--log-metricas', help="Acrescenta as métricas de cada planilha a este arquivo (JSON lines).")
+    args = parser.parse_args(argv)
+
+    try:
+        arquivos = find_inputs(args.caminhos, args.recursivo)
+    except (FileNotFoundError, ValueError) as e:
+        parser.error(str(e))
+    if not arquivos:
+        print("Nenhuma planilha encontrada.", file=sys.stderr)
+        return 0
+
+    avisos = []
+    configs, base_index = load_base(BaseStorage(args.base), args.base_csv, args.base_excel, avisos)
+    for nivel, mensagem in avisos:
+        print(f"[{nivel}] {mensagem}", file=sys.stderr)
+    if not configs:
+        print("A base de configurações está vazia ou não foi encontrada.", file=sys.stderr)
+        return 2
+
+    inicio = time.perf_counter()
+    # Índices opcionais montados uma vez e enviados prontos, com a base, a cada processo
+    if args.similaridade == SIMILARITY_TFIDF:
+        base_index.tfidf()
+    if args.prefixo_ncm:
+        base_index.ncm_prefix_index()
+    falhas = 0
+    opcoes = {'pdf': args.pdf or args.pdf_alterados, 'only_changed': args.pdf_alterados,
+              'similarity_method': args.similaridade, 'ncm_prefix': args.prefixo_ncm}
+    for caminho, resumo, erro in audit_files(arquivos, base_index, args.processos, **opcoes):
+        if erro is not None:
+            falhas += 1
+            print(f"ERRO  {caminho}: {erro}", file=sys.stderr)
+            continue
+        print(f"OK    {caminho}: {resumo['linhas']} linhas, {resumo['alteradas']} alteradas, "
+              f"{resumo['segundos']:.1f} s -> {', '.join(resumo['saidas'])}")
+        if args.log_metricas:
+            resumo['metricas'].log(args.log_metricas, arquivo=caminho, linhas=resumo['linhas'],
+                                   alteradas=resumo['alteradas'])
+    print(f"{len(arquivos) - falhas} de {len(arquivos)} planilhas auditadas em {time.perf_counter() - inicio:.1f} s.")
+    return 1 if falhas else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1072 @@
+"""Motor de auditoria tributária: normalização, índices da base e matching.
+
+Separado da interface Streamlit (app.py) para que os processos auxiliares do
+modo paralelo possam importá-lo sem executar a interface.
+"""
+import hashlib
+import multiprocessing
+import re
+import sys
+import time
+import unicodedata
+from collections import namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz, process as rf_process  # Fuzzy matching em C (mesmo motor do thefuzz)
+
+from metricas import AuditMetrics
+from similaridade import TfidfIndex
+
+SIMILARITY_THRESHOLD = 70 # Limiar padrão (%) da etapa de similaridade
+FUZZY_BATCH_SIZE = 64 # Linhas por lote na matriz de similaridade
+SIMILARITY_FUZZY = 'fuzzy' # Etapa de similaridade por fuzz.ratio contra a base (padrão)
+SIMILARITY_TFIDF = 'tfidf' # Etapa de similaridade pelo cosseno TF-IDF de n-gramas de caracteres
+SIMILARITY_METHODS = (SIMILARITY_FUZZY, SIMILARITY_TFIDF)
+ALTERNATIVES_K = 3 # Alternativas sugeridas para as linhas de baixa confiança
+NCM_LEVELS = (8, 6, 4, 2) # Item, subposição, posição e capítulo do NCM, do mais específico ao mais geral
+AUDIT_CHUNK_SIZE = 1000 # Linhas por bloco (progresso da auditoria e tarefas do modo paralelo)
+# Valores distintos memorizados por processo (ver clear_text_caches)
+TEXT_CACHE_SIZE = 2**17 # get_keywords e normalize_description
+CEST_CACHE_SIZE = 2**14 # clean_cest
+STOPWORDS = frozenset({'de', 'da', 'do', 'e', 'em', 'com', 'ml'})
+
+# Tipos de correspondência devolvidos por match_rows
+MATCH_SEM_DESCRICAO = -1 # Linha sem descrição (não auditada)
+MATCH_NENHUM = 0
+MATCH_EXATO = 1
+MATCH_PALAVRAS = 2
+MATCH_SIMILARIDADE = 3
+MATCH_TIPOS = (MATCH_EXATO, MATCH_PALAVRAS, MATCH_SIMILARIDADE, MATCH_NENHUM, MATCH_SEM_DESCRICAO)
+LOW_CONFIDENCE_TYPES = (MATCH_PALAVRAS, MATCH_SIMILARIDADE, MATCH_NENHUM) # Linhas sem correspondência exata
+# Valores da coluna 'CORRESPONDENCIA' do resultado (categórica), na ordem de MATCH_TIPOS
+MATCH_ROTULOS = {MATCH_EXATO: 'Descrição Exata', MATCH_PALAVRAS: 'Palavras/NCM', MATCH_SIMILARIDADE: 'Similaridade',
+                 MATCH_NENHUM: 'Nenhuma correspondência', MATCH_SEM_DESCRICAO: 'Sem descrição'}
+_CODIGO_TIPO = np.empty(len(MATCH_TIPOS), dtype=np.int8) # tipo + 1 -> código na coluna 'CORRESPONDENCIA'
+_CODIGO_TIPO[np.asarray(MATCH_TIPOS) + 1] = np.arange(len(MATCH_TIPOS))
+# Colunas da base gravadas no resultado: poucos valores distintos, guardadas como categóricas
+RESULT_BASE_COLUMNS = ('NCM', 'Aliq. ICMS', 'TRIBUTACAO', 'CEST') # Nome interno sem Ç
+# Nome de cada tipo nas métricas (AuditMetrics): contadores 'linhas_<nome>'
+MATCH_NOMES = {MATCH_EXATO: 'exata', MATCH_PALAVRAS: 'palavras_ncm', MATCH_SIMILARIDADE: 'similaridade',
+               MATCH_NENHUM: 'sem_correspondencia', MATCH_SEM_DESCRICAO: 'sem_descricao'}
+
+# Progresso de iter_process_planilha: bloco auditado, linhas processadas, total e contagem por MATCH_*
+AuditProgress = namedtuple('AuditProgress', ['bloco', 'processadas', 'total', 'contagens'])
+
+@lru_cache(maxsize=CEST_CACHE_SIZE, typed=True) # typed: True e 1 não são o mesmo CEST
+def _clean_cest(cest_value):
+    cest_str = str(cest_value).strip()
+    if cest_str.endswith('.0'):
+        cest_str = cest_str[:-2] # Remove '.0'
+    # Tenta converter para int para remover quaisquer outros decimais e depois para str
+    try:
+        return str(int(cest_str))
+    except ValueError:
+        # Se não for um número válido após remover .0, retorna a string limpa
+        return cest_str if cest_str else '0'
+
+def clean_cest(cest_value):
+    """Limpa o valor do CEST, removendo '.0' e garantindo que seja uma string.
+
+    Cada valor distinto é limpo uma vez por processo; a mesma string é devolvida a cada repetição.
+    """
+    # Vazios antes do cache: NaN != NaN, e cada NaN de uma coluna seria uma entrada nova nele
+    if pd.api.types.is_scalar(cest_value) and pd.isna(cest_value):
+        return '0'
+    try:
+        return _clean_cest(cest_value)
+    except TypeError: # Valor não hashable: limpa sem passar pelo cache
+        return _clean_cest.__wrapped__(cest_value)
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _keywords(texto):
+    palavras = []
+    for word in texto.split():
+        palavra = word.lower()
+        if palavra not in STOPWORDS and len(word) > 2:
+            palavras.append(sys.intern(palavra)) # Palavras repetidas na base compartilham a mesma string
+    return frozenset(palavras)
+
+def get_keywords(text):
+    """Palavras-chave do texto (frozenset de strings internadas), memorizadas por texto distinto."""
+    return _keywords(str(text))
+
+_NAO_ALFANUMERICO = re.compile(r'[\W_]+')
+_NAO_DIGITO = re.compile(r'\D')
+
+def ncm_prefixes(ncm):
+    """Prefixos do NCM (só dígitos) em cada nível de NCM_LEVELS que ele alcança, do mais longo ao mais curto."""
+    digitos = _NAO_DIGITO.sub('', ncm)
+    return [digitos[:nivel] for nivel in NCM_LEVELS if len(digitos) >= nivel]
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch))
+    return ' '.join(_NAO_ALFANUMERICO.sub(' ', texto).split())
+
+def normalize_description(text):
+    """Normaliza a descrição para a busca exata: minúsculas, sem acentos, pontuação ou espaços repetidos."""
+    return _normalizar(str(text))
+
+def clear_text_caches():
+    """Esvazia os caches de get_keywords, normalize_description e clean_cest (ex.: depois de um lote grande)."""
+    _keywords.cache_clear()
+    _normalizar.cache_clear()
+    _clean_cest.cache_clear()
+
+class DescriptionLookup:
+    """Mapa descrição normalizada -> descrição original da base (busca exata em O(1)).
+
+    Em caso de colisão (duas descrições com a mesma forma normalizada) vale a
+    última inserida, como no antigo mapa `{k.lower(): k}`.
+    """
+
+    def __init__(self):
+        self.mapa = {}
+
+    def add(self, desc):
+        chave = normalize_description(desc)
+        if chave:
+            self.mapa[chave] = desc
+
+    def get(self, desc_item):
+        chave = normalize_description(desc_item)
+        return self.mapa.get(chave) if chave else None
+
+def _item_hash(pos, *valores):
+    dados = '\x1f'.join((str(pos),) + valores).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(dados, digest_size=8).digest(), 'little')
+
+class BaseIndex:
+    """Índice invertido da base de configurações (palavra -> itens e NCM -> itens).
+
+    Montado uma única vez por base carregada, permite que a etapa "Palavras/NCM"
+    pontue apenas os itens que compartilham ao menos uma palavra ou o NCM da linha.
+    Os itens são referenciados pela posição na base (ordem de inserção do dict).
+    """
+
+    def __init__(self):
+        self.descs = []        # Descrições na ordem da base
+        self.descs_lower = []  # Descrições normalizadas para a etapa de similaridade
+        self.posicoes = {}     # Descrição -> posição em self.descs
+        self.palavras = []     # Palavras-chave de cada item
+        self.ncms = []         # Valores de cada item, já limpos como na comparação
+        self.aliqs = []
+        self.tributacoes = []
+        self.cests = []
+        self.por_palavra = {}  # Palavra -> conjunto de posições
+        self.por_ncm = {}      # NCM (não vazio) -> conjunto de posições
+        self.lookup = DescriptionLookup() # Busca exata por descrição normalizada
+        self._assinatura = 0   # Soma (mod 2**64) dos hashes de cada item; ver fingerprint()
+        self.alteracoes = []   # Posições incluídas/alteradas por add(), em ordem; ver version()
+        self._tfidf = None     # TfidfIndex das descrições, montado sob demanda; ver tfidf()
+        self._por_prefixo_ncm = None # Prefixo do NCM -> conjunto de posições, sob demanda; ver ncm_levels()
+
+    @classmethod
+    def from_configs(cls, configs):
+        index = cls()
+        for desc, values in configs.items():
+            index.add(desc, values)
+        index.alteracoes.clear() # A carga inicial não é uma alteração
+        return index
+
+    @classmethod
+    def from_columns(cls, descs, ncms, aliqs, tributacoes, cests, palavras, normalizadas, assinatura=None,
+                     por_palavra=None):
+        """Monta o índice a partir de colunas já limpas e dos dados derivados pré-computados.
+
+        `palavras` e `normalizadas` devem ser o resultado de get_keywords e
+        normalize_description para cada descrição (ex.: lidos do arquivo binário);
+        `por_palavra` (palavra -> conjunto de posições) é montado aqui se omitido.
+        """
+        index = cls()
+        index.descs = list(descs)
+        index.descs_lower = [desc.strip().lower() for desc in index.descs]
+        index.posicoes = {desc: pos for pos, desc in enumerate(index.descs)}
+        index.palavras = list(palavras)
+        index.ncms, index.aliqs = list(ncms), list(aliqs)
+        index.tributacoes, index.cests = list(tributacoes), list(cests)
+        if por_palavra is not None:
+            index.por_palavra = por_palavra
+        else:
+            for pos, palavras_item in enumerate(index.palavras):
+                for palavra in palavras_item:
+                    index.por_palavra.setdefault(palavra, set()).add(pos)
+        for pos, ncm in enumerate(index.ncms):
+            if ncm:
+                index.por_ncm.setdefault(ncm, set()).add(pos)
+        index.lookup.mapa = {chave: desc for chave, desc in zip(normalizadas, index.descs) if chave}
+        if assinatura is None:
+            valores = zip(index.descs, index.ncms, index.aliqs, index.tributacoes, index.cests)
+            assinatura = sum(_item_hash(pos, *item) for pos, item in enumerate(valores)) % 2**64
+        index._assinatura = assinatura
+        return index
+
+    def add(self, desc, values):
+        """Adiciona um item novo ou atualiza os valores de um item já indexado."""
+        # Poucos valores distintos em bases grandes: internados, cada um fica uma vez só na memória
+        ncm = sys.intern(str(values.get('NCM', '')).strip())
+        aliq = sys.intern(str(values.get('ALIQ_ICMS', '')).strip())
+        trib = sys.intern(str(values.get('TRIBUTACAO', '')).strip()) # Usa nome sem Ç
+        cest = clean_cest(values.get('CEST', '0'))
+        pos = self.posicoes.get(desc)
+        if pos is not None:
+            self._assinatura -= _item_hash(pos, desc, self.ncms[pos], self.aliqs[pos], self.tributacoes[pos],
+                                           self.cests[pos])
+        if pos is None:
+            pos = len(self.descs)
+            palavras = get_keywords(desc.strip().lower())
+            # Primeiro as colunas, depois os mapas que publicam a posição: quem a encontra já lê os valores
+            self.descs.append(desc)
+            self.descs_lower.append(desc.strip().lower())
+            self.palavras.append(palavras)
+            self.ncms.append(ncm)
+            self.aliqs.append(aliq)
+            self.tributacoes.append(trib)
+            self.cests.append(cest)
+            self.posicoes[desc] = pos
+            self.lookup.add(desc)
+            for palavra in palavras:
+                self.por_palavra.setdefault(palavra, set()).add(pos)
+            ncm_antigo = ''
+        else:
+            ncm_antigo = self.ncms[pos]
+            self.ncms[pos] = ncm
+            self.aliqs[pos] = aliq
+            self.tributacoes[pos] = trib
+            self.cests[pos] = cest
+        if ncm_antigo != ncm:
+            if ncm_antigo:
+                self.por_ncm[ncm_antigo].discard(pos)
+            if ncm:
+                self.por_ncm.setdefault(ncm, set()).add(pos)
+            if self._por_prefixo_ncm is not None:
+                for prefixo in ncm_prefixes(ncm_antigo):
+                    self._por_prefixo_ncm[prefixo].discard(pos)
+                for prefixo in ncm_prefixes(ncm):
+                    self._por_prefixo_ncm.setdefault(prefixo, set()).add(pos)
+        self._assinatura = (self._assinatura + _item_hash(pos, desc, ncm, aliq, trib, cest)) % 2**64
+        self.alteracoes.append(pos)
+
+    def version(self):
+        """Número de alterações desde a carga; alteracoes[v:] são as posições alteradas após a versão v.
+
+        Índices derivados (ex.: a pesquisa da Aba 2) guardam a versão em que foram
+        montados e reaplicam só as posições alteradas desde então.
+        """
+        return len(self.alteracoes)
+
+    def fingerprint(self):
+        """Impressão digital do conteúdo e da ordem da base, atualizada a cada add()."""
+        return f'{len(self.descs)}-{self._assinatura:016x}'
+
+    def values(self, pos):
+        """Valores do item `pos` no formato da base ({'NCM': ..., 'ALIQ_ICMS': ..., ...})."""
+        return {'NCM': self.ncms[pos], 'ALIQ_ICMS': self.aliqs[pos], 'TRIBUTACAO': self.tributacoes[pos],
+                'CEST': self.cests[pos]}
+
+    def snapshot(self):
+        """Cópia das colunas do índice, suficiente para gravar a base sem segurar o lock."""
+        copia = BaseIndex()
+        copia.descs = list(self.descs)
+        copia.palavras = list(self.palavras) # Os conjuntos de palavras não mudam depois de criados
+        copia.ncms, copia.aliqs = list(self.ncms), list(self.aliqs)
+        copia.tributacoes, copia.cests = list(self.tributacoes), list(self.cests)
+        copia._assinatura = self._assinatura
+        return copia
+
+    def tfidf(self):
+        """TfidfIndex das descrições normalizadas, montado na primeira chamada.
+
+        As descrições de um item não mudam; o índice só é remontado quando entram itens
+        novos (o idf depende de toda a base).
+        """
+        indice = self._tfidf
+        if indice is None or indice.tamanho != len(self.descs):
+            indice = TfidfIndex([normalize_description(desc) for desc in self.descs])
+            self._tfidf = indice
+        return indice
+
+    def ncm_prefix_index(self):
+        """Prefixo do NCM (2, 4, 6 e 8 dígitos) -> posições; montado na primeira chamada e mantido por add()."""
+        if self._por_prefixo_ncm is None:
+            por_prefixo = {}
+            for pos, ncm in enumerate(self.ncms):
+                for prefixo in ncm_prefixes(ncm):
+                    por_prefixo.setdefault(prefixo, set()).add(pos)
+            self._por_prefixo_ncm = por_prefixo
+        return self._por_prefixo_ncm
+
+    def ncm_levels(self, ncm_item):
+        """[(prefixo, posições), ...] dos itens que compartilham o NCM de `ncm_item` em cada nível.
+
+        Do nível mais específico (8 dígitos) ao capítulo (2), só os níveis com itens e
+        sem repetir um conjunto igual ao do nível anterior. Consulta em O(tamanho do NCM)
+        no índice de prefixos (ncm_prefix_index).
+        """
+        por_prefixo = self.ncm_prefix_index()
+        niveis = []
+        for prefixo in ncm_prefixes(ncm_item):
+            posicoes = por_prefixo.get(prefixo)
+            # Os conjuntos são aninhados: mesmo tamanho que o nível anterior é o mesmo conjunto
+            if posicoes and (not niveis or len(posicoes) > len(niveis[-1][1])):
+                niveis.append((prefixo, posicoes))
+        return niveis
+
+    def exact_match(self, desc_item):
+        """Retorna a posição do item equivalente a `desc_item` após normalização, ou -1."""
+        desc = self.lookup.get(desc_item)
+        return self.posicoes[desc] if desc is not None else -1
+
+    def keyword_match(self, palavras_item, ncm_item, metricas=None, permitidos=None):
+        """Retorna (posição, pontuação) do melhor item por palavras/NCM ou (-1, -1).
+
+        Com `permitidos` (conjunto de posições, ex.: de ncm_levels), só esses itens concorrem.
+        """
+        if permitidos is None:
+            candidatos = set(self.por_ncm.get(ncm_item, ()))
+            for palavra in palavras_item:
+                candidatos.update(self.por_palavra.get(palavra, ()))
+        else: # intersection percorre o menor dos dois conjuntos
+            candidatos = permitidos.intersection(self.por_ncm.get(ncm_item, ()))
+            for palavra in palavras_item:
+                candidatos.update(permitidos.intersection(self.por_palavra.get(palavra, ())))
+        if metricas is not None:
+            metricas.count('candidatos_palavras_ncm', len(candidatos))
+
+        melhor_pos = -1
+        max_score = -1
+        # Percorre na ordem da base para manter o mesmo desempate do laço original
+        for pos in sorted(candidatos):
+            palavras_iguais = palavras_item & self.palavras[pos]
+            ncm_base = self.ncms[pos]
+            ncm_igual = bool(ncm_base) and ncm_base == ncm_item
+            # Considera match se tiver >= 2 palavras iguais OU NCM igual (e não vazio)
+            if len(palavras_iguais) >= 2 or ncm_igual:
+                score_atual = len(palavras_iguais) * 10 + (50 if ncm_igual else 0)
+                if score_atual > max_score:
+                    max_score = score_atual
+                    melhor_pos = pos
+        return melhor_pos, max_score
+
+class ConfigsView(Mapping):
+    """A base no formato {descrição: valores}, lida das colunas de um BaseIndex.
+
+    Substitui o dict com um dict por item: os valores ficam só nas colunas do índice
+    e cada item vira dict apenas quando consultado. Somente leitura; as alterações
+    são feitas com BaseIndex.add() e aparecem aqui na hora.
+    """
+
+    def __init__(self, base_index):
+        self.base_index = base_index
+
+    def __getitem__(self, desc):
+        return self.base_index.values(self.base_index.posicoes[desc])
+
+    def __contains__(self, desc):
+        return desc in self.base_index.posicoes
+
+    def __iter__(self):
+        return iter(self.base_index.descs)
+
+    def __len__(self):
+        return len(self.base_index.descs)
+
+def fuzzy_match_batch(queries, choices, threshold=SIMILARITY_THRESHOLD, batch_size=FUZZY_BATCH_SIZE,
+                      return_comparisons=False):
+    """Encontra, para cada texto de `queries`, o item de `choices` com maior fuzz.ratio.
+
+    Os textos são processados em lotes: cada lote gera uma matriz de similaridade
+    calculada em C (rapidfuzz.process.cdist) apenas contra os itens da base cujo
+    comprimento permite atingir o limiar (bloqueio por comprimento, sem perda de matches).
+    Retorna dois arrays (posição em `choices`, pontuação inteira); posição -1 indica
+    que nenhum item atingiu `threshold`. Empates ficam com o primeiro item da base.
+    Com `return_comparisons`, retorna também quantos itens da base cada texto foi comparado.
+    """
+    total = len(queries)
+    melhores_pos = np.full(total, -1, dtype=np.int64)
+    melhores_scores = np.zeros(total, dtype=np.int64)
+    comparacoes = np.zeros(total, dtype=np.int64)
+    if total == 0 or not choices:
+        return (melhores_pos, melhores_scores, comparacoes) if return_comparisons else (melhores_pos, melhores_scores)
+
+    # Pontuações abaixo do corte são zeradas pelo rapidfuzz; o corte fica 1 ponto
+    # abaixo do limiar para não perder valores que arredondam para cima (ex.: 69.5 -> 70)
+    corte = min(max(threshold - 1, 0), 100)
+    lens_base = np.fromiter(map(len, choices), dtype=np.int64, count=len(choices))
+    ordem_base = np.argsort(lens_base, kind='stable')
+    lens_ordenados = lens_base[ordem_base]
+    lens_queries = np.fromiter(map(len, queries), dtype=np.int64, count=total)
+    ordem_queries = np.argsort(lens_queries, kind='stable')
+
+    batch_size = max(int(batch_size), 1)
+    for inicio in range(0, total, batch_size):
+        lote = ordem_queries[inicio:inicio + batch_size]
+        if corte > 0:
+            # fuzz.ratio <= 200 * min(l1, l2) / (l1 + l2): fora desta janela não há como atingir o corte
+            menor, maior = lens_queries[lote[0]], lens_queries[lote[-1]]
+            lo = np.searchsorted(lens_ordenados, menor * corte / (200 - corte) - 1e-9, side='left')
+            hi = np.searchsorted(lens_ordenados, maior * (200 - corte) / corte + 1e-9, side='right')
+            colunas = np.sort(ordem_base[lo:hi]) # Volta à ordem da base para o desempate
+        else:
+            colunas = np.arange(len(choices))
+        comparacoes[lote] = len(colunas)
+        if len(colunas) == 0:
+            continue
+
+        matriz = rf_process.cdist(
+            [queries[j] for j in lote],
+            [choices[k] for k in colunas],
+            scorer=fuzz.ratio,
+            score_cutoff=corte,
+            dtype=np.float64,
+        )
+        matriz = np.rint(matriz) # Mesmo arredondamento de int(round(score)) do thefuzz
+        melhor_coluna = matriz.argmax(axis=1) # argmax devolve a primeira ocorrência do máximo
+        scores = matriz[np.arange(len(lote)), melhor_coluna]
+        aceitos = scores >= threshold
+        melhores_pos[lote[aceitos]] = colunas[melhor_coluna[aceitos]]
+        melhores_scores[lote[aceitos]] = scores[aceitos].astype(np.int64)
+
+    if return_comparisons:
+        return melhores_pos, melhores_scores, comparacoes
+    return melhores_pos, melhores_scores
+
+def tfidf_match_batch(queries, base_index, threshold=SIMILARITY_THRESHOLD, colunas=None):
+    """Como fuzzy_match_batch, pelo cosseno TF-IDF (0-100) com as descrições da base (BaseIndex.tfidf).
+
+    Retorna (posição, pontuação inteira); posição -1 se nenhum item atingiu `threshold`.
+    Com `colunas` (posições em ordem crescente), só esses itens da base concorrem.
+    """
+    posicoes, scores = base_index.tfidf().top_k([normalize_description(q) for q in queries], 1, colunas=colunas)
+    posicoes, scores = posicoes[:, 0], scores[:, 0]
+    posicoes[scores < threshold] = -1
+    scores[posicoes < 0] = 0
+    return posicoes, scores
+
+def match_alternatives(descs_item, base_index, k=ALTERNATIVES_K):
+    """Os `k` itens da base mais próximos de cada descrição pelo cosseno TF-IDF, sem limiar.
+
+    Retorna arrays (n, k) de posições (-1 quando faltam candidatos) e pontuações (0-100).
+    """
+    return base_index.tfidf().top_k([normalize_description(desc) for desc in descs_item], k)
+
+def similarity_batch(queries, base_index, similarity_threshold=SIMILARITY_THRESHOLD, batch_size=FUZZY_BATCH_SIZE,
+                     similarity_method=SIMILARITY_FUZZY, colunas=None):
+    """Etapa de similaridade pelo método escolhido: (posição na base, pontuação, comparações) de cada texto.
+
+    Com `colunas` (posições em ordem crescente), compara só com esses itens da base.
+    """
+    if similarity_method == SIMILARITY_TFIDF:
+        posicoes, scores = tfidf_match_batch(queries, base_index, similarity_threshold, colunas)
+        # Produto com todos os itens concorrentes
+        comparacoes = np.full(len(queries), len(base_index.descs) if colunas is None else len(colunas), dtype=np.int64)
+        return posicoes, scores, comparacoes
+    choices = base_index.descs_lower if colunas is None else [base_index.descs_lower[pos] for pos in colunas]
+    posicoes, scores, comparacoes = fuzzy_match_batch(queries, choices, threshold=similarity_threshold,
+                                                      batch_size=batch_size, return_comparisons=True)
+    if colunas is not None:
+        posicoes = np.where(posicoes >= 0, colunas[np.maximum(posicoes, 0)], -1)
+    return posicoes, scores, comparacoes
+
+def match_rows(descs_item, ncms_item, base_index, similarity_threshold=SIMILARITY_THRESHOLD,
+               batch_size=FUZZY_BATCH_SIZE, metricas=None, similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+    """Executa as três etapas de correspondência para cada linha auditada.
+
+    `descs_item` são as descrições já em minúsculas e sem espaços nas pontas e
+    `ncms_item` os NCMs das linhas. Retorna três arrays: posição do item da base
+    (-1 sem match), pontuação e tipo de correspondência (constantes MATCH_*).
+    Se `metricas` (AuditMetrics) for informado, registra o tempo de cada etapa,
+    os candidatos avaliados e o tempo de cada linha. `similarity_method` escolhe a
+    etapa 3: SIMILARITY_FUZZY (fuzzy_match_batch) ou SIMILARITY_TFIDF (tfidf_match_batch).
+    Com `ncm_prefix`, as etapas 2 e 3 procuram primeiro entre os itens com o mesmo NCM
+    e, sem correspondência, entre os da mesma subposição, posição e capítulo
+    (BaseIndex.ncm_levels) antes de recorrer à base inteira.
+    """
+    total = len(descs_item)
+    posicoes = np.full(total, -1, dtype=np.int64)
+    scores = np.zeros(total, dtype=np.int64)
+    tipos = np.full(total, MATCH_NENHUM, dtype=np.int8)
+    pendentes = [] # Linhas sem match nas etapas 1 e 2, resolvidas em lote na etapa 3
+    scores_pendentes = []
+    medir = metricas is not None
+    if medir:
+        tempos = np.zeros(total, dtype=np.float64) # Tempo de cada linha (s)
+        tempo_exata = tempo_palavras = 0.0
+
+    for i, (desc_item, ncm_item) in enumerate(zip(descs_item, ncms_item)):
+        if not desc_item:
+            tipos[i] = MATCH_SEM_DESCRICAO
+            continue
+
+        # 1. Procura por correspondência exata na descrição normalizada
+        # (sem diferenciar maiúsculas, acentos, pontuação e espaços repetidos)
+        if medir:
+            inicio = time.perf_counter()
+        pos = base_index.exact_match(desc_item)
+        if medir:
+            meio = time.perf_counter()
+            tempo_exata += meio - inicio
+            tempos[i] = meio - inicio
+        if pos >= 0:
+            posicoes[i], scores[i], tipos[i] = pos, 100, MATCH_EXATO
+            continue
+
+        # 2. Se não encontrou exata, procura por palavras-chave ou NCM (via índice invertido)
+        palavras_item = get_keywords(desc_item)
+        for _, permitidos in (base_index.ncm_levels(ncm_item) if ncm_prefix else ()):
+            pos, max_score = base_index.keyword_match(palavras_item, ncm_item, metricas, permitidos)
+            if pos >= 0 and base_index.descs[pos]:
+                if medir:
+                    metricas.count('correspondencias_prefixo_ncm')
+                break
+        else: # Nenhum nível do NCM resolveu: a base inteira
+            pos, max_score = base_index.keyword_match(palavras_item, ncm_item, metricas)
+        if medir:
+            decorrido = time.perf_counter() - meio
+            tempo_palavras += decorrido
+            tempos[i] += decorrido
+        # Uma descrição vazia na base não conta como match, como no laço original
+        if pos >= 0 and base_index.descs[pos]:
+            posicoes[i], scores[i], tipos[i] = pos, max_score, MATCH_PALAVRAS
+            continue
+
+        # 3. Se ainda não encontrou, a linha segue para o fuzzy matching em lote
+        pendentes.append(i)
+        scores_pendentes.append(max_score)
+
+    # 3. Similaridade em lote para as linhas restantes
+    pendentes = np.asarray(pendentes, dtype=np.int64)
+    scores_pendentes = np.asarray(scores_pendentes, dtype=np.int64)
+    inicio = time.perf_counter()
+    pos_fuzzy = np.full(len(pendentes), -1, dtype=np.int64)
+    scores_fuzzy = np.zeros(len(pendentes), dtype=np.int64)
+    comparacoes = np.zeros(len(pendentes), dtype=np.int64)
+    restantes = np.arange(len(pendentes))
+    if ncm_prefix:
+        # Nível a nível do NCM, cada grupo de linhas com o mesmo prefixo é comparado só com os itens dele
+        niveis = [base_index.ncm_levels(ncms_item[i]) for i in pendentes.tolist()]
+        for profundidade in range(len(NCM_LEVELS)):
+            grupos = {}
+            for j in restantes.tolist():
+                if profundidade < len(niveis[j]):
+                    grupos.setdefault(niveis[j][profundidade][0], []).append(j)
+            for linhas in grupos.values():
+                linhas = np.asarray(linhas, dtype=np.int64)
+                colunas = np.array(sorted(niveis[linhas[0]][profundidade][1]), dtype=np.int64)
+                pos_fuzzy[linhas], scores_fuzzy[linhas], comparacoes_nivel = similarity_batch(
+                    [descs_item[i] for i in pendentes[linhas]], base_index, similarity_threshold, batch_size,
+                    similarity_method, colunas)
+                comparacoes[linhas] += comparacoes_nivel
+            resolvidas = (pos_fuzzy[restantes] >= 0) & (scores_fuzzy[restantes] > scores_pendentes[restantes])
+            if medir:
+                metricas.count('correspondencias_prefixo_ncm', resolvidas.sum())
+            restantes = restantes[~resolvidas]
+    if len(restantes):
+        pos_fuzzy[restantes], scores_fuzzy[restantes], comparacoes_base = similarity_batch(
+            [descs_item[i] for i in pendentes[restantes]], base_index, similarity_threshold, batch_size,
+            similarity_method)
+        comparacoes[restantes] += comparacoes_base
+    if medir:
+        tempo_similaridade = time.perf_counter() - inicio
+        metricas.add_time('exata', tempo_exata)
+        metricas.add_time('palavras_ncm', tempo_palavras)
+        metricas.add_time('similaridade', tempo_similaridade)
+        metricas.count('linhas_avaliadas_similaridade', len(pendentes))
+        metricas.count('comparacoes_similaridade', comparacoes.sum())
+        if comparacoes.sum(): # O tempo dos lotes é rateado pelo número de comparações de cada linha
+            tempos[pendentes] += tempo_similaridade * comparacoes / comparacoes.sum()
+        metricas.add_rows(tempos, descs_item)
+    aceitos = (pos_fuzzy >= 0) & (scores_fuzzy > scores_pendentes)
+    posicoes[pendentes[aceitos]] = pos_fuzzy[aceitos]
+    scores[pendentes[aceitos]] = scores_fuzzy[aceitos]
+    tipos[pendentes[aceitos]] = MATCH_SIMILARIDADE
+
+    return posicoes, scores, tipos
+
+# Índice da base recebido por cada processo auxiliar (enviado uma vez, no initializer)
+_worker_index = None
+
+def _init_worker(base_index):
+    global _worker_index
+    _worker_index = base_index
+
+def _match_chunk(args, base_index=None):
+    descs_item, ncms_item, similarity_threshold, batch_size, medir, similarity_method, ncm_prefix = args
+    metricas = AuditMetrics() if medir else None
+    resultado = match_rows(descs_item, ncms_item, base_index or _worker_index, similarity_threshold, batch_size,
+                           metricas, similarity_method, ncm_prefix)
+    return resultado, metricas
+
+def _contexto_processos():
+    """Contexto dos processos do modo paralelo: 'forkserver' onde existir (Linux, macOS), senão o padrão.
+
+    Um fork a partir de um processo com threads (o servidor do Streamlit, a fila de
+    tarefas) copia locks que outras threads seguravam, e o filho pode travar neles.
+    """
+    metodos = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in metodos else None)
+
+def iter_match_blocks(descs_item, ncms_item, base_index, workers=1, similarity_threshold=SIMILARITY_THRESHOLD,
+                      batch_size=FUZZY_BATCH_SIZE, chunk_size=AUDIT_CHUNK_SIZE, metricas=None,
+                      similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+    """Executa match_rows em blocos de `chunk_size` linhas, gerando (início, resultados) na ordem original.
+
+    Com `workers` > 1 os blocos são processados em paralelo: a base indexada é enviada
+    a cada processo uma única vez e o resultado é idêntico ao do modo serial. As
+    métricas de cada bloco são somadas em `metricas`, se informado.
+    """
+    chunk_size = max(int(chunk_size), 1)
+    inicios = range(0, len(descs_item), chunk_size)
+    blocos = [
+        (descs_item[i:i + chunk_size], ncms_item[i:i + chunk_size], similarity_threshold, batch_size,
+         metricas is not None, similarity_method, ncm_prefix)
+        for i in inicios
+    ]
+    pool = None
+    if workers <= 1 or len(blocos) <= 1:
+        resultados = (_match_chunk(bloco, base_index) for bloco in blocos)
+    else:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(blocos)), mp_context=_contexto_processos(),
+                                   initializer=_init_worker, initargs=(base_index,))
+        # map preserva a ordem dos blocos e entrega cada um assim que estiver pronto
+        resultados = pool.map(_match_chunk, blocos)
+    try:
+        for inicio, (resultado, metricas_bloco) in zip(inicios, resultados):
+            if metricas is not None:
+                metricas.merge(metricas_bloco, inicio)
+            yield inicio, resultado
+    finally:
+        # Se o consumidor parar no meio (cancelamento), descarta os blocos pendentes
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+def match_labels(posicoes, scores, tipos, base_index):
+    """Monta o texto da coluna 'ITEM CONSIDERADO' a partir dos resultados de match_rows (ver export_frame)."""
+    labels = []
+    for pos, score, tipo in zip(posicoes.tolist(), scores.tolist(), tipos.tolist()):
+        if tipo == MATCH_EXATO:
+            labels.append(f'Descrição Exata: {base_index.descs[pos]}')
+        elif tipo == MATCH_PALAVRAS:
+            labels.append(f'Palavras/NCM: {base_index.descs[pos]}')
+        elif tipo == MATCH_SIMILARIDADE:
+            labels.append(f'Similaridade ({score}%): {base_index.descs[pos]}')
+        elif tipo == MATCH_NENHUM:
+            labels.append('Nenhuma correspondência encontrada')
+        else:
+            labels.append('')
+    return labels
+
+def apply_match_results(df, posicoes, scores, tipos, base_index):
+    """Grava no DataFrame, coluna a coluna, os valores da base e as marcações de alteração."""
+    encontrados = posicoes >= 0
+    pos_base = np.where(encontrados, posicoes, 0)
+    comparacoes = zip(RESULT_BASE_COLUMNS, (base_index.ncms, base_index.aliqs, base_index.tributacoes,
+                                            base_index.cests))
+    for coluna, valores_base in comparacoes:
+        valores = np.array([str(v).strip() for v in df[coluna]], dtype=object)
+        if not base_index.descs:
+            alterado = np.zeros(len(df), dtype=bool)
+        else:
+            valores_base = np.array([valores_base[pos] for pos in pos_base.tolist()], dtype=object)
+            # Compara e atualiza os campos, marcando as alterações
+            alterado = encontrados & (valores != valores_base)
+            valores[alterado] = valores_base[alterado]
+        df[coluna] = pd.Categorical(valores)
+        df[f'{coluna} Alterado'] = alterado
+
+    # O item considerado fica como posição na base; o texto é montado só na exportação (export_frame)
+    df['ITEM BASE'] = np.where(encontrados, posicoes, -1).astype(np.int32)
+    df['CORRESPONDENCIA'] = pd.Categorical.from_codes(_CODIGO_TIPO[np.asarray(tipos) + 1],
+                                                      categories=list(MATCH_ROTULOS.values()))
+    df['SIMILARIDADE'] = np.where(encontrados, scores, 0).astype(np.int32)
+    return df
+
+def export_frame(result_df, base_index):
+    """Resultado no layout de exportação: 'ITEM CONSIDERADO' em texto no lugar de 'ITEM BASE'/'CORRESPONDENCIA'.
+
+    Os textos são montados uma vez por combinação distinta de item, tipo e pontuação;
+    as linhas repetidas compartilham o mesmo texto. `base_index` é o índice usado na
+    auditoria (AuditState.base_index): as posições se referem a ele.
+    """
+    posicoes = result_df['ITEM BASE'].to_numpy(dtype=np.int64)
+    tipos = np.asarray(MATCH_TIPOS, dtype=np.int64)[result_df['CORRESPONDENCIA'].cat.codes.to_numpy()]
+    scores = np.where(tipos == MATCH_SIMILARIDADE, result_df['SIMILARIDADE'].to_numpy(dtype=np.int64), 0)
+    chaves = (posicoes + 1) * 1024 + scores * 8 + (tipos + 1) # Pontuação <= 100 e tipo + 1 <= 4
+    _, primeiras, inverso = np.unique(chaves, return_index=True, return_inverse=True)
+    textos = np.array(match_labels(posicoes[primeiras], scores[primeiras], tipos[primeiras], base_index), dtype=object)
+    saida = result_df.drop(columns=['ITEM BASE', 'CORRESPONDENCIA'])
+    saida.insert(result_df.columns.get_loc('ITEM BASE'), 'ITEM CONSIDERADO', textos[inverso.reshape(-1)])
+    return saida
+
+def concat_results(blocos):
+    """Junta os blocos de resultado (AuditProgress.bloco) mantendo as colunas categóricas.
+
+    pd.concat converteria para texto as colunas cujas categorias diferem entre os blocos.
+    As categorias ficam ordenadas, como em pd.Categorical: o resultado não depende da divisão em blocos.
+    """
+    blocos = list(blocos)
+    if len(blocos) == 1:
+        return blocos[0]
+    for coluna in [col for col in blocos[0].columns if isinstance(blocos[0][col].dtype, pd.CategoricalDtype)]:
+        if all(bloco[coluna].cat.categories.equals(blocos[0][coluna].cat.categories) for bloco in blocos):
+            continue # Categorias fixas (ex.: 'CORRESPONDENCIA') ou iguais em todos os blocos
+        categorias = np.unique(np.concatenate([bloco[coluna].cat.categories.to_numpy(dtype=object)
+                                               for bloco in blocos]))
+        blocos = [bloco.assign(**{coluna: bloco[coluna].cat.set_categories(categorias)}) for bloco in blocos]
+    return pd.concat(blocos)
+
+def prepare_audit_df(df):
+    """Padroniza as colunas da planilha de auditoria e cria as colunas de controle."""
+    # Garante a existência e limpeza inicial das colunas no DataFrame de entrada
+    if 'NCM' not in df.columns:
+        df['NCM'] = ''
+    else:
+        df['NCM'] = df['NCM'].astype(str).str.replace('\.0$', '', regex=True).str.strip()
+
+    # Padroniza nomes de coluna de entrada (exemplo)
+    df.columns = df.columns.str.strip().str.upper().str.replace('.', '', regex=False)
+    col_mapping_audit = {
+        'DESCRIÇÃO ITEM': 'Descrição item', 'DESCRICAO ITEM': 'Descrição item',
+        'NCM': 'NCM',
+        'ALIQ ICMS': 'Aliq. ICMS', 'ALIQUOTA ICMS': 'Aliq. ICMS',
+        'TRIBUTAÇÃO': 'TRIBUTACAO', 'TRIBUTACAO': 'TRIBUTACAO',
+        'CEST': 'CEST'
+    }
+    df.rename(columns=col_mapping_audit, inplace=True)
+
+    if 'Aliq. ICMS' not in df.columns:
+        df['Aliq. ICMS'] = ''
+    else:
+        df['Aliq. ICMS'] = df['Aliq. ICMS'].astype(str).str.strip()
+
+    # Usa o nome padronizado sem Ç
+    if 'TRIBUTACAO' not in df.columns:
+        df['TRIBUTACAO'] = ''
+    else:
+        df['TRIBUTACAO'] = df['TRIBUTACAO'].astype(str).str.strip()
+
+    if 'CEST' not in df.columns:
+        df['CEST'] = '0'
+    df['CEST'] = df['CEST'].apply(clean_cest)
+
+    # Inicializa colunas de controle
+    df['NCM Alterado'] = False
+    df['Aliq. ICMS Alterado'] = False
+    df['TRIBUTACAO Alterado'] = False # Nome interno sem Ç
+    df['CEST Alterado'] = False
+    df['ITEM BASE'] = np.full(len(df), -1, dtype=np.int32)
+    df['CORRESPONDENCIA'] = pd.Categorical.from_codes(np.full(len(df), _CODIGO_TIPO[MATCH_SEM_DESCRICAO + 1]),
+                                                      categories=list(MATCH_ROTULOS.values()))
+    df['SIMILARIDADE'] = np.zeros(len(df), dtype=np.int32)
+
+    return df
+
+class AuditState:
+    """Resultado do matching de cada linha de uma planilha e a versão da base usada.
+
+    Preenchido por iter_process_planilha/process_planilha (parâmetro `estado`) e usado
+    por reaudit_planilha para reprocessar só as linhas afetadas pelas alterações feitas
+    na base (BaseIndex.alteracoes) desde a auditoria.
+    """
+
+    def __init__(self):
+        self.base_index = None
+        self.versao = 0    # BaseIndex.version() no início da auditoria
+        self.n_base = 0    # Itens na base no início da auditoria; posições >= n_base são itens novos
+        self.parametros = None
+        self.ncms_base = None # NCMs da base no início da auditoria (só com ncm_prefix; ver _linhas_afetadas)
+        self.descs_item = []
+        self.ncms_item = []
+        self.posicoes = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0, dtype=np.int32) # Similaridade 0-100; Palavras/NCM 10 por palavra (+50 com o NCM)
+        self.tipos = np.zeros(0, dtype=np.int8)
+        self.processadas = 0
+
+    def _iniciar(self, base_index, descs_item, ncms_item, parametros):
+        self.base_index = base_index
+        self.n_base = len(base_index.descs) # Antes da versão: um item incluído entre as duas leituras conta como novo
+        self.versao = base_index.version()
+        self.parametros = parametros
+        self.ncms_base = list(base_index.ncms) if parametros[3] else None
+        self.descs_item, self.ncms_item = descs_item, ncms_item
+        total = len(descs_item)
+        self.posicoes = np.full(total, -1, dtype=np.int32)
+        self.scores = np.zeros(total, dtype=np.int32)
+        self.tipos = np.full(total, MATCH_NENHUM, dtype=np.int8)
+        self.processadas = 0
+
+    def _registrar(self, inicio, posicoes, scores, tipos):
+        fim = inicio + len(posicoes)
+        self.posicoes[inicio:fim], self.scores[inicio:fim], self.tipos[inicio:fim] = posicoes, scores, tipos
+        self.processadas += len(posicoes)
+
+    def memory_usage(self):
+        """Tamanho aproximado em bytes (arrays e textos das linhas), para limitar caches."""
+        # Linhas repetidas compartilham o texto: conta cada texto distinto e as referências de cada linha
+        textos = sum(len(texto) + 50 for texto in {*self.descs_item, *self.ncms_item}) + 16 * len(self.descs_item)
+        base = 8 * len(self.ncms_base) if self.ncms_base is not None else 0 # Só referências a textos da base
+        return self.posicoes.nbytes + self.scores.nbytes + self.tipos.nbytes + textos + base
+
+    def can_reaudit(self, base_index, similarity_threshold=SIMILARITY_THRESHOLD, batch_size=FUZZY_BATCH_SIZE,
+                    similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+        """True se a auditoria foi concluída sobre este mesmo `base_index` e com os mesmos parâmetros."""
+        return (self.base_index is base_index and self.processadas == len(self.descs_item)
+                and self.parametros == (similarity_threshold, batch_size, similarity_method, bool(ncm_prefix)))
+
+    def _linhas_afetadas(self, versao):
+        """Linhas a refazer por completo e linhas que só precisam comparar a similaridade com os itens novos.
+
+        Um item alterado só muda valores e NCM (a descrição é a chave), então afeta as
+        linhas que o usaram e as que têm o seu NCM (a pontuação Palavras/NCM pode subir),
+        exceto as de correspondência exata, que não chegam à etapa 2.
+        Um item novo pode virar a correspondência exata (mesma descrição normalizada),
+        a de palavras/NCM (palavra ou NCM em comum) ou a de similaridade das linhas que
+        chegaram à etapa 3. Considera as alterações até a `versao` da base.
+        Com SIMILARITY_TFIDF, um item novo muda o idf e, com ele, a pontuação de todos os
+        itens: as linhas da etapa 3 são refeitas por completo. Com ncm_prefix, um item
+        incluído ou com NCM alterado muda os candidatos dos níveis do NCM antigo e do novo:
+        as linhas do mesmo capítulo são refeitas, e as da etapa 3 sempre que há itens novos.
+        """
+        base = self.base_index
+        pendentes = set(base.alteracoes[self.versao:versao])
+        alterados = sorted(pos for pos in pendentes if pos < self.n_base)
+        novos = sorted(pos for pos in pendentes if pos >= self.n_base)
+
+        refazer = np.isin(self.posicoes, alterados)
+        ncms = {base.ncms[pos] for pos in pendentes} - {''}
+        palavras = set().union(*(base.palavras[pos] for pos in novos))
+        chaves = {normalize_description(base.descs[pos]) for pos in novos} - {''}
+        capitulos = set() # Capítulos (2 dígitos) cujos níveis de NCM ganharam ou perderam itens
+        if self.ncms_base is not None:
+            for pos in pendentes:
+                antigo = self.ncms_base[pos] if pos < self.n_base else None
+                if antigo != base.ncms[pos]:
+                    capitulos.update(ncm_prefixes(antigo or '')[-1:], ncm_prefixes(base.ncms[pos])[-1:])
+        tipos = self.tipos.tolist()
+        for i, (desc_item, ncm_item) in enumerate(zip(self.descs_item, self.ncms_item)):
+            if not desc_item or refazer[i]:
+                continue
+            if tipos[i] == MATCH_EXATO: # Não passa pela etapa 2: só um item novo com a mesma chave a afeta
+                refazer[i] = bool(chaves) and normalize_description(desc_item) in chaves
+            elif (ncm_item in ncms or (palavras and not palavras.isdisjoint(get_keywords(desc_item)))
+                  or (chaves and normalize_description(desc_item) in chaves)
+                  or (capitulos and not capitulos.isdisjoint(ncm_prefixes(ncm_item)[-1:]))):
+                refazer[i] = True
+
+        etapa_similaridade = np.isin(self.tipos, (MATCH_SIMILARIDADE, MATCH_NENHUM)) & ~refazer
+        # Um item de descrição vazia pode ter sido o melhor em Palavras/NCM sem ser aceito; a
+        # pontuação dele limita a similaridade dessas linhas, que então são refeitas por completo
+        pos_vazio = base.posicoes.get('')
+        if (pos_vazio is not None and (novos or pos_vazio in alterados)) or (
+                novos and (self.parametros[2] == SIMILARITY_TFIDF or self.parametros[3])):
+            refazer |= etapa_similaridade
+            etapa_similaridade[:] = False
+        elif not novos:
+            etapa_similaridade[:] = False
+        return np.flatnonzero(refazer), np.flatnonzero(etapa_similaridade), novos
+
+def group_rows(descs_item, ncms_item):
+    """Agrupa as linhas com a mesma descrição (já em minúsculas) e o mesmo NCM.
+
+    Retorna (posição da primeira linha de cada grupo, número do grupo de cada linha);
+    os grupos são numerados na ordem da primeira ocorrência.
+    """
+    numeros = {}
+    grupos = np.fromiter((numeros.setdefault(chave, len(numeros)) for chave in zip(descs_item, ncms_item)),
+                         dtype=np.int64, count=len(descs_item))
+    primeiras = np.full(len(numeros), len(grupos), dtype=np.int64)
+    np.minimum.at(primeiras, grupos, np.arange(len(grupos)))
+    return primeiras, grupos
+
+def match_distinct(descs_item, ncms_item, base_index, similarity_threshold=SIMILARITY_THRESHOLD,
+                   batch_size=FUZZY_BATCH_SIZE, metricas=None, similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+    """match_rows comparando cada (descrição, NCM) distinto uma vez e repetindo o resultado nas cópias."""
+    primeiras, grupos = group_rows(descs_item, ncms_item)
+    metricas_grupos = AuditMetrics() if metricas is not None else None
+    posicoes, scores, tipos = match_rows([descs_item[i] for i in primeiras], [ncms_item[i] for i in primeiras],
+                                         base_index, similarity_threshold, batch_size, metricas_grupos,
+                                         similarity_method, ncm_prefix)
+    if metricas is not None:
+        metricas.merge(metricas_grupos, linhas=primeiras)
+    return posicoes[grupos], scores[grupos], tipos[grupos]
+
+def iter_process_planilha(df, configs, base_index=None, similarity_threshold=SIMILARITY_THRESHOLD,
+                          batch_size=FUZZY_BATCH_SIZE, workers=1, chunk_size=AUDIT_CHUNK_SIZE, metricas=None,
+                          estado=None, similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+    """Processa a planilha de auditoria em blocos, gerando um AuditProgress a cada bloco concluído.
+
+    Cada `AuditProgress.bloco` traz as linhas já auditadas do bloco; juntá-los com
+    concat_results resulta no mesmo DataFrame de process_planilha. Interromper a iteração cancela
+    o processamento restante. Uma planilha vazia gera um único bloco vazio.
+    Linhas com a mesma descrição e NCM são comparadas com a base uma única vez.
+    Com `metricas` (AuditMetrics), registra tempos por etapa, contagens por tipo de
+    correspondência e as linhas mais lentas (número da linha a partir de 0). Um
+    AuditState passado em `estado` recebe o resultado de cada linha (ver reaudit_planilha).
+    """
+    medir_etapa = metricas.stage if metricas is not None else (lambda etapa: nullcontext())
+    if similarity_method not in SIMILARITY_METHODS:
+        raise ValueError(f"Método de similaridade desconhecido: '{similarity_method}'.")
+    if base_index is None:
+        with medir_etapa('indice_base'):
+            base_index = BaseIndex.from_configs(configs)
+    if similarity_method == SIMILARITY_TFIDF:
+        # Montado antes dos blocos: no modo paralelo segue pronto, com a base, para os processos
+        with medir_etapa('indice_similaridade'):
+            base_index.tfidf()
+    if ncm_prefix:
+        with medir_etapa('indice_ncm'):
+            base_index.ncm_prefix_index()
+
+    with medir_etapa('preparacao'):
+        df = prepare_audit_df(df)
+        # Linhas repetidas compartilham o mesmo texto (o AuditState guarda estas listas)
+        distintos = {}
+        if 'Descrição item' in df.columns:
+            descs_item = [distintos.setdefault(desc, desc) for desc in (str(v).strip().lower()
+                                                                       for v in df['Descrição item'])]
+        else:
+            descs_item = [''] * len(df)
+        ncms_item = [distintos.setdefault(ncm, ncm) for ncm in (str(v).strip() for v in df['NCM'])]
+    if estado is not None:
+        estado._iniciar(base_index, descs_item, ncms_item, (similarity_threshold, batch_size, similarity_method,
+                                                                 bool(ncm_prefix)))
+
+    total = len(df)
+    if total == 0:
+        yield AuditProgress(df, 0, 0, {tipo: 0 for tipo in MATCH_TIPOS})
+        return
+
+    # Linhas repetidas (mesma descrição e NCM) são comparadas com a base uma vez só
+    primeiras, grupos = group_rows(descs_item, ncms_item)
+    n_grupos = len(primeiras)
+    posicoes_grupos = np.full(n_grupos, -1, dtype=np.int64)
+    scores_grupos = np.zeros(n_grupos, dtype=np.int64)
+    tipos_grupos = np.full(n_grupos, MATCH_NENHUM, dtype=np.int8)
+    # Os grupos são numerados na ordem da primeira ocorrência: a linha i fica pronta quando
+    # todos os grupos até o maior visto nas linhas 0..i tiverem sido comparados
+    maior_grupo = np.maximum.accumulate(grupos)
+    if metricas is not None:
+        metricas.count('linhas_distintas', n_grupos)
+    metricas_grupos = AuditMetrics() if metricas is not None else None
+
+    contagens = {tipo: 0 for tipo in MATCH_TIPOS}
+    processadas = 0
+    try:
+        for inicio, (posicoes, scores, tipos) in iter_match_blocks(
+                [descs_item[i] for i in primeiras], [ncms_item[i] for i in primeiras], base_index, workers,
+                similarity_threshold, batch_size, chunk_size, metricas_grupos, similarity_method, ncm_prefix):
+            fim = inicio + len(posicoes)
+            posicoes_grupos[inicio:fim], scores_grupos[inicio:fim], tipos_grupos[inicio:fim] = posicoes, scores, tipos
+            prontas = int(np.searchsorted(maior_grupo, fim))
+            grupos_bloco = grupos[processadas:prontas]
+            posicoes, scores, tipos = posicoes_grupos[grupos_bloco], scores_grupos[grupos_bloco], tipos_grupos[grupos_bloco]
+            if estado is not None:
+                estado._registrar(processadas, posicoes, scores, tipos)
+            # Grava os resultados do bloco coluna a coluna; cada linha é comparada com os próprios valores
+            with medir_etapa('gravacao_resultados'):
+                bloco = apply_match_results(df.iloc[processadas:prontas].copy(), posicoes, scores, tipos, base_index)
+            for tipo, quantidade in zip(*np.unique(tipos, return_counts=True)):
+                contagens[int(tipo)] += int(quantidade)
+                if metricas is not None:
+                    metricas.count(f'linhas_{MATCH_NOMES[int(tipo)]}', quantidade)
+            processadas = prontas
+            yield AuditProgress(bloco, processadas, total, dict(contagens))
+    finally:
+        if metricas is not None: # Tempos por grupo atribuídos à primeira linha do grupo
+            metricas.merge(metricas_grupos, linhas=primeiras)
+
+def process_planilha(df, configs, base_index=None, similarity_threshold=SIMILARITY_THRESHOLD,
+                     batch_size=FUZZY_BATCH_SIZE, workers=1, metricas=None, estado=None,
+                     similarity_method=SIMILARITY_FUZZY, ncm_prefix=False):
+    """Processa a planilha de auditoria comparando com as configurações.
+
+    `base_index` pode ser um BaseIndex já montado para `configs`; se omitido, é montado aqui.
+    `similarity_threshold` e `batch_size` controlam a etapa de similaridade e `similarity_method`
+    escolhe como ela compara (SIMILARITY_FUZZY ou SIMILARITY_TFIDF; ver match_rows). Com
+    `ncm_prefix`, as etapas 2 e 3 procuram primeiro entre os itens que compartilham o NCM
+    da linha, do item ao capítulo, antes da base inteira (desligado por padrão).
+    Com `workers` > 1 o matching roda em paralelo; o modo serial (`workers=1`) é a
+    referência de resultado. Para acompanhar o progresso use iter_process_planilha;
+    para medir as etapas, passe um AuditMetrics em `metricas`; para permitir uma
+    reauditoria incremental, um AuditState em `estado`.
+    O resultado é compacto: as colunas da base (RESULT_BASE_COLUMNS) são categóricas, as
+    marcações de alteração são bool e o item considerado é a posição na base ('ITEM BASE',
+    -1 sem correspondência) com o tipo em 'CORRESPONDENCIA'; export_frame monta o layout
+    de exportação, com o texto de 'ITEM CONSIDERADO'.
+    """
+    blocos = [progresso.bloco for progresso in iter_process_planilha(df, configs, base_index, similarity_threshold,
+                                                                     batch_size, workers, metricas=metricas,
+                                                                     estado=estado,
+                                                                     similarity_method=similarity_method,
+                                                                     ncm_prefix=ncm_prefix)]
+    return concat_results(blocos)
+
+def reaudit_planilha(df, result_df, estado, metricas=None):
+    """Reaudita `df` depois de alterações na base, refazendo só as linhas afetadas.
+
+    `result_df` e `estado` são o resultado e o AuditState da auditoria anterior de `df`
+    (a planilha original, antes de prepare_audit_df); estado.can_reaudit() deve ser True
+    para a base atual. Retorna (novo resultado, novo AuditState, linhas reprocessadas),
+    iguais aos de uma auditoria completa; os objetos anteriores não são alterados.
+    """
+    base = estado.base_index
+    similarity_threshold, batch_size, similarity_method, ncm_prefix = estado.parametros
+    medir_etapa = metricas.stage if metricas is not None else (lambda etapa: nullcontext())
+    novo = AuditState()
+    novo._iniciar(base, estado.descs_item, estado.ncms_item, estado.parametros)
+    novo._registrar(0, estado.posicoes, estado.scores, estado.tipos)
+    with medir_etapa('linhas_afetadas'):
+        # Alterações feitas durante a reauditoria ficam para a próxima
+        refazer, etapa_similaridade, novos = estado._linhas_afetadas(novo.versao)
+    if len(refazer):
+        metricas_refazer = AuditMetrics() if metricas is not None else None
+        resultados = match_distinct([estado.descs_item[i] for i in refazer], [estado.ncms_item[i] for i in refazer],
+                                    base, similarity_threshold, batch_size, metricas_refazer, similarity_method,
+                                    ncm_prefix)
+        novo.posicoes[refazer], novo.scores[refazer], novo.tipos[refazer] = resultados
+        if metricas is not None:
+            metricas.merge(metricas_refazer, linhas=refazer)
+    trocadas = np.zeros(0, dtype=np.int64)
+    if len(etapa_similaridade):
+        # Só os itens novos podem mudar a similaridade destas linhas: comparadas apenas com eles. Com o
+        # desempate pelo primeiro item da base, um item novo só vence com pontuação maior que a anterior
+        with medir_etapa('similaridade'):
+            pos_novo, scores_novo = fuzzy_match_batch([estado.descs_item[i] for i in etapa_similaridade],
+                                                      [base.descs_lower[pos] for pos in novos],
+                                                      threshold=similarity_threshold, batch_size=batch_size)
+        anteriores = np.where(estado.tipos[etapa_similaridade] == MATCH_SIMILARIDADE,
+                              estado.scores[etapa_similaridade], -1)
+        vence = (pos_novo >= 0) & (scores_novo > anteriores)
+        trocadas = etapa_similaridade[vence]
+        novo.posicoes[trocadas] = np.asarray(novos, dtype=np.int64)[pos_novo[vence]]
+        novo.scores[trocadas] = scores_novo[vence]
+        novo.tipos[trocadas] = MATCH_SIMILARIDADE
+        if metricas is not None:
+            metricas.count('linhas_avaliadas_similaridade', len(etapa_similaridade))
+
+    linhas = np.union1d(refazer, trocadas)
+    resultado = result_df.copy()
+    if len(linhas):
+        with medir_etapa('gravacao_resultados'):
+            bloco = apply_match_results(prepare_audit_df(df.iloc[linhas].copy()), novo.posicoes[linhas],
+                                        novo.scores[linhas], novo.tipos[linhas], base)
+            for coluna in bloco.columns:
+                valores = bloco[coluna].to_numpy()
+                if isinstance(resultado[coluna].dtype, pd.CategoricalDtype):
+                    categorias = resultado[coluna].cat.categories
+                    novas = [valor for valor in pd.unique(valores) if valor not in categorias]
+                    if novas: # Mantém as categorias ordenadas, como em uma auditoria completa
+                        resultado[coluna] = resultado[coluna].cat.set_categories(sorted([*categorias, *novas]))
+                resultado.iloc[linhas, resultado.columns.get_loc(coluna)] = valores
+            for coluna in RESULT_BASE_COLUMNS: # Sem os valores que nenhuma linha usa mais, como na auditoria completa
+                resultado[coluna] = resultado[coluna].cat.remove_unused_categories()
+    if metricas is not None:
+        metricas.count('linhas_reprocessadas', len(linhas))
+        metricas.count('linhas_reaproveitadas', len(df) - len(linhas))
+    return resultado, novo, len(linhas)
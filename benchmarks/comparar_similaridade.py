@@ -0,0 +1,92 @@
+"""Compara os métodos da etapa de similaridade (fuzzy e TF-IDF) com dados sintéticos.
+
+Gera uma base e uma planilha só com linhas que chegam à etapa 3 na prática
+(variações de escrita, erros de digitação e itens desconhecidos) e passa as
+mesmas descrições por fuzzy_match_batch e tfidf_match_batch. Como a planilha
+sintética sabe de qual item cada linha veio, mede para cada método:
+
+    acertos      linhas conhecidas associadas ao item de origem
+    erros        linhas conhecidas associadas a outro item
+    sem_match    linhas conhecidas sem item acima do limiar
+    falsos       itens desconhecidos associados a algum item da base
+
+e também a concordância entre os métodos e, para o TF-IDF, em quantas linhas o
+item de origem aparece entre os k candidatos (match_alternatives):
+
+    python benchmarks/comparar_similaridade.py --base 20000 --linhas 5000 --limiares 60 70 80
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auditoria import (ALTERNATIVES_K, BaseIndex, fuzzy_match_batch, match_alternatives, # noqa: E402
+                       tfidf_match_batch)
+from dados_sinteticos import generate_audit, generate_base # noqa: E402
+
+def _avaliar(posicoes, origem):
+    conhecidas = origem >= 0
+    return {
+        'acertos': float(np.mean(posicoes[conhecidas] == origem[conhecidas])) if conhecidas.any() else None,
+        'erros': float(np.mean((posicoes[conhecidas] >= 0) & (posicoes[conhecidas] != origem[conhecidas])))
+                 if conhecidas.any() else None,
+        'sem_match': float(np.mean(posicoes[conhecidas] < 0)) if conhecidas.any() else None,
+        'falsos': float(np.mean(posicoes[~conhecidas] >= 0)) if (~conhecidas).any() else None,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara as etapas de similaridade fuzzy e TF-IDF.")
+    parser.add_argument('--base', type=int, default=5000, help="Itens na base de configurações.")
+    parser.add_argument('--linhas', type=int, default=2000, help="Linhas da planilha de auditoria.")
+    parser.add_argument('--limiares', type=int, nargs='+', default=[70], help="Limiares (%%) a comparar.")
+    parser.add_argument('--desconhecidos', type=float, default=0.1, help="Fração de itens que não estão na base.")
+    parser.add_argument('--k', type=int, default=ALTERNATIVES_K, help="Candidatos para a cobertura do top-k.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--saida', help="Grava os resultados neste JSON.")
+    args = parser.parse_args(argv)
+
+    configs = generate_base(args.base, seed=args.seed)
+    conhecidas = 1 - args.desconhecidos
+    audit_df = generate_audit(configs, args.linhas, seed=args.seed + 1, taxa_exata=0, taxa_variante=conhecidas / 2,
+                              taxa_erro=conhecidas / 2, taxa_divergencia=0, origem=True)
+    base_index = BaseIndex.from_configs(configs)
+    descs = [str(desc).strip().lower() for desc in audit_df['Descrição item']]
+    origem = np.array([base_index.posicoes[desc] if desc else -1 for desc in audit_df['Item de origem']])
+
+    inicio = time.perf_counter()
+    base_index.tfidf()
+    print(f"Índice TF-IDF: {time.perf_counter() - inicio:.2f} s para {args.base} itens")
+
+    resultados = []
+    for limiar in args.limiares:
+        posicoes = {}
+        for metodo, funcao in (('fuzzy', lambda: fuzzy_match_batch(descs, base_index.descs_lower, limiar)),
+                               ('tfidf', lambda: tfidf_match_batch(descs, base_index, limiar))):
+            inicio = time.perf_counter()
+            posicoes[metodo] = funcao()[0]
+            segundos = time.perf_counter() - inicio
+            resultados.append({'limiar': limiar, 'metodo': metodo, 'segundos': segundos,
+                               **_avaliar(posicoes[metodo], origem)})
+            print(f"limiar {limiar:>3}  {metodo:<6} {segundos:8.2f} s  "
+                  + "  ".join(f"{chave} {valor:.3f}" for chave, valor in resultados[-1].items()
+                              if chave not in ('limiar', 'metodo', 'segundos') and valor is not None))
+        print(f"limiar {limiar:>3}  concordância entre os métodos: {np.mean(posicoes['fuzzy'] == posicoes['tfidf']):.3f}")
+
+    candidatos = match_alternatives(descs, base_index, args.k)[0]
+    cobertura = float(np.mean((candidatos == origem[:, None]).any(axis=1)[origem >= 0]))
+    print(f"Item de origem entre os {args.k} candidatos TF-IDF: {cobertura:.3f}")
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump({'parametros': vars(args), 'resultados': resultados, 'cobertura_top_k': cobertura}, f,
+                      ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Gerador de bases e planilhas de auditoria sintéticas para os benchmarks.
+
+As descrições imitam cadastros de produtos de supermercado (produto, marca,
+variação e embalagem), com NCM/CEST coerentes por categoria. A planilha de
+auditoria mistura, nas proporções pedidas, linhas copiadas da base, variações
+de escrita (caixa, acentos, pontuação, abreviações), erros de digitação e itens
+desconhecidos; uma fração das linhas conhecidas recebe NCM/alíquota/CEST
+divergentes da base, que a auditoria deve corrigir.
+"""
+import random
+import unicodedata
+
+import pandas as pd
+
+# Categoria -> (NCM, CEST, alíquota, tributação, produtos)
+CATEGORIAS = {
+    'graos': ('10063021', '1703800', '7', 'TRIBUTADO', ['ARROZ', 'FEIJAO', 'LENTILHA', 'GRAO DE BICO', 'MILHO PIPOCA']),
+    'massas': ('19021900', '1704900', '12', 'TRIBUTADO', ['MACARRAO ESPAGUETE', 'MACARRAO PARAFUSO', 'LASANHA',
+                                                       'MIOJO', 'NHOQUE']),
+    'bebidas': ('22021000', '0300700', '25', 'ST', ['REFRIGERANTE', 'SUCO', 'AGUA MINERAL', 'ENERGETICO', 'CHA GELADO']),
+    'cervejas': ('22030000', '0302100', '25', 'ST', ['CERVEJA LATA', 'CERVEJA LONG NECK', 'CHOPP', 'CERVEJA PURO MALTE']),
+    'laticinios': ('04012010', '1701300', '7', 'ISENTO', ['LEITE INTEGRAL', 'LEITE DESNATADO', 'IOGURTE', 'QUEIJO MUSSARELA',
+                                                        'REQUEIJAO', 'MANTEIGA']),
+    'higiene': ('33051000', '2002800', '18', 'ST', ['SHAMPOO', 'CONDICIONADOR', 'SABONETE', 'CREME DENTAL', 'DESODORANTE']),
+    'limpeza': ('34022000', '1100500', '18', 'TRIBUTADO', ['DETERGENTE', 'SABAO EM PO', 'AMACIANTE', 'DESINFETANTE',
+                                                          'AGUA SANITARIA']),
+    'mercearia': ('17019900', '1703100', '7', 'TRIBUTADO', ['ACUCAR REFINADO', 'CAFE TORRADO', 'OLEO DE SOJA', 'SAL REFINADO',
+                                                           'FARINHA DE TRIGO', 'FUBA']),
+    'biscoitos': ('19053100', '1705300', '12', 'ST', ['BISCOITO RECHEADO', 'BOLACHA AGUA E SAL', 'BISCOITO MAISENA',
+                                                     'WAFER', 'ROSQUINHA']),
+    'carnes': ('02013000', '', '7', 'ISENTO', ['CARNE BOVINA', 'FRANGO CONGELADO', 'LINGUICA TOSCANA', 'PEITO DE PERU',
+                                              'BACON']),
+}
+MARCAS = ['TIO JOAO', 'CAMIL', 'DONA BENTA', 'NESTLE', 'ITALAC', 'PIRACANJUBA', 'SADIA', 'PERDIGAO', 'SEARA', 'YPE',
+          'OMO', 'COLGATE', 'DOVE', 'AMBEV', 'COCA COLA', 'GUARANA', 'VITARELLA', 'PILAR', 'SANTA AMALIA', 'MELITTA',
+          'PILAO', 'UNIAO', 'LIZA', 'BOM PRECO', 'QUALITA']
+VARIACOES = ['TRADICIONAL', 'INTEGRAL', 'LIGHT', 'ZERO', 'MORANGO', 'CHOCOLATE', 'LIMAO', 'NATURAL', 'EXTRA', 'PREMIUM',
+             'TIPO 1', 'FAMILIA', 'ORIGINAL', 'SUAVE', 'CONCENTRADO']
+EMBALAGENS = ['1KG', '5KG', '500G', '200G', '1L', '2L', '350ML', '600ML', '90G', 'CX 12UN', 'PCT 6UN', 'FD 30UN']
+ABREVIACOES = {'REFRIGERANTE': 'REFRIG', 'BISCOITO': 'BISC', 'DETERGENTE': 'DETERG', 'TRADICIONAL': 'TRAD',
+               'INTEGRAL': 'INTEG', 'CHOCOLATE': 'CHOC', 'CONDICIONADOR': 'COND', 'MACARRAO': 'MAC'}
+ALIQUOTAS = ['0', '7', '12', '18', '25']
+
+def _com_acentos(texto):
+    trocas = {'ACUCAR': 'AÇÚCAR', 'FEIJAO': 'FEIJÃO', 'MACARRAO': 'MACARRÃO', 'SABAO': 'SABÃO', 'REQUEIJAO': 'REQUEIJÃO',
+              'CAFE': 'CAFÉ', 'AGUA': 'ÁGUA', 'FUBA': 'FUBÁ', 'GRAO': 'GRÃO'}
+    for original, acentuado in trocas.items():
+        texto = texto.replace(original, acentuado)
+    return texto
+
+def _sem_acentos(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+def generate_base(n_itens, seed=0):
+    """Base de configurações sintética com `n_itens` descrições distintas: {descrição: valores}."""
+    rnd = random.Random(seed)
+    categorias = list(CATEGORIAS.values())
+    configs = {}
+    tentativas = 0
+    while len(configs) < n_itens:
+        tentativas += 1
+        ncm, cest, aliq, trib, produtos = rnd.choice(categorias)
+        partes = [rnd.choice(produtos), rnd.choice(MARCAS)]
+        if rnd.random() < 0.7:
+            partes.append(rnd.choice(VARIACOES))
+        partes.append(rnd.choice(EMBALAGENS))
+        desc = ' '.join(partes)
+        if desc in configs:
+            desc = f"{desc} {tentativas}" # Garante descrições distintas em bases grandes
+        if rnd.random() < 0.3:
+            ncm = ncm[:6] + f"{rnd.randint(0, 99):02d}" # Subposições diferentes dentro da categoria
+        configs[_com_acentos(desc) if rnd.random() < 0.2 else desc] = {
+            'NCM': ncm, 'ALIQ_ICMS': aliq, 'TRIBUTACAO': trib, 'CEST': cest or '0'
+        }
+    return configs
+
+def _variante(desc, rnd):
+    """Mesma descrição com outra escrita: caixa, acentos, pontuação ou abreviações."""
+    escolha = rnd.randrange(4)
+    if escolha == 0:
+        return desc.lower()
+    if escolha == 1:
+        return _sem_acentos(desc) if desc != _sem_acentos(desc) else _com_acentos(desc)
+    if escolha == 2:
+        return desc.replace(' ', ' - ', 1) + '.'
+    palavras = [ABREVIACOES.get(palavra, palavra) for palavra in desc.split()]
+    return ' '.join(palavras)
+
+def _erro_digitacao(desc, rnd):
+    caracteres = list(desc)
+    for _ in range(rnd.randint(1, 3)):
+        if not caracteres:
+            break
+        posicao = rnd.randrange(len(caracteres))
+        operacao = rnd.randrange(3)
+        if operacao == 0:
+            del caracteres[posicao]
+        elif operacao == 1:
+            caracteres.insert(posicao, rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ'))
+        else:
+            caracteres[posicao] = rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+    return ''.join(caracteres) or desc
+
+def generate_audit(configs, n_linhas, seed=1, taxa_exata=0.5, taxa_variante=0.2, taxa_erro=0.2, taxa_divergencia=0.3,
+                   origem=False):
+    """Planilha de auditoria sintética com `n_linhas` linhas a partir da base `configs`.
+
+    As taxas definem a fração de linhas copiadas, com variação de escrita e com erros
+    de digitação; o restante são itens desconhecidos. `taxa_divergencia` é a fração das
+    linhas conhecidas com NCM/alíquota/CEST diferentes da base. Com `origem`, a coluna
+    'Item de origem' traz a descrição da base que gerou a linha ('' para itens desconhecidos).
+    """
+    rnd = random.Random(seed)
+    descs = list(configs)
+    desconhecidos = generate_base(max(1, n_linhas // 10), seed=seed + 1000)
+    desconhecidos = [desc for desc in desconhecidos if desc not in configs] or ['ITEM DESCONHECIDO']
+    linhas = []
+    for _ in range(n_linhas):
+        sorteio = rnd.random()
+        if sorteio < taxa_exata + taxa_variante + taxa_erro:
+            desc = item_origem = rnd.choice(descs)
+            valores = dict(configs[desc])
+            if sorteio >= taxa_exata + taxa_variante:
+                desc = _erro_digitacao(desc, rnd)
+            elif sorteio >= taxa_exata:
+                desc = _variante(desc, rnd)
+            if rnd.random() < taxa_divergencia:
+                campo = rnd.choice(['NCM', 'ALIQ_ICMS', 'CEST'])
+                if campo == 'NCM':
+                    valores['NCM'] = f"{rnd.randint(10**7, 10**8 - 1)}"
+                elif campo == 'ALIQ_ICMS':
+                    valores['ALIQ_ICMS'] = rnd.choice([aliq for aliq in ALIQUOTAS if aliq != valores['ALIQ_ICMS']])
+                else:
+                    valores['CEST'] = f"{rnd.randint(10**6, 10**7 - 1)}"
+        else:
+            item_origem = ''
+            desc = rnd.choice(desconhecidos)
+            ncm, cest, aliq, trib, _ = rnd.choice(list(CATEGORIAS.values()))
+            valores = {'NCM': ncm, 'ALIQ_ICMS': aliq, 'TRIBUTACAO': trib, 'CEST': cest or '0'}
+        linha = {
+            'Descrição item': desc,
+            'NCM': valores['NCM'],
+            'Aliq. ICMS': valores['ALIQ_ICMS'],
+            'TRIBUTAÇÃO': valores['TRIBUTACAO'],
+            'CEST': valores['CEST'],
+            'Quantidade': rnd.randint(1, 500),
+            'Valor unitário': round(rnd.uniform(0.5, 150.0), 2),
+        }
+        if origem:
+            linha['Item de origem'] = item_origem
+        linhas.append(linha)
+    return pd.DataFrame(linhas)
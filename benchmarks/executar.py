@@ -0,0 +1,183 @@
+"""Benchmark do pipeline de auditoria, executado offline com dados sintéticos.
+
+Para cada tamanho de planilha, gera uma base e uma planilha de auditoria
+(benchmarks/dados_sinteticos.py), grava os arquivos de entrada em um diretório
+temporário e mede o tempo e o pico de memória (tracemalloc) de cada etapa:
+
+    carga_csv, indice, binario_gravar, binario_carregar, leitura_planilha,
+    auditoria, excel, pdf
+
+Os resultados vão para um JSON (com commit, versão do Python e parâmetros), que
+pode ser comparado com uma execução anterior para acompanhar regressões:
+
+    python benchmarks/executar.py --tamanhos 1000 10000 --base 5000 --saida atual.json
+    python benchmarks/executar.py --tamanhos 1000 10000 --comparar anterior.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from armazenamento import (load_base_binary, read_configurations_csv, save_base_binary, # noqa: E402
+                           write_configurations_csv)
+from auditoria import SIMILARITY_FUZZY, SIMILARITY_METHODS, BaseIndex, export_frame, process_planilha # noqa: E402
+from dados_sinteticos import generate_audit, generate_base # noqa: E402
+from exportacao import excel_download, write_pdf_report # noqa: E402
+from ingestao import read_table # noqa: E402
+
+ETAPAS = ('carga_csv', 'indice', 'binario_gravar', 'binario_carregar', 'leitura_planilha', 'auditoria', 'excel', 'pdf')
+ETAPAS_PLANILHA = ('leitura_planilha', 'auditoria', 'excel', 'pdf') # Etapas que escalam com as linhas da planilha
+# Etapas cujo resultado (ou arquivo) cada etapa usa
+DEPENDENCIAS = {
+    'indice': ('carga_csv',),
+    'binario_gravar': ('indice',),
+    'binario_carregar': ('binario_gravar',),
+    'auditoria': ('leitura_planilha', 'carga_csv', 'indice'),
+    'excel': ('auditoria', 'indice'),
+    'pdf': ('auditoria', 'indice'),
+}
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', '-C', RAIZ, 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _medir(funcao, memoria):
+    """Executa `funcao` e retorna (resultado, segundos, pico de memória em MB ou None)."""
+    gc.collect()
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        resultado = funcao()
+        segundos = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1] / 2**20 if memoria else None
+    finally:
+        if memoria:
+            tracemalloc.stop()
+    return resultado, segundos, pico
+
+def run_benchmark(tamanho, n_base, args, diretorio):
+    """Mede as etapas para uma planilha de `tamanho` linhas; retorna a lista de medições."""
+    configs = generate_base(n_base, seed=args.seed)
+    audit_df = generate_audit(configs, tamanho, seed=args.seed + 1, taxa_exata=args.exatas,
+                              taxa_variante=args.variantes, taxa_erro=args.erros, taxa_divergencia=args.divergencia)
+    caminho_csv = os.path.join(diretorio, f'base_{n_base}.csv')
+    caminho_binario = os.path.join(diretorio, f'base_{n_base}.npz')
+    caminho_planilha = os.path.join(diretorio, f'auditoria_{tamanho}.xlsx')
+    with open(caminho_csv, 'w', encoding='utf-8', newline='') as f:
+        write_configurations_csv(configs, f)
+    audit_df.to_excel(caminho_planilha, index=False)
+
+    estado = {}
+    etapas = [
+        ('carga_csv', lambda: read_configurations_csv(caminho_csv)[0]),
+        ('indice', lambda: BaseIndex.from_configs(estado['carga_csv'])),
+        ('binario_gravar', lambda: save_base_binary(estado['indice'], caminho_binario)),
+        ('binario_carregar', lambda: load_base_binary(caminho_binario)),
+        ('leitura_planilha', lambda: read_table(caminho_planilha)),
+        # process_planilha altera a planilha recebida: cada repetição audita uma cópia da planilha lida
+        ('auditoria', lambda: process_planilha(estado['leitura_planilha'].copy(), estado['carga_csv'], estado['indice'],
+                                               workers=args.workers, similarity_method=args.similaridade,
+                                               ncm_prefix=args.prefixo_ncm)),
+        # As exportações incluem a montagem dos textos do resultado compacto (export_frame)
+        ('excel', lambda: excel_download(export_frame(estado['auditoria'], estado['indice']))),
+        ('pdf', lambda: write_pdf_report(export_frame(estado['auditoria'], estado['indice']),
+                                         only_changed=args.pdf_alterados)),
+    ]
+    # Uma etapa pulada da qual outra etapa medida depende roda assim mesmo, só sem medição
+    necessarias = set()
+    for etapa in reversed(ETAPAS):
+        if etapa not in args.pular or etapa in necessarias:
+            necessarias.update(DEPENDENCIAS.get(etapa, ()))
+    medicoes = []
+    for etapa, funcao in etapas:
+        if etapa in args.pular:
+            if etapa in necessarias:
+                estado[etapa] = funcao()
+            continue
+        tempos = []
+        for _ in range(args.repeticoes):
+            resultado, segundos, _ = _medir(funcao, memoria=False)
+            tempos.append(segundos)
+        pico = _medir(funcao, memoria=True)[2] if args.memoria else None
+        estado[etapa] = resultado
+        medicoes.append({
+            'tamanho': tamanho, 'itens_base': n_base, 'etapa': etapa,
+            'segundos': min(tempos), 'segundos_todas': tempos,
+            'linhas_por_segundo': tamanho / min(tempos) if etapa in ETAPAS_PLANILHA and min(tempos) > 0 else None,
+            'pico_memoria_mb': pico,
+        })
+        texto_pico = f"{pico:8.1f} MB" if pico is not None else ''
+        print(f"{tamanho:>8} linhas  {etapa:<17} {min(tempos):9.3f} s {texto_pico}", flush=True)
+    return medicoes
+
+def comparar(atual, anterior_path):
+    """Mostra a razão de tempo (atual / anterior) por tamanho e etapa."""
+    with open(anterior_path, encoding='utf-8') as f:
+        anterior = {(m['tamanho'], m['etapa']): m for m in json.load(f)['resultados']}
+    print(f"\nComparação com {anterior_path} (tempo atual / anterior):")
+    for medicao in atual:
+        base = anterior.get((medicao['tamanho'], medicao['etapa']))
+        if base and base['segundos']:
+            razao = medicao['segundos'] / base['segundos']
+            alerta = '  <-- mais lento' if razao > 1.2 else ''
+            print(f"{medicao['tamanho']:>8} linhas  {medicao['etapa']:<17} {razao:6.2f}x{alerta}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark do pipeline de auditoria com dados sintéticos.")
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[1000, 10000], help="Linhas da planilha de auditoria.")
+    parser.add_argument('--base', type=int, default=5000, help="Itens na base de configurações.")
+    parser.add_argument('--exatas', type=float, default=0.5, help="Fração de linhas copiadas da base.")
+    parser.add_argument('--variantes', type=float, default=0.2, help="Fração de linhas com outra escrita da descrição.")
+    parser.add_argument('--erros', type=float, default=0.2, help="Fração de linhas com erros de digitação.")
+    parser.add_argument('--divergencia', type=float, default=0.3, help="Fração de linhas conhecidas com valores divergentes.")
+    parser.add_argument('--workers', type=int, default=1, help="Processos paralelos na etapa de auditoria.")
+    parser.add_argument('--similaridade', choices=SIMILARITY_METHODS, default=SIMILARITY_FUZZY,
+                        help="Método da etapa de similaridade na auditoria.")
+    parser.add_argument('--prefixo-ncm', action='store_true', help="Auditoria com a busca por prefixo de NCM.")
+    parser.add_argument('--repeticoes', type=int, default=1, help="Execuções por etapa (vale o menor tempo).")
+    parser.add_argument('--sem-memoria', dest='memoria', action='store_false',
+                        help="Não mede o pico de memória (evita uma execução extra com tracemalloc).")
+    parser.add_argument('--pdf-alterados', action='store_true', help="PDF só com as linhas alteradas.")
+    parser.add_argument('--pular', nargs='*', choices=ETAPAS, default=[],
+                        help="Etapas a não medir (ex.: pdf); as que outras etapas usam rodam sem medição.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--saida', default='benchmark_resultados.json', help="Arquivo JSON de saída.")
+    parser.add_argument('--comparar', help="JSON de uma execução anterior para comparação.")
+    args = parser.parse_args(argv)
+
+    resultados = []
+    with tempfile.TemporaryDirectory(prefix='benchmark-auditoria-') as diretorio:
+        for tamanho in args.tamanhos:
+            resultados.extend(run_benchmark(tamanho, args.base, args, diretorio))
+
+    saida = {
+        'commit': _commit(),
+        'data': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': vars(args),
+        'resultados': resultados,
+    }
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(saida, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados gravados em {args.saida}")
+    if args.comparar:
+        comparar(resultados, args.comparar)
+
+if __name__ == '__main__':
+    main()
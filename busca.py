@@ -0,0 +1,149 @@
+"""Índice de pesquisa da base de configurações (Aba 2).
+
+Montado uma vez a partir do BaseIndex e atualizado incrementalmente pelas
+alterações registradas nele (BaseIndex.version()), o índice responde a:
+
+- texto contido em qualquer campo (descrição, NCM, CEST, alíquota, tributação);
+- prefixo da descrição, do NCM, do CEST ou da tributação;
+- prefixo e faixa de NCM.
+
+As consultas retornam posições na ordem da base; page() recorta a página pedida.
+"""
+import bisect
+import re
+
+import numpy as np
+
+SEARCH_BLOCK_SIZE = 2048 # Itens por bloco de texto; uma alteração só remonta o bloco do item
+SEARCH_FIELDS = ('descs', 'ncms', 'cests', 'aliqs', 'tributacoes') # Atributos do BaseIndex pesquisáveis
+PREFIX_FIELDS = ('descs', 'ncms', 'cests', 'tributacoes')
+NCM_DIGITS = 8
+_SEPARADOR = '\x1f' # Separa os campos de um item no texto do bloco; não pode aparecer na consulta
+_NAO_DIGITO = re.compile(r'\D')
+
+def _ncm_digitos(ncm):
+    return _NAO_DIGITO.sub('', ncm)
+
+def _ncm_chave(ncm):
+    """NCM só com dígitos, completado à direita até 8 (o NCM '0713' vale como 07130000)."""
+    digitos = _ncm_digitos(ncm)
+    return digitos.ljust(NCM_DIGITS, '0') if digitos else ''
+
+def _texto(valor):
+    return valor.lower().replace('\n', ' ').replace(_SEPARADOR, ' ')
+
+class SearchIndex:
+    """Índice de pesquisa sobre as colunas de um BaseIndex."""
+
+    def __init__(self, base_index):
+        self.base_index = base_index
+        self.versao = base_index.version()
+        self._registros = [self._registro(pos) for pos in range(len(base_index.descs))]
+        self._blocos = {} # Número do bloco -> (texto concatenado, offsets de início de cada item)
+        self._ordenados = {
+            campo: sorted((_texto(valor), pos) for pos, valor in enumerate(getattr(base_index, campo)) if valor)
+            for campo in PREFIX_FIELDS
+        }
+        self._ncms = sorted((_ncm_chave(ncm), pos) for pos, ncm in enumerate(base_index.ncms) if _ncm_chave(ncm))
+
+    def _registro(self, pos):
+        return _SEPARADOR.join(_texto(getattr(self.base_index, campo)[pos]) for campo in SEARCH_FIELDS)
+
+    def sync(self):
+        """Aplica as alterações feitas no BaseIndex desde a última sincronização."""
+        base = self.base_index
+        pendentes = base.alteracoes[self.versao:]
+        self.versao = base.version()
+        for pos in dict.fromkeys(pendentes): # Sem repetição, na ordem das alterações
+            if pos < len(self._registros):
+                anteriores = self._registros[pos].split(_SEPARADOR)
+                self._registros[pos] = self._registro(pos)
+                for campo in PREFIX_FIELDS:
+                    valor_antigo = anteriores[SEARCH_FIELDS.index(campo)]
+                    if valor_antigo:
+                        lista = self._ordenados[campo]
+                        del lista[bisect.bisect_left(lista, (valor_antigo, pos))]
+                ncm_antigo = _ncm_chave(anteriores[SEARCH_FIELDS.index('ncms')])
+                if ncm_antigo:
+                    del self._ncms[bisect.bisect_left(self._ncms, (ncm_antigo, pos))]
+            else: # Itens novos sempre entram no fim da base
+                self._registros.append(self._registro(pos))
+            for campo in PREFIX_FIELDS:
+                valor = _texto(getattr(base, campo)[pos])
+                if valor:
+                    bisect.insort(self._ordenados[campo], (valor, pos))
+            ncm = _ncm_chave(base.ncms[pos])
+            if ncm:
+                bisect.insort(self._ncms, (ncm, pos))
+            self._blocos.pop(pos // SEARCH_BLOCK_SIZE, None)
+
+    def _bloco(self, numero):
+        bloco = self._blocos.get(numero)
+        if bloco is None:
+            registros = self._registros[numero * SEARCH_BLOCK_SIZE:(numero + 1) * SEARCH_BLOCK_SIZE]
+            offsets = [0]
+            for registro in registros:
+                offsets.append(offsets[-1] + len(registro) + 1)
+            bloco = ('\n'.join(registros), offsets)
+            self._blocos[numero] = bloco
+        return bloco
+
+    def contains(self, termo):
+        """Posições dos itens em que algum campo contém `termo` (sem diferenciar maiúsculas)."""
+        termo = termo.strip().lower().replace(_SEPARADOR, '').replace('\n', '')
+        if not termo:
+            return self.all()
+        encontrados = []
+        n_blocos = -(-len(self._registros) // SEARCH_BLOCK_SIZE)
+        for numero in range(n_blocos):
+            texto, offsets = self._bloco(numero)
+            inicio = texto.find(termo)
+            while inicio != -1:
+                item = bisect.bisect_right(offsets, inicio) - 1
+                encontrados.append(numero * SEARCH_BLOCK_SIZE + item)
+                inicio = texto.find(termo, offsets[item + 1]) # Continua a partir do próximo item
+        return np.asarray(encontrados, dtype=np.int64)
+
+    def prefix(self, termo, campos=PREFIX_FIELDS):
+        """Posições dos itens em que algum dos `campos` começa com `termo`."""
+        termo = _texto(termo.strip())
+        if not termo:
+            return self.all()
+        posicoes = set()
+        for campo in campos:
+            lista = self._ordenados[campo]
+            inicio = bisect.bisect_left(lista, (termo,))
+            fim = bisect.bisect_left(lista, (termo + '\U0010ffff',))
+            posicoes.update(pos for _, pos in lista[inicio:fim])
+        return np.asarray(sorted(posicoes), dtype=np.int64)
+
+    def ncm_prefix(self, prefixo):
+        """Posições dos itens cujo NCM (só dígitos) começa com `prefixo`."""
+        prefixo = _ncm_digitos(prefixo)
+        if not prefixo:
+            return self.all()
+        esquerda = bisect.bisect_left(self._ncms, (prefixo,))
+        direita = bisect.bisect_left(self._ncms, (prefixo + '\U0010ffff',))
+        return np.sort(np.fromiter((pos for _, pos in self._ncms[esquerda:direita]), dtype=np.int64))
+
+    def ncm_range(self, inicio, fim):
+        """Posições dos itens com NCM entre `inicio` e `fim`, inclusive.
+
+        Limites incompletos valem como prefixos: ncm_range('8471', '8473') vai de
+        84710000 a 84739999.
+        """
+        inicio = _ncm_digitos(inicio).ljust(NCM_DIGITS, '0')
+        fim = _ncm_digitos(fim).ljust(NCM_DIGITS, '9') if _ncm_digitos(fim) else '9' * NCM_DIGITS
+        esquerda = bisect.bisect_left(self._ncms, (inicio,))
+        direita = bisect.bisect_left(self._ncms, (fim + '\U0010ffff',))
+        return np.sort(np.fromiter((pos for _, pos in self._ncms[esquerda:direita]), dtype=np.int64))
+
+    def all(self):
+        return np.arange(len(self._registros), dtype=np.int64)
+
+    @staticmethod
+    def page(posicoes, pagina, por_pagina):
+        """Recorta a página `pagina` (a partir de 1) do resultado; retorna (posições, total de páginas)."""
+        total_paginas = max(1, -(-len(posicoes) // por_pagina))
+        pagina = min(max(1, pagina), total_paginas)
+        return posicoes[(pagina - 1) * por_pagina:pagina * por_pagina], total_paginas
@@ -0,0 +1,225 @@
+"""Exportação do resultado da auditoria (Excel com destaque e relatório PDF), sem dependência do Streamlit.
+
+O reportlab só é importado quando um PDF é gerado.
+"""
+import io
+import os
+import zipfile
+from functools import lru_cache
+
+import numpy as np
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+EXCEL_CONTROL_COLUMNS = ['NCM Alterado', 'Aliq. ICMS Alterado', 'TRIBUTACAO Alterado', 'CEST Alterado', 'SIMILARIDADE']
+EXCEL_HIGHLIGHTS = {'NCM': 'NCM Alterado', 'Aliq. ICMS': 'Aliq. ICMS Alterado', 'TRIBUTACAO': 'TRIBUTACAO Alterado',
+                    'CEST': 'CEST Alterado'} # Coluna destacada -> coluna de controle que indica a alteração
+
+def _valores_excel(serie):
+    """Valores da coluna como objetos Python, com ausentes (NaN/NaT/None) como célula vazia."""
+    valores = serie.tolist()
+    for posicao in np.flatnonzero(serie.isna().to_numpy()):
+        valores[posicao] = None
+    return valores
+
+def write_highlighted_excel(df, destino):
+    """Grava o resultado em Excel (`destino`: caminho ou arquivo) com as células alteradas em amarelo.
+
+    Usa um workbook write_only: linhas e estilos são gravados em uma única passada,
+    sem cópias do DataFrame e sem manter a planilha inteira em memória.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Resultado Auditoria')
+    yellow_fill = PatternFill(start_color='FFFFFF00', end_color='FFFFFF00', fill_type='solid') # Compartilhado por todas as células
+
+    colunas = [col for col in df.columns if col not in EXCEL_CONTROL_COLUMNS]
+    # Cabeçalho no estilo do to_excel do pandas: negrito, bordas finas e centralizado
+    negrito = Font(bold=True)
+    fina = Side(style='thin')
+    bordas = Border(left=fina, right=fina, top=fina, bottom=fina)
+    centralizado = Alignment(horizontal='center', vertical='top')
+    cabecalho = []
+    for col in colunas:
+        # Renomeia a coluna de tributação para exibição no Excel (com Ç)
+        celula = WriteOnlyCell(worksheet, value='TRIBUTAÇÃO' if col == 'TRIBUTACAO' else col)
+        celula.font, celula.border, celula.alignment = negrito, bordas, centralizado
+        cabecalho.append(celula)
+    worksheet.append(cabecalho)
+
+    destaques = [
+        (posicao, df[EXCEL_HIGHLIGHTS[col]].to_numpy(dtype=bool, na_value=False))
+        for posicao, col in enumerate(colunas) if EXCEL_HIGHLIGHTS.get(col) in df.columns
+    ]
+    linhas_destacadas = np.zeros(len(df), dtype=bool)
+    for _, alterado in destaques:
+        linhas_destacadas |= alterado
+
+    for indice, linha in enumerate(zip(*(_valores_excel(df[col]) for col in colunas))):
+        if linhas_destacadas[indice]:
+            linha = list(linha)
+            for posicao, alterado in destaques:
+                if alterado[indice]:
+                    celula = WriteOnlyCell(worksheet, value=linha[posicao])
+                    celula.fill = yellow_fill
+                    linha[posicao] = celula
+        worksheet.append(linha)
+    workbook.save(destino)
+
+def excel_download(df, file_name="resultado_auditoria.xlsx"):
+    """Gera o Excel com destaque em memória e retorna (dados, nome do arquivo, mime)."""
+    buffer = io.BytesIO()
+    write_highlighted_excel(df, buffer)
+    return buffer.getvalue(), file_name, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+PDF_FONT, PDF_FONT_SIZE = 'Helvetica', 7
+PDF_HEADER_FONT, PDF_HEADER_FONT_SIZE = 'Helvetica-Bold', 9
+PDF_MARGIN = 40
+PDF_LINE_HEIGHT = 11
+PDF_MAX_LINES_PER_CELL = 5
+PDF_ROWS_PER_PART = 10000 # Relatórios maiores são divididos em partes (um PDF por parte, em um .zip)
+PDF_COLUMN_WEIGHTS = {'Descrição item': 3, 'NCM': 1.5, 'CEST': 1, 'Aliq. ICMS': 1, 'TRIBUTAÇÃO': 1, 'ITEM CONSIDERADO': 2.5}
+PDF_TRUNCATION_MARK = ' [...]'
+
+@lru_cache(maxsize=None)
+def _medidor():
+    """Largura de um texto na fonte das células (stringWidth do reportlab, importado uma vez só)."""
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    return lambda texto: stringWidth(texto, PDF_FONT, PDF_FONT_SIZE)
+
+def _cabe(medir, texto, largura):
+    return medir(texto) <= largura
+
+def _maior_prefixo(medir, texto, largura):
+    """Tamanho do maior prefixo de `texto` que cabe em `largura` (mínimo 1 caractere)."""
+    total = 0.0
+    for posicao, caractere in enumerate(texto):
+        total += medir(caractere)
+        if total > largura:
+            return max(posicao, 1)
+    return len(texto)
+
+@lru_cache(maxsize=65536)
+def _quebrar_texto(texto, largura):
+    """Quebra `texto` em linhas que cabem em `largura` pontos, medidas com as métricas reais da fonte.
+
+    O resultado é cacheado: valores repetidos (NCM, tributação, alíquota...) são medidos uma vez só.
+    """
+    medir = _medidor()
+    linhas = []
+    atual = ''
+    for palavra in texto.split():
+        candidato = f"{atual} {palavra}" if atual else palavra
+        if _cabe(medir, candidato, largura):
+            atual = candidato
+            continue
+        if atual:
+            linhas.append(atual)
+        while not _cabe(medir, palavra, largura): # Palavra maior que a coluna: quebra por caracteres
+            corte = _maior_prefixo(medir, palavra, largura)
+            linhas.append(palavra[:corte])
+            palavra = palavra[corte:]
+        atual = palavra
+    if atual:
+        linhas.append(atual)
+    if len(linhas) > PDF_MAX_LINES_PER_CELL:
+        linhas = linhas[:PDF_MAX_LINES_PER_CELL]
+        ultima = linhas[-1]
+        while ultima and not _cabe(medir, ultima + PDF_TRUNCATION_MARK, largura):
+            ultima = ultima[:-1]
+        linhas[-1] = ultima + PDF_TRUNCATION_MARK
+    return tuple(linhas)
+
+def _linhas_pdf(df, only_changed):
+    """Posições das linhas que entram no relatório."""
+    if not only_changed:
+        return np.arange(len(df))
+    alteradas = np.zeros(len(df), dtype=bool)
+    for flag in EXCEL_HIGHLIGHTS.values():
+        if flag in df.columns:
+            alteradas |= df[flag].to_numpy(dtype=bool, na_value=False)
+    return np.flatnonzero(alteradas)
+
+def _gravar_pdf(df, posicoes, destino, titulo=None):
+    """Desenha as linhas `posicoes` de `df` em um PDF, página a página."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    colunas = [col for col in df.columns if not col.endswith('Alterado') and col != 'SIMILARIDADE']
+    nomes = ['TRIBUTAÇÃO' if col == 'TRIBUTACAO' else col for col in colunas] # Exibe com Ç no PDF
+
+    c = canvas.Canvas(destino, pagesize=letter)
+    width, height = letter
+    available_width = width - 2 * PDF_MARGIN
+    total_weight = sum(PDF_COLUMN_WEIGHTS.get(nome, 1) for nome in nomes)
+    col_widths = [(PDF_COLUMN_WEIGHTS.get(nome, 1) / total_weight) * available_width for nome in nomes]
+    col_x = [PDF_MARGIN + sum(col_widths[:i]) + 2 for i in range(len(nomes))] # Pequeno padding à esquerda
+    larguras_uteis = [largura - 4 for largura in col_widths]
+
+    # Textos só das linhas selecionadas, coluna a coluna (sem iterrows)
+    selecao = df.iloc[posicoes]
+    textos = [['' if valor is None else str(valor) for valor in _valores_excel(selecao[col])] for col in colunas]
+
+    def cabecalho():
+        y = height - PDF_MARGIN
+        c.setFont(PDF_HEADER_FONT, PDF_HEADER_FONT_SIZE)
+        if titulo:
+            c.drawString(PDF_MARGIN, y, titulo)
+            y -= PDF_LINE_HEIGHT * 1.5
+        for x, nome in zip(col_x, nomes):
+            c.drawString(x, y, nome)
+        return y - PDF_LINE_HEIGHT * 1.5
+
+    # As células de cada página vão em um único objeto de texto (bem mais rápido que um drawString por célula)
+    y_position = cabecalho()
+    texto_pagina = c.beginText()
+    texto_pagina.setFont(PDF_FONT, PDF_FONT_SIZE) # Fonte menor para caber mais
+    espaco_linha = PDF_LINE_HEIGHT * 0.9 # Espaçamento entre linhas dentro da célula
+    for linha in zip(*textos):
+        celulas = [_quebrar_texto(texto, largura) for texto, largura in zip(linha, larguras_uteis)]
+        n_linhas = max(1, max((len(celula) for celula in celulas), default=1))
+        if y_position - (n_linhas - 1) * espaco_linha < PDF_MARGIN: # A última linha da célula não cabe na página
+            c.drawText(texto_pagina)
+            c.showPage()
+            y_position = cabecalho()
+            texto_pagina = c.beginText()
+            texto_pagina.setFont(PDF_FONT, PDF_FONT_SIZE)
+        for x, celula in zip(col_x, celulas):
+            for numero, texto in enumerate(celula):
+                texto_pagina.setTextOrigin(x, y_position - numero * espaco_linha)
+                texto_pagina.textOut(texto)
+        y_position -= n_linhas * espaco_linha + PDF_LINE_HEIGHT * 0.3 # Espaço extra entre linhas da tabela
+    c.drawText(texto_pagina)
+    c.save()
+
+def write_pdf_report(df, only_changed=False, rows_per_part=PDF_ROWS_PER_PART):
+    """Gera o relatório PDF e retorna uma lista com os bytes de cada parte.
+
+    `only_changed` limita o relatório às linhas com alguma alteração (resumo).
+    Cada parte tem no máximo `rows_per_part` linhas e é gravada em um canvas
+    próprio, de modo que a memória fica limitada ao tamanho de uma parte.
+    """
+    posicoes = _linhas_pdf(df, only_changed)
+    resumo = f"Somente linhas alteradas: {len(posicoes)} de {len(df)}" if only_changed else None
+    blocos = [posicoes[inicio:inicio + rows_per_part] for inicio in range(0, len(posicoes), rows_per_part)] or [posicoes]
+    partes = []
+    for numero, bloco in enumerate(blocos, start=1):
+        titulo = resumo
+        if len(blocos) > 1:
+            titulo = f"{resumo + ' - ' if resumo else ''}Parte {numero} de {len(blocos)}"
+        buffer = io.BytesIO()
+        _gravar_pdf(df, bloco, buffer, titulo)
+        partes.append(buffer.getvalue())
+    return partes
+
+def pdf_download(df, only_changed=False, file_name="resultado_auditoria.pdf"):
+    """Gera o PDF em memória e retorna (dados, nome do arquivo, mime). Relatórios em partes vão em um .zip."""
+    partes = write_pdf_report(df, only_changed)
+    if len(partes) == 1:
+        return partes[0], file_name, "application/pdf"
+    base_nome = os.path.splitext(file_name)[0]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for numero, parte in enumerate(partes, start=1):
+            arquivo_zip.writestr(f"{base_nome}_parte_{numero}.pdf", parte)
+    return buffer.getvalue(), base_nome + '.zip', "application/zip"
@@ -0,0 +1,166 @@
+"""Leitura das planilhas enviadas (base e auditoria) com cabeçalhos padronizados.
+
+Aceita .xlsx, .csv e .parquet. Só as colunas pedidas são lidas, e os cabeçalhos
+passam uma única vez por normalize_header, compartilhado pelas abas 1 e 3 e pela
+carga de 'configuracoes.xlsx'. O .xlsx é lido pelo motor calamine, se o pacote
+python-calamine estiver instalado (bem mais rápido); senão, pelo openpyxl em modo
+read_only. O .parquet requer o pyarrow.
+"""
+import csv
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from auditoria import clean_cest
+
+SUPPORTED_EXTENSIONS = ['xlsx', 'csv', 'parquet']
+COLUMN_ALIASES = {
+    'DESCRIÇÃO ITEM': 'Descrição item', 'DESCRICAO ITEM': 'Descrição item',
+    'NCM': 'NCM',
+    'ALIQ ICMS': 'Aliq. ICMS', 'ALIQUOTA ICMS': 'Aliq. ICMS',
+    'TRIBUTAÇÃO': 'TRIBUTACAO', 'TRIBUTACAO': 'TRIBUTACAO',
+    'CEST': 'CEST'
+}
+BASE_COLUMNS = ['Descrição item', 'NCM', 'Aliq. ICMS', 'TRIBUTACAO', 'CEST'] # Colunas usadas da planilha da base
+BASE_REQUIRED_COLUMNS = ['Descrição item', 'NCM', 'Aliq. ICMS']
+TEXT_COLUMNS = ['NCM', 'CEST'] # Lidas como texto para preservar zeros à esquerda
+
+def normalize_header(nome):
+    """Limpa um cabeçalho (espaços, aspas, quebras de linha, pontos, caixa) e aplica os nomes padronizados."""
+    limpo = str(nome).strip().replace('"', '').replace('\n', '').replace('\r', '').upper().replace('.', '')
+    return COLUMN_ALIASES.get(limpo, limpo)
+
+def _excel_engine():
+    try:
+        import python_calamine # noqa: F401 (só verifica se o motor rápido está disponível)
+        return 'calamine'
+    except ImportError:
+        return 'openpyxl' # O pandas abre o workbook em modo read_only
+
+def _rebobinar(arquivo):
+    if hasattr(arquivo, 'seek'):
+        arquivo.seek(0)
+
+def _selecionar(nomes_originais, colunas):
+    """Nomes originais a ler (todos, se `colunas` for None) e quais deles devem ser lidos como texto."""
+    selecionados = [nome for nome in nomes_originais if colunas is None or normalize_header(nome) in colunas]
+    texto = {nome: str for nome in selecionados if normalize_header(nome) in TEXT_COLUMNS}
+    return selecionados, texto
+
+def _ler_xlsx(arquivo, colunas):
+    engine = _excel_engine()
+    nomes = pd.read_excel(arquivo, engine=engine, nrows=0).columns
+    _rebobinar(arquivo)
+    selecionados, texto = _selecionar(nomes, colunas)
+    if not selecionados:
+        return pd.DataFrame()
+    return pd.read_excel(arquivo, engine=engine, usecols=selecionados, dtype=texto)
+
+def _ler_csv(arquivo, colunas):
+    if hasattr(arquivo, 'read'):
+        bruto = arquivo.read()
+    else:
+        with open(arquivo, 'rb') as f:
+            bruto = f.read()
+    try:
+        conteudo = bruto.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        conteudo = bruto.decode('latin-1') # Planilhas exportadas pelo Excel em português
+    try:
+        delimitador = csv.Sniffer().sniff(conteudo[:2048]).delimiter
+    except csv.Error:
+        delimitador = ',' # Usa vírgula se não for possível detectar
+    nomes = pd.read_csv(io.StringIO(conteudo), sep=delimitador, nrows=0).columns
+    selecionados, texto = _selecionar(nomes, colunas)
+    if not selecionados:
+        return pd.DataFrame()
+    return pd.read_csv(io.StringIO(conteudo), sep=delimitador, usecols=selecionados, dtype=texto)
+
+def _como_texto(coluna):
+    """Coluna tipada do Parquet como texto, igual à lida do .csv: nulos continuam NaN e
+    inteiros guardados como float (coluna inteira com nulos) não ganham o '.0'."""
+    if pd.api.types.is_float_dtype(coluna) and np.all(np.mod(coluna.dropna(), 1) == 0):
+        coluna = coluna.astype('Int64')
+    texto = coluna.astype('string') # Mantém os nulos como pd.NA (astype(str) os troca por 'nan'/'None')
+    return texto.astype(object).where(texto.notna(), np.nan)
+
+def _ler_parquet(arquivo, colunas):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("A leitura de arquivos Parquet requer o pacote 'pyarrow'.")
+    nomes = pq.read_schema(arquivo).names
+    _rebobinar(arquivo)
+    selecionados, texto = _selecionar(nomes, colunas)
+    if not selecionados:
+        return pd.DataFrame()
+    df = pd.read_parquet(arquivo, columns=selecionados)
+    for nome in texto: # Colunas tipadas (ex.: NCM inteiro) viram texto como nos outros formatos
+        df[nome] = _como_texto(df[nome])
+    return df
+
+def read_table(arquivo, nome=None, colunas=None):
+    """Lê uma planilha .xlsx/.csv/.parquet e retorna um DataFrame com os cabeçalhos padronizados.
+
+    `arquivo` é um caminho ou um objeto de arquivo (ex.: upload do Streamlit); o formato
+    vem da extensão de `nome` (padrão: o nome do próprio arquivo). Se `colunas` for
+    informado, só as colunas cujo cabeçalho padronizado estiver na lista são lidas.
+    """
+    nome = nome or getattr(arquivo, 'name', None) or str(arquivo)
+    extensao = os.path.splitext(nome)[1].lower().lstrip('.')
+    leitores = {'xlsx': _ler_xlsx, 'csv': _ler_csv, 'parquet': _ler_parquet}
+    if extensao not in leitores:
+        raise ValueError(f"Formato de arquivo não suportado: '.{extensao}'. Use: {', '.join(SUPPORTED_EXTENSIONS)}.")
+    _rebobinar(arquivo)
+    df = leitores[extensao](arquivo, colunas)
+
+    # Padroniza os cabeçalhos; nomes repetidos após a limpeza recebem um sufixo numérico
+    vistos = {}
+    cabecalhos = []
+    for coluna in df.columns:
+        padrao = normalize_header(coluna)
+        vistos[padrao] = vistos.get(padrao, -1) + 1
+        cabecalhos.append(f"{padrao}{vistos[padrao]}" if vistos[padrao] else padrao)
+    df.columns = cabecalhos
+    return df
+
+def base_records(df):
+    """Converte a planilha da base em [(descrição, valores), ...], na ordem das linhas.
+
+    Trabalha coluna a coluna; linhas sem descrição são ignoradas. Sem a coluna
+    TRIBUTACAO, usa a alíquota; sem CEST, usa '0'.
+    """
+    descs = [str(valor).strip() for valor in df['Descrição item'].tolist()]
+    ncms = ['' if pd.isna(valor) else str(valor).strip() for valor in df['NCM'].tolist()]
+    aliqs = [str(valor).strip() for valor in df['Aliq. ICMS'].tolist()]
+    tribs = [str(valor).strip() for valor in df['TRIBUTACAO'].tolist()] if 'TRIBUTACAO' in df.columns else aliqs
+    if 'CEST' in df.columns:
+        cests = [clean_cest(valor) for valor in df['CEST'].tolist()] # Cada valor distinto é limpo uma vez
+    else:
+        cests = [clean_cest('0')] * len(descs)
+    return [
+        (desc, {'NCM': ncm, 'ALIQ_ICMS': aliq, 'TRIBUTACAO': trib, 'CEST': cest})
+        for desc, ncm, aliq, trib, cest in zip(descs, ncms, aliqs, tribs, cests) if desc
+    ]
+
+def upsert_records(configs, base_index, registros):
+    """Aplica os registros da base em `base_index`, em lote; `configs` é a visão da base (ConfigsView).
+
+    Retorna (itens adicionados, itens atualizados, [(desc, valores) realmente alterados]).
+    Itens reenviados com os mesmos valores não entram na lista de alterados.
+    """
+    adicionados = atualizados = 0
+    alterados = {}
+    for desc, valores in registros:
+        atual = alterados[desc] if desc in alterados else configs.get(desc)
+        if atual is None:
+            adicionados += 1
+        else:
+            atualizados += 1
+        if atual != valores:
+            alterados[desc] = valores # Descrição repetida na planilha: vale a última linha
+    for desc, valores in alterados.items():
+        base_index.add(desc, valores) # Atualiza os índices só com os itens alterados
+    return adicionados, atualizados, list(alterados.items())
@@ -0,0 +1,111 @@
+"""Métricas de uma auditoria: tempo por etapa, contadores de candidatos e linhas mais lentas.
+
+Um AuditMetrics é preenchido pelo motor (auditoria.py) quando passado em
+iter_process_planilha/process_planilha, e pela interface nas etapas de leitura e
+exportação. Os tempos das etapas de correspondência somam o tempo de cada linha;
+no modo paralelo, somam o tempo de todos os processos. O resultado pode ser
+exibido (to_dict) e registrado em um log JSON, uma linha por evento (log).
+"""
+import datetime
+import heapq
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+SLOWEST_ROWS = 20 # Linhas mais lentas guardadas por auditoria
+
+class AuditMetrics:
+    """Acumula tempos (s) por etapa, contadores e as linhas auditadas mais lentas."""
+
+    def __init__(self, max_linhas=SLOWEST_ROWS):
+        self.etapas = {}
+        self.contadores = {}
+        self.max_linhas = max_linhas
+        self._linhas = [] # Heap de (segundos, linha, descrição) com as mais lentas
+        self._lock = threading.Lock() # As exportações registram seus tempos em outras threads
+
+    def __getstate__(self): # Enviado entre processos no modo paralelo
+        estado = self.__dict__.copy()
+        del estado['_lock']
+        return estado
+
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._lock = threading.Lock()
+
+    def add_time(self, etapa, segundos):
+        with self._lock:
+            self.etapas[etapa] = self.etapas.get(etapa, 0.0) + segundos
+
+    def count(self, contador, quantidade=1):
+        with self._lock:
+            self.contadores[contador] = self.contadores.get(contador, 0) + int(quantidade)
+
+    @contextmanager
+    def stage(self, etapa):
+        """Mede o bloco `with` e soma o tempo à `etapa`."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(etapa, time.perf_counter() - inicio)
+
+    def timed(self, etapa, funcao, *args, **kwargs):
+        """Executa `funcao(*args, **kwargs)` medindo o tempo como `etapa` (útil em pool.submit)."""
+        with self.stage(etapa):
+            return funcao(*args, **kwargs)
+
+    def _guardar(self, item):
+        if len(self._linhas) < self.max_linhas:
+            heapq.heappush(self._linhas, item)
+        elif item > self._linhas[0]:
+            heapq.heapreplace(self._linhas, item)
+
+    def add_rows(self, tempos, descricoes, deslocamento=0):
+        """Considera as linhas de `tempos` (s por linha) para a lista das mais lentas."""
+        tempos = np.asarray(tempos, dtype=np.float64)
+        candidatas = np.arange(len(tempos))
+        if len(tempos) > self.max_linhas: # Só as candidatas a entrar na lista
+            candidatas = np.argpartition(tempos, -self.max_linhas)[-self.max_linhas:]
+        with self._lock:
+            for i in candidatas.tolist():
+                self._guardar((float(tempos[i]), i + deslocamento, descricoes[i]))
+
+    def merge(self, outro, deslocamento=0, linhas=None):
+        """Soma as métricas de `outro` (ex.: de um bloco), deslocando o número das linhas.
+
+        Se `linhas` for informado, a linha i de `outro` passa a ser linhas[i].
+        """
+        for etapa, segundos in outro.etapas.items():
+            self.add_time(etapa, segundos)
+        for contador, quantidade in outro.contadores.items():
+            self.count(contador, quantidade)
+        with self._lock:
+            for segundos, linha, desc in outro._linhas:
+                linha = int(linhas[linha]) if linhas is not None else linha + deslocamento
+                self._guardar((segundos, linha, desc))
+
+    def slowest_rows(self):
+        """[(segundos, linha, descrição), ...] da mais lenta para a mais rápida."""
+        with self._lock:
+            return sorted(self._linhas, reverse=True)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'etapas': dict(self.etapas),
+                'contadores': dict(self.contadores),
+                'linhas_mais_lentas': [
+                    {'linha': linha, 'segundos': segundos, 'descricao': desc}
+                    for segundos, linha, desc in sorted(self._linhas, reverse=True)
+                ],
+            }
+
+    def log(self, path, **extra):
+        """Acrescenta ao arquivo `path` uma linha JSON com as métricas atuais e os campos `extra`."""
+        registro = {'data': datetime.datetime.now().isoformat(timespec='seconds'), **extra, **self.to_dict()}
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
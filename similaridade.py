@@ -0,0 +1,154 @@
+"""Índice TF-IDF de n-gramas de caracteres das descrições da base (etapa de similaridade).
+
+Alternativa ao fuzz.ratio item a item: as descrições da base viram, uma única
+vez, vetores TF-IDF esparsos de trigramas de caracteres (sobre a descrição
+normalizada, com um espaço em cada ponta), guardados como listas invertidas
+(n-grama -> itens e pesos). Um lote de consultas é multiplicado pela matriz da
+base de uma vez: cada n-grama da consulta soma o seu peso vezes o peso do item em
+todos os itens que o contêm. Os n-gramas muito frequentes (listas longas) ficam em
+uma pequena matriz densa, multiplicada por BLAS. O resultado é a similaridade do cosseno (0-100) e
+top_k() devolve os k itens mais próximos de cada consulta.
+
+Implementado só com numpy (sem scipy/scikit-learn), como o restante do motor.
+"""
+import math
+
+import numpy as np
+
+NGRAM_SIZE = 3
+TFIDF_BLOCK_CELLS = 2**22 # Células (consultas x itens da base) da matriz densa de cada lote
+DENSE_NGRAMS = 256 # Máximo de n-gramas frequentes guardados em uma matriz densa (n-gramas x itens)
+DENSE_MIN_FRACTION = 1 / 64 # ... só os presentes em pelo menos esta fração dos itens
+DENSE_MAX_CELLS = 2**24 # ... e até este número de células (float32)
+
+def char_ngrams(texto, n=NGRAM_SIZE):
+    """N-gramas de caracteres de `texto` (já normalizado), com um espaço marcando o início e o fim."""
+    texto = f' {texto} '
+    return [texto[i:i + n] for i in range(len(texto) - n + 1)] if len(texto.strip()) else []
+
+class TfidfIndex:
+    """Vetores TF-IDF (tf sublinear, idf suavizado, norma L2) das descrições da base."""
+
+    def __init__(self, textos, n=NGRAM_SIZE):
+        self.n = n
+        self.tamanho = len(textos)
+        self.vocabulario = {} # N-grama -> número
+        linhas, colunas, contagens = [], [], []
+        for pos, texto in enumerate(textos):
+            frequencias = {}
+            for ngrama in char_ngrams(texto, n):
+                numero = self.vocabulario.setdefault(ngrama, len(self.vocabulario))
+                frequencias[numero] = frequencias.get(numero, 0) + 1
+            linhas.extend([pos] * len(frequencias))
+            colunas.extend(frequencias)
+            contagens.extend(frequencias.values())
+        linhas = np.asarray(linhas, dtype=np.int32)
+        colunas = np.asarray(colunas, dtype=np.int64)
+        pesos = 1.0 + np.log(np.asarray(contagens, dtype=np.float64))
+
+        # idf suavizado, como no TfidfVectorizer: log((1 + N) / (1 + df)) + 1
+        documentos = np.bincount(colunas, minlength=len(self.vocabulario))
+        self.idf = np.log((1.0 + self.tamanho) / (1.0 + documentos)) + 1.0
+        pesos *= self.idf[colunas]
+        normas = np.sqrt(np.bincount(linhas, weights=pesos ** 2, minlength=self.tamanho))
+        pesos /= np.where(normas > 0, normas, 1.0)[linhas]
+
+        # N-gramas frequentes: linhas de uma matriz densa; densos[g] é a linha do n-grama g, ou -1
+        limite = min(DENSE_NGRAMS, DENSE_MAX_CELLS // max(self.tamanho, 1))
+        frequentes = np.argsort(-documentos, kind='stable')[:limite]
+        frequentes = frequentes[documentos[frequentes] >= max(self.tamanho * DENSE_MIN_FRACTION, 1)]
+        self.densos = np.full(len(self.vocabulario), -1, dtype=np.int64)
+        self.densos[frequentes] = np.arange(len(frequentes))
+        self.matriz_densa = np.zeros((len(frequentes), self.tamanho), dtype=np.float32)
+        na_densa = self.densos[colunas] >= 0
+        self.matriz_densa[self.densos[colunas[na_densa]], linhas[na_densa]] = pesos[na_densa]
+        documentos[frequentes] = 0
+
+        # Listas invertidas dos demais: os itens do n-grama g ficam em itens[inicio[g]:inicio[g + 1]]
+        ordem = np.argsort(colunas, kind='stable')
+        ordem = ordem[~na_densa[ordem]]
+        self.itens = linhas[ordem]
+        self.pesos = pesos[ordem].astype(np.float32)
+        self.inicio = np.zeros(len(self.vocabulario) + 1, dtype=np.int64)
+        np.cumsum(documentos, out=self.inicio[1:])
+
+    def _vetor(self, texto):
+        """(números dos n-gramas conhecidos, pesos normalizados) de uma consulta."""
+        frequencias = {}
+        for ngrama in char_ngrams(texto, self.n):
+            numero = self.vocabulario.get(ngrama)
+            if numero is not None: # N-gramas que não existem na base não pontuam
+                frequencias[numero] = frequencias.get(numero, 0) + 1
+        colunas = np.fromiter(frequencias, dtype=np.int64, count=len(frequencias))
+        pesos = np.array([1.0 + math.log(c) for c in frequencias.values()], dtype=np.float64) * self.idf[colunas]
+        # A norma usa só os n-gramas conhecidos: os demais não mudam o produto, só o escalariam
+        norma = math.sqrt(float(pesos @ pesos)) if len(pesos) else 0.0
+        return colunas, (pesos / norma if norma else pesos)
+
+    def scores(self, textos):
+        """Matriz densa (consultas x itens da base) da similaridade do cosseno, em float64."""
+        vetores = [self._vetor(texto) for texto in textos]
+        colunas = np.concatenate([v[0] for v in vetores]) if vetores else np.zeros(0, dtype=np.int64)
+        pesos = np.concatenate([v[1] for v in vetores]) if vetores else np.zeros(0)
+        consultas = np.repeat(np.arange(len(vetores)), [len(v[0]) for v in vetores])
+
+        linhas_densas = self.densos[colunas]
+        na_densa = linhas_densas >= 0
+        consultas_densas = np.zeros((len(vetores), len(self.matriz_densa)), dtype=np.float32)
+        consultas_densas[consultas[na_densa], linhas_densas[na_densa]] = pesos[na_densa]
+        colunas, pesos, consultas = colunas[~na_densa], pesos[~na_densa], consultas[~na_densa]
+
+        # Expande cada (consulta, n-grama) na lista invertida do n-grama: produto esparso x esparso
+        tamanhos = self.inicio[colunas + 1] - self.inicio[colunas]
+        total = int(tamanhos.sum())
+        deslocamentos = np.repeat(self.inicio[colunas] - (np.cumsum(tamanhos) - tamanhos), tamanhos)
+        indices = np.arange(total, dtype=np.int64) + deslocamentos
+        celulas = np.repeat(consultas, tamanhos) * self.tamanho + self.itens[indices]
+        produtos = np.repeat(pesos, tamanhos) * self.pesos[indices]
+        matriz = np.bincount(celulas, weights=produtos, minlength=len(vetores) * self.tamanho)
+        return matriz.reshape(len(vetores), self.tamanho) + consultas_densas @ self.matriz_densa
+
+    def top_k(self, textos, k=1, batch_size=None, colunas=None):
+        """Os `k` itens mais próximos de cada texto: arrays (n, k) de posições e pontuações (0-100).
+
+        Pontuações inteiras (cosseno x 100, arredondado); em empate vence o primeiro item
+        da base. Posição -1 (pontuação 0) quando há menos de k itens com algum n-grama em comum.
+        Com `colunas` (posições em ordem crescente), só esses itens da base concorrem.
+        """
+        total = len(textos)
+        k = max(int(k), 1)
+        posicoes = np.full((total, k), -1, dtype=np.int64)
+        scores = np.zeros((total, k), dtype=np.int64)
+        n_colunas = self.tamanho if colunas is None else len(colunas)
+        if total == 0 or n_colunas == 0:
+            return posicoes, scores
+        lote = max(1, TFIDF_BLOCK_CELLS // self.tamanho)
+        if batch_size:
+            lote = min(lote, int(batch_size))
+        colunas_k = min(k, n_colunas)
+        for inicio in range(0, total, lote):
+            matriz = self.scores(textos[inicio:inicio + lote])
+            if colunas is not None:
+                matriz = matriz[:, colunas]
+            matriz = np.rint(matriz * 100)
+            if k == 1: # argmax devolve a primeira ocorrência do máximo
+                melhor = matriz.argmax(axis=1)
+                valores = matriz[np.arange(len(matriz)), melhor]
+                encontrados = valores > 0
+                posicoes[inicio:inicio + len(matriz), 0] = np.where(encontrados, melhor, -1)
+                scores[inicio:inicio + len(matriz), 0] = valores
+            else:
+                if colunas_k < n_colunas:
+                    # Candidatos: os k maiores, mais os empatados com o k-ésimo (para o desempate pela posição)
+                    corte = -np.partition(-matriz, colunas_k - 1, axis=1)[:, colunas_k - 1:colunas_k]
+                    candidatas = (matriz >= corte) & (matriz > 0)
+                else:
+                    candidatas = matriz > 0
+                for linha, (cols,) in enumerate(map(np.nonzero, candidatas)):
+                    valores = matriz[linha, cols]
+                    ordem = np.lexsort((cols, -valores))[:colunas_k] # Maior pontuação; empate: menor posição
+                    posicoes[inicio + linha, :len(ordem)] = cols[ordem]
+                    scores[inicio + linha, :len(ordem)] = valores[ordem].astype(np.int64)
+        if colunas is not None: # Volta às posições da base
+            posicoes = np.where(posicoes >= 0, np.asarray(colunas, dtype=np.int64)[np.maximum(posicoes, 0)], -1)
+        return posicoes, scores
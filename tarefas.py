@@ -0,0 +1,229 @@
+"""Fila local de tarefas em segundo plano (auditorias da interface), compartilhada entre sessões.
+
+Cada sessão tem a sua fila (FIFO) e as threads de trabalho atendem as sessões em
+rodízio: uma sessão com muitas planilhas na fila não atrasa a primeira planilha
+das demais. O número de tarefas executadas ao mesmo tempo é limitado pelo número
+de threads. As tarefas ficam guardadas pelo id (inclusive depois de concluídas,
+até o limite do histórico), de modo que a interface pode voltar a consultá-las
+depois de recarregar a página. Tudo fica na memória do processo, sem serviços externos.
+
+ReadWriteLock protege dados compartilhados entre as tarefas e as sessões (a base de
+configurações): as auditorias leem ao mesmo tempo e uma alteração espera por elas.
+"""
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+JOB_WORKERS = 2 # Tarefas executadas ao mesmo tempo (todas as sessões)
+JOB_HISTORY = 16 # Tarefas encerradas mantidas para consulta
+# Processos de auditoria por tarefa: as JOB_WORKERS tarefas simultâneas somadas não passam do número de CPUs
+JOB_PROCESSES = max((os.cpu_count() or 1) // JOB_WORKERS, 1)
+
+JOB_QUEUED = 'na_fila'
+JOB_RUNNING = 'executando'
+JOB_DONE = 'concluida'
+JOB_CANCELLED = 'cancelada'
+JOB_FAILED = 'erro'
+JOB_FINISHED = (JOB_DONE, JOB_CANCELLED, JOB_FAILED)
+
+class JobCancelled(Exception):
+    """Levantada pela função da tarefa ao atender um cancelamento; `resultado` é o que ela já produziu."""
+
+    def __init__(self, resultado=None):
+        super().__init__(resultado)
+        self.resultado = resultado
+
+class Job:
+    """Uma tarefa da fila: `funcao(job, *args, **kwargs)` roda em uma thread de trabalho.
+
+    A função informa o andamento com report() e deve consultar cancel_requested
+    para encerrar cedo, levantando JobCancelled com o resultado parcial. O que ela
+    devolver (ou o resultado parcial) fica em `resultado`; se ela terminar normalmente,
+    a tarefa é concluída mesmo que o cancelamento tenha sido pedido. Outra exceção
+    vira o status JOB_FAILED, com a exceção em `erro`.
+    """
+
+    def __init__(self, sessao, funcao, args, kwargs, chave=None):
+        self.id = uuid.uuid4().hex
+        self.sessao = sessao
+        self.chave = chave # Identifica o trabalho (ex.: planilha + base + opções) para não repeti-lo
+        self.status = JOB_QUEUED
+        self.criada = time.time()
+        self.iniciada = None
+        self.encerrada = None
+        self.progresso = None
+        self.resultado = None
+        self.erro = None
+        self._funcao, self._args, self._kwargs = funcao, args, kwargs
+        self._cancelar = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in JOB_FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancelar.is_set()
+
+    def report(self, progresso):
+        """Guarda o último andamento informado pela função (lido pela interface)."""
+        self.progresso = progresso
+
+    def _executar(self):
+        try:
+            self.resultado = self._funcao(self, *self._args, **self._kwargs)
+            return JOB_DONE
+        except JobCancelled as e:
+            self.resultado = e.resultado
+            return JOB_CANCELLED
+        except Exception as e:
+            self.erro = e
+            return JOB_FAILED
+        finally:
+            self._funcao = self._args = self._kwargs = None # Libera a planilha enviada
+
+class JobQueue:
+    """Fila de tarefas com `workers` threads, em rodízio entre as sessões."""
+
+    def __init__(self, workers=JOB_WORKERS, history=JOB_HISTORY):
+        self.history = history
+        self._filas = OrderedDict() # sessão -> deque de tarefas na fila; a ordem é a do rodízio
+        self._tarefas = OrderedDict() # id -> tarefa, na ordem de criação
+        self._cond = threading.Condition()
+        self._threads = [threading.Thread(target=self._trabalhar, name=f'tarefa-{n}', daemon=True)
+                         for n in range(max(int(workers), 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, sessao, funcao, *args, chave=None, **kwargs):
+        """Põe `funcao(job, *args, **kwargs)` no fim da fila da `sessao` e devolve o Job."""
+        job = Job(sessao, funcao, args, kwargs, chave)
+        with self._cond:
+            self._tarefas[job.id] = job
+            self._filas.setdefault(sessao, deque()).append(job)
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._tarefas.get(job_id)
+
+    def find(self, sessao, chave):
+        """Tarefa mais recente da `sessao` com a `chave` que não falhou nem foi cancelada, ou None."""
+        with self._cond:
+            return next((job for job in reversed(self._tarefas.values())
+                         if job.sessao == sessao and job.chave == chave
+                         and job.status not in (JOB_CANCELLED, JOB_FAILED)), None)
+
+    def position(self, job):
+        """Tarefas que serão iniciadas antes de `job` (0: é a próxima); None se já não está na fila."""
+        with self._cond:
+            if job.status != JOB_QUEUED:
+                return None
+            # Simula o rodízio: a cada volta sai a primeira tarefa de cada sessão, na ordem das sessões
+            rodadas = itertools.zip_longest(*self._filas.values())
+            ordem = (tarefa for rodada in rodadas for tarefa in rodada if tarefa is not None)
+            return next(n for n, tarefa in enumerate(ordem) if tarefa is job)
+
+    def cancel(self, job_id):
+        """Pede o cancelamento; uma tarefa ainda na fila é removida dela na hora."""
+        with self._cond:
+            job = self._tarefas.get(job_id)
+            if job is None or job.finished:
+                return
+            job._cancelar.set()
+            if job.status == JOB_QUEUED:
+                fila = self._filas[job.sessao]
+                fila.remove(job)
+                if not fila:
+                    del self._filas[job.sessao]
+                self._encerrar(job, JOB_CANCELLED)
+
+    def _proxima(self):
+        """Primeira tarefa da próxima sessão do rodízio (chamada com o lock)."""
+        sessao, fila = next(iter(self._filas.items()))
+        job = fila.popleft()
+        del self._filas[sessao]
+        if fila: # A sessão volta para o fim do rodízio
+            self._filas[sessao] = fila
+        return job
+
+    def _encerrar(self, job, status):
+        """Marca a tarefa como encerrada e descarta as encerradas mais antigas (chamada com o lock)."""
+        job.status = status
+        job.encerrada = time.time()
+        encerradas = [tarefa for tarefa in self._tarefas.values() if tarefa.finished]
+        for tarefa in encerradas[:max(len(encerradas) - self.history, 0)]:
+            del self._tarefas[tarefa.id]
+
+    def _trabalhar(self):
+        while True:
+            with self._cond:
+                while not self._filas:
+                    self._cond.wait()
+                job = self._proxima()
+                job.status = JOB_RUNNING
+                job.iniciada = time.time()
+            status = job._executar()
+            with self._cond:
+                self._encerrar(job, status)
+
+class ReadWriteLock:
+    """Várias leituras ao mesmo tempo ou uma escrita exclusiva.
+
+    Uma escrita à espera bloqueia as novas leituras, para não esperar indefinidamente
+    enquanto chegam auditorias. A escrita é reentrante e a thread que escreve também
+    pode ler; uma leitura não deve ser pedida de novo dentro de outra leitura.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._leitores = 0
+        self._escritor = None # Thread que está escrevendo
+        self._profundidade = 0 # Escritas aninhadas da mesma thread
+        self._escritas_esperando = 0
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            propria = self._escritor == threading.get_ident() # Dentro da própria escrita
+            if not propria:
+                while self._escritor is not None or self._escritas_esperando:
+                    self._cond.wait()
+                self._leitores += 1
+        try:
+            yield
+        finally:
+            if not propria:
+                with self._cond:
+                    self._leitores -= 1
+                    if not self._leitores:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        eu = threading.get_ident()
+        with self._cond:
+            if self._escritor == eu:
+                self._profundidade += 1
+            else:
+                self._escritas_esperando += 1
+                try:
+                    while self._escritor is not None or self._leitores:
+                        self._cond.wait()
+                finally:
+                    self._escritas_esperando -= 1
+                    self._cond.notify_all() # Leituras à espera reavaliam (ex.: escrita interrompida)
+                self._escritor, self._profundidade = eu, 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._profundidade -= 1
+                if not self._profundidade:
+                    self._escritor = None
+                    self._cond.notify_all()
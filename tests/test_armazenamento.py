@@ -0,0 +1,145 @@
+"""Testes do armazenamento da base (armazenamento.py): binário e journal, contra o índice montado do dict."""
+import os
+
+import armazenamento
+from armazenamento import BaseStorage, load_base_binary, save_base_binary
+from auditoria import BaseIndex, clean_cest
+from dados_sinteticos import generate_base
+
+def _sem_vazios(indice):
+    # add() deixa conjuntos vazios para os NCMs que nenhum item usa mais
+    return {chave: posicoes for chave, posicoes in indice.items() if posicoes}
+
+def _mesmo_indice(lido, esperado):
+    """Compara as colunas, os índices derivados e a impressão digital de dois BaseIndex."""
+    for atributo in ('descs', 'descs_lower', 'palavras', 'ncms', 'aliqs', 'tributacoes', 'cests', 'posicoes',
+                     'por_palavra'):
+        assert getattr(lido, atributo) == getattr(esperado, atributo), atributo
+    assert _sem_vazios(lido.por_ncm) == _sem_vazios(esperado.por_ncm)
+    assert _sem_vazios(lido.ncm_prefix_index()) == _sem_vazios(esperado.ncm_prefix_index())
+    assert lido.lookup.mapa == esperado.lookup.mapa
+    assert lido.fingerprint() == esperado.fingerprint()
+
+def _configs():
+    configs = generate_base(400, seed=101)
+    configs.update({
+        'Açúcar Cristal União 1kg': {'NCM': '17019900', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '1700100'},
+        'ACUCAR CRISTAL UNIAO 1KG': {'NCM': '17019900', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': ''},
+        'SEM NCM': {'NCM': '', 'ALIQ_ICMS': '', 'TRIBUTACAO': '', 'CEST': '0'},
+        'de da do': {'NCM': '0713', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'ST', 'CEST': '2106400'}, # Só stopwords
+        '...': {'NCM': '22021000', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'F', 'CEST': '0'}, # Normalizada vazia
+    })
+    return configs
+
+def test_binario_ida_e_volta(tmp_path):
+    configs = _configs()
+    esperado = BaseIndex.from_configs(configs)
+    path = str(tmp_path / 'base.npz')
+    save_base_binary(esperado, path)
+    lidos, lido = load_base_binary(path)
+    _mesmo_indice(lido, esperado)
+    assert dict(lidos) == {desc: esperado.values(pos) for pos, desc in enumerate(esperado.descs)}
+
+    # O índice lido continua aceitando alterações como o montado do dict
+    novos = {'PRODUTO NOVO 1KG': {'NCM': '10063021', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'},
+             esperado.descs[5]: {'NCM': '84713012', 'ALIQ_ICMS': '12', 'TRIBUTACAO': 'I', 'CEST': '0100100'}}
+    for desc, values in novos.items():
+        lido.add(desc, values)
+    configs.update(novos)
+    _mesmo_indice(lido, BaseIndex.from_configs(configs))
+
+def test_binario_base_vazia(tmp_path):
+    path = str(tmp_path / 'base.npz')
+    save_base_binary(BaseIndex(), path)
+    lidos, lido = load_base_binary(path)
+    assert len(lidos) == 0
+    _mesmo_indice(lido, BaseIndex())
+
+def _valores(i):
+    return {'NCM': f'8471{i % 100:04d}', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': clean_cest(str(i))}
+
+def _upserts(configs, n, inicio=0):
+    """Metade atualizações de itens existentes, metade itens novos."""
+    descs = list(configs)
+    return [(descs[i % len(descs)] if i % 2 else f'ITEM NOVO {i}', _valores(i)) for i in range(inicio, inicio + n)]
+
+def _carregar(path):
+    return BaseStorage(path).load()[1]
+
+def test_journal_reaplicado_sobre_o_snapshot(tmp_path):
+    configs = generate_base(200, seed=111)
+    path = str(tmp_path / 'base.npz')
+    storage = BaseStorage(path)
+    storage.write_snapshot(BaseIndex.from_configs(configs))
+    itens = _upserts(configs, 30)
+    storage.append(itens[:10])
+    storage.append(itens[10:])
+    assert not storage.changed_externally()
+    configs.update(itens)
+    _mesmo_indice(_carregar(path), BaseIndex.from_configs(configs))
+
+    # Sem snapshot, só o journal
+    sem_snapshot = BaseStorage(str(tmp_path / 'vazia.npz'))
+    sem_snapshot.append(itens)
+    _mesmo_indice(_carregar(sem_snapshot.path), BaseIndex.from_configs(dict(itens)))
+
+def test_journal_com_ultima_linha_incompleta(tmp_path):
+    configs = generate_base(100, seed=112)
+    path = str(tmp_path / 'base.npz')
+    storage = BaseStorage(path)
+    storage.write_snapshot(BaseIndex.from_configs(configs))
+    itens = _upserts(configs, 6)
+    storage.append(itens)
+    with open(storage.journal_path, 'rb') as f:
+        completo = f.read()
+    # Queda no meio da escrita da última linha
+    with open(storage.journal_path, 'ab') as f:
+        f.write(b'{"desc": "ITEM CORTADO", "NCM": "847')
+    configs.update(itens)
+    storage = BaseStorage(path)
+    _mesmo_indice(storage.load()[1], BaseIndex.from_configs(configs))
+    with open(storage.journal_path, 'rb') as f:
+        assert f.read() == completo # O final incompleto sai do journal
+
+    # A próxima entrada começa em uma linha nova e é lida normalmente
+    mais = _upserts(configs, 4, inicio=50)
+    storage.append(mais)
+    configs.update(mais)
+    _mesmo_indice(_carregar(path), BaseIndex.from_configs(configs))
+
+def test_compactacao(tmp_path, monkeypatch):
+    monkeypatch.setattr(armazenamento, 'COMPACTION_MIN_ENTRIES', 20)
+    configs = generate_base(100, seed=113)
+    path = str(tmp_path / 'base.npz')
+    storage = BaseStorage(path)
+    storage.write_snapshot(BaseIndex.from_configs(configs))
+    _, base_index = storage.load()
+    durante = _upserts(configs, 3, inicio=900)
+    gravar = armazenamento.save_base_binary
+
+    def gravar_com_upsert(indice, destino):
+        # Um upsert chega enquanto o snapshot novo é gravado, fora do lock
+        for desc, values in durante:
+            base_index.add(desc, values)
+        storage.append(durante)
+        gravar(indice, destino)
+
+    monkeypatch.setattr(armazenamento, 'save_base_binary', gravar_com_upsert)
+    itens = _upserts(configs, 25)
+    for desc, values in itens:
+        base_index.add(desc, values)
+    storage.append(itens[:10], base_index) # Abaixo do limite: sem compactação
+    assert storage._compactacao is None
+    storage.append(itens[10:], base_index)
+    storage._compactacao.join()
+    monkeypatch.setattr(armazenamento, 'save_base_binary', gravar)
+
+    configs.update(itens)
+    snapshot = dict(configs)
+    configs.update(durante)
+    # O snapshot tem os itens até a compactação; o journal, só o que chegou durante ela
+    assert [desc for desc, _ in storage._ler_journal()] == [desc for desc, _ in durante]
+    assert storage._entradas_journal == len(durante)
+    _mesmo_indice(load_base_binary(path)[1], BaseIndex.from_configs(snapshot))
+    _mesmo_indice(_carregar(path), BaseIndex.from_configs(configs))
+    assert not os.path.exists(path + '.compactando')
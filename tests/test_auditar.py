@@ -0,0 +1,32 @@
+"""Testes da auditoria em lote pela linha de comando (auditar.py)."""
+import os
+
+import pytest
+
+from auditar import find_inputs, main
+
+def _criar(pasta, *nomes):
+    for nome in nomes:
+        (pasta / nome).write_bytes(b'')
+
+def test_find_inputs_ignora_resultados_e_temporarios(tmp_path):
+    _criar(tmp_path, 'a.xlsx', 'b.csv', 'a_auditado.xlsx', '~$a.xlsx', 'notas.txt')
+    arquivo = str(tmp_path / 'a.xlsx')
+    caminho_relativo = os.path.relpath(arquivo)
+    assert find_inputs([str(tmp_path), arquivo, caminho_relativo]) == [arquivo, str(tmp_path / 'b.csv')]
+
+def test_find_inputs_recusa_nomes_que_gravariam_o_mesmo_resultado(tmp_path):
+    _criar(tmp_path, 'notas.xlsx', 'notas.csv', 'outra.parquet')
+    with pytest.raises(ValueError, match='notas.csv e .*notas.xlsx'):
+        find_inputs([str(tmp_path)])
+    (tmp_path / 'sub').mkdir()
+    _criar(tmp_path / 'sub', 'outra.csv') # Outra pasta: resultado em outro lugar
+    assert len(find_inputs([str(tmp_path / 'outra.parquet'), str(tmp_path / 'sub')])) == 2
+
+def test_main_informa_o_conflito(tmp_path, capsys):
+    _criar(tmp_path, 'notas.xlsx', 'notas.csv')
+    with pytest.raises(SystemExit) as saida:
+        main([str(tmp_path)])
+    assert saida.value.code == 2
+    assert 'mesmo resultado' in capsys.readouterr().err
+    assert not list(tmp_path.glob('*_auditado*'))
@@ -0,0 +1,382 @@
+"""Testes do motor de auditoria (auditoria.py) contra implementações de referência simples."""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+from rapidfuzz import fuzz
+
+import auditoria
+from auditoria import (MATCH_EXATO, MATCH_NENHUM, MATCH_PALAVRAS, MATCH_ROTULOS, MATCH_SEM_DESCRICAO,
+                       MATCH_SIMILARIDADE, NCM_LEVELS, SIMILARITY_FUZZY, SIMILARITY_TFIDF, AuditState, BaseIndex,
+                       clean_cest, clear_text_caches, concat_results, export_frame, get_keywords, group_rows,
+                       iter_process_planilha, match_distinct, match_rows, ncm_prefixes, normalize_description,
+                       process_planilha, reaudit_planilha, similarity_batch)
+from dados_sinteticos import generate_audit, generate_base
+
+def _palavras_ncm_forca_bruta(base_index, palavras_item, ncm_item, permitidos=None):
+    """Etapa Palavras/NCM como no laço original: percorre a base inteira (ou só `permitidos`), na ordem."""
+    melhor_pos, max_score = -1, -1
+    for pos, desc in enumerate(base_index.descs):
+        if permitidos is not None and pos not in permitidos:
+            continue
+        palavras_iguais = palavras_item & get_keywords(desc.strip().lower())
+        ncm_base = base_index.ncms[pos]
+        ncm_igual = bool(ncm_base) and ncm_base == ncm_item
+        if len(palavras_iguais) >= 2 or ncm_igual:
+            score_atual = len(palavras_iguais) * 10 + (50 if ncm_igual else 0)
+            if score_atual > max_score:
+                max_score = score_atual
+                melhor_pos = pos
+    return melhor_pos, max_score
+
+def test_clean_cest_vazios_fora_do_cache():
+    clear_text_caches()
+    valores = [float('nan')] * 500 + [np.float32('nan'), None, pd.NA, pd.NaT, 1700100.0, '1700100.0', ' 0100100 ', '']
+    assert [clean_cest(valor) for valor in valores[-8:]] == ['0', '0', '0', '0', '1700100', '1700100', '100100', '0']
+    assert pd.Series(valores).map(clean_cest).tolist()[:500] == ['0'] * 500
+    # Só os valores preenchidos passam pelo cache; cada NaN seria uma entrada nova (NaN != NaN)
+    assert auditoria._clean_cest.cache_info().currsize == 4
+
+def test_keyword_match_igual_a_forca_bruta():
+    configs = generate_base(1500, seed=11)
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = generate_audit(configs, 600, seed=12)
+    consultas = list(zip(audit_df['Descrição item'], audit_df['NCM']))
+    consultas += [('', '22021000'), ('de da do com', '22021000'), ('de e em', ''), ('', ''), ('ARROZ', '00000000')]
+    for desc, ncm in consultas:
+        palavras = get_keywords(str(desc).strip().lower())
+        assert base_index.keyword_match(palavras, str(ncm)) == _palavras_ncm_forca_bruta(base_index, palavras, str(ncm))
+
+def test_keyword_match_desempate_e_so_ncm():
+    configs = {
+        'ARROZ TIPO 1 CAMIL 5KG': {'NCM': '10063021', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'},
+        'ARROZ TIPO 1 TIO JOAO 5KG': {'NCM': '10063021', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'},
+        'FEIJAO CARIOCA 1KG': {'NCM': '07133319', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'},
+        'SEM NCM': {'NCM': '', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'},
+    }
+    base_index = BaseIndex.from_configs(configs)
+    casos = [
+        ({'arroz', 'tipo', '5kg'}, '10063021'), # Empate: vence o primeiro item da base
+        ({'macarrao'}, '07133319'),              # Só o NCM em comum
+        (get_keywords('de da com'), '07133319'), # Descrição só com stopwords: só o NCM
+        (frozenset(), ''),                       # NCM vazio não casa com item sem NCM
+        ({'sem', 'ncm'}, ''),
+    ]
+    for palavras, ncm in casos:
+        assert base_index.keyword_match(palavras, ncm) == _palavras_ncm_forca_bruta(base_index, palavras, ncm)
+    assert base_index.keyword_match({'arroz', 'tipo', '5kg'}, '10063021') == (0, 80)
+    assert base_index.keyword_match({'macarrao'}, '07133319') == (2, 50)
+
+def test_keyword_match_com_base_embaralhada():
+    rnd = random.Random(3)
+    palavras = ['arroz', 'feijao', 'cafe', 'leite', 'acucar', 'oleo', 'sal', 'trigo']
+    configs = {}
+    while len(configs) < 400:
+        desc = ' '.join(rnd.sample(palavras, rnd.randint(1, 4))).upper() + f' {len(configs)}'
+        configs[desc] = {'NCM': rnd.choice(['', '1001', '1002', '1003']), 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T',
+                         'CEST': '0'}
+    base_index = BaseIndex.from_configs(configs)
+    for _ in range(300):
+        item = frozenset(rnd.sample(palavras, rnd.randint(0, 5)))
+        ncm = rnd.choice(['', '1001', '1002', '9999'])
+        assert base_index.keyword_match(item, ncm) == _palavras_ncm_forca_bruta(base_index, item, ncm)
+
+def _auditoria_linear(descs_item, ncms_item, configs, similarity_threshold=70):
+    """O laço original da auditoria: cada linha percorre a base inteira em cada etapa.
+
+    Retorna (descrição da base ou None, pontuação, rótulo da correspondência) de cada linha.
+    A etapa exata usa a descrição normalizada, como a busca exata atual.
+    """
+    exatas = {}
+    for desc_base in configs:
+        if normalize_description(desc_base):
+            exatas[normalize_description(desc_base)] = desc_base # Colisão: vale a última
+    resultado = []
+    for desc_item, ncm_item in zip(descs_item, ncms_item):
+        desc_item = desc_item.strip().lower()
+        if not desc_item:
+            resultado.append((None, 0, MATCH_ROTULOS[MATCH_SEM_DESCRICAO]))
+            continue
+        melhor_match, max_score, tipo = exatas.get(normalize_description(desc_item)), -1, MATCH_EXATO
+        if melhor_match is not None:
+            max_score = 100
+        if not melhor_match:
+            palavras_item = get_keywords(desc_item)
+            for desc_base, values in configs.items():
+                palavras_iguais = palavras_item & get_keywords(desc_base.strip().lower())
+                ncm_base = str(values.get('NCM', '')).strip()
+                ncm_igual = bool(ncm_base) and ncm_base == ncm_item
+                if len(palavras_iguais) >= 2 or ncm_igual:
+                    score_atual = len(palavras_iguais) * 10 + (50 if ncm_igual else 0)
+                    if score_atual > max_score:
+                        max_score, melhor_match, tipo = score_atual, desc_base, MATCH_PALAVRAS
+        if not melhor_match:
+            for desc_base in configs:
+                score = round(fuzz.ratio(desc_item, desc_base.strip().lower()))
+                if score >= similarity_threshold and score > max_score:
+                    max_score, melhor_match, tipo = score, desc_base, MATCH_SIMILARIDADE
+        if melhor_match:
+            resultado.append((melhor_match, max_score, MATCH_ROTULOS[tipo]))
+        else:
+            resultado.append((None, 0, MATCH_ROTULOS[MATCH_NENHUM]))
+    return resultado
+
+def test_auditoria_indexada_igual_ao_laco_linear():
+    # Descrição vazia no início da base: vence o empate só pelo NCM, mas não conta como match
+    configs = {'': {'NCM': '22021000', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '0'}}
+    configs.update(generate_base(500, seed=13))
+    configs['SEM NCM ITEM AVULSO'] = {'NCM': '', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '0'}
+    audit_df = generate_audit(configs, 400, seed=14)
+    rnd = random.Random(15)
+    ncms = sorted({values['NCM'] for values in configs.values()})
+    audit_df.loc[::7, 'NCM'] = [rnd.choice(ncms) for _ in range(len(audit_df.loc[::7]))]
+    audit_df.loc[::31, 'Descrição item'] = ''
+    audit_df.loc[5, ['Descrição item', 'NCM']] = ['item avulso', '']
+    audit_df.loc[6, ['Descrição item', 'NCM']] = ['zzzz yyyy', '22021000']
+    audit_df.loc[8, ['Descrição item', 'NCM']] = ['zzz qqq www', '99999999']
+
+    resultado = process_planilha(audit_df.copy(), configs)
+    esperado = _auditoria_linear(audit_df['Descrição item'], audit_df['NCM'].astype(str), configs)
+    descs_base = list(configs)
+    assert [descs_base[pos] if pos >= 0 else None for pos in resultado['ITEM BASE']] == [d for d, _, _ in esperado]
+    assert resultado['SIMILARIDADE'].tolist() == [score for _, score, _ in esperado]
+    assert resultado['CORRESPONDENCIA'].tolist() == [rotulo for _, _, rotulo in esperado]
+    # Todas as etapas foram exercitadas
+    assert {rotulo for _, _, rotulo in esperado} == set(MATCH_ROTULOS.values())
+
+@pytest.mark.parametrize('similarity_method', [SIMILARITY_FUZZY, SIMILARITY_TFIDF])
+def test_paralelo_igual_ao_serial(similarity_method):
+    configs = generate_base(800, seed=21)
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = generate_audit(configs, 700, seed=22)
+    audit_df.loc[::53, 'Descrição item'] = None
+    # prepare_audit_df altera a planilha recebida: cada execução usa uma cópia
+    serial = process_planilha(audit_df.copy(), configs, base_index, workers=1, similarity_method=similarity_method)
+    paralelo = concat_results(progresso.bloco for progresso in iter_process_planilha(
+        audit_df.copy(), configs, base_index, workers=2, chunk_size=40, similarity_method=similarity_method))
+    pd.testing.assert_frame_equal(serial, paralelo)
+
+@pytest.mark.parametrize('ncm_prefix', [False, True])
+def test_tfidf_paralelo_igual_ao_serial(ncm_prefix):
+    # Mais linhas distintas que AUDIT_CHUNK_SIZE: o modo paralelo divide a planilha entre os processos
+    configs = generate_base(600, seed=23)
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = generate_audit(configs, 2600, seed=24, taxa_exata=0.2, taxa_variante=0.3, taxa_erro=0.4)
+    opcoes = {'similarity_method': SIMILARITY_TFIDF, 'ncm_prefix': ncm_prefix}
+    serial = process_planilha(audit_df.copy(), configs, base_index, workers=1, **opcoes)
+    paralelo = process_planilha(audit_df.copy(), configs, base_index, workers=3, **opcoes)
+    pd.testing.assert_frame_equal(serial, paralelo)
+    assert (serial['CORRESPONDENCIA'] == MATCH_ROTULOS[MATCH_SIMILARIDADE]).sum() >= 10
+
+def test_pontuacao_palavras_ncm_acima_de_255():
+    # Palavras/NCM pontua 10 por palavra em comum (+50 com o mesmo NCM): passa de 100 e de 255
+    palavras = [f'palavra{n:02d}' for n in range(30)]
+    configs = {
+        ' '.join(palavras[:25]) + ' base': {'NCM': '10011000', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'},
+        ' '.join(palavras[:24]) + ' outra': {'NCM': '10011000', 'ALIQ_ICMS': '12', 'TRIBUTACAO': 'F', 'CEST': '0'},
+        ' '.join(palavras[:8]) + ' curta': {'NCM': '22021000', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '0'},
+    }
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = pd.DataFrame({
+        'Descrição item': [' '.join(palavras[:25]), ' '.join(palavras[:25]), ' '.join(palavras[:8]) + ' x'],
+        'NCM': ['10011000', '99999999', '22021000'],
+        'Aliq. ICMS': ['18', '18', '18'],
+    })
+    estado = AuditState()
+    resultado = process_planilha(audit_df.copy(), configs, base_index, estado=estado)
+    assert resultado['SIMILARIDADE'].tolist() == [300, 250, 130]
+    assert estado.scores.tolist() == [300, 250, 130]
+    assert export_frame(resultado, base_index)['ITEM CONSIDERADO'].tolist() == [
+        f"Palavras/NCM: {' '.join(palavras[:25])} base"] * 2 + [f"Palavras/NCM: {' '.join(palavras[:8])} curta"]
+    assert resultado['Aliq. ICMS'].tolist() == ['7', '7', '18']
+
+    # A reauditoria parte das pontuações guardadas no AuditState e chega ao mesmo resultado da completa
+    base_index.add(' '.join(palavras[:26]), {'NCM': '99999999', 'ALIQ_ICMS': '4', 'TRIBUTACAO': 'T', 'CEST': '0'})
+    reauditado, novo, _ = reaudit_planilha(audit_df.copy(), resultado, estado)
+    completo = process_planilha(audit_df.copy(), None, base_index)
+    pd.testing.assert_frame_equal(reauditado, completo)
+    assert novo.scores.tolist() == completo['SIMILARIDADE'].tolist() == [300, 300, 130]
+
+def test_add_publica_a_posicao_depois_dos_valores():
+    # Uma auditoria que encontra a posição (posicoes, lookup, por_palavra, por_ncm) já lê os valores do item
+    base_index = BaseIndex.from_configs(generate_base(50, seed=41))
+
+    class Colunas(list):
+        def append(self, valor):
+            desc = base_index.descs[len(self)]
+            assert desc not in base_index.posicoes and base_index.lookup.get(desc) is None
+            assert all(len(self) not in posicoes for posicoes in base_index.por_palavra.values())
+            super().append(valor)
+
+    for nome in ['ncms', 'aliqs', 'tributacoes', 'cests']:
+        setattr(base_index, nome, Colunas(getattr(base_index, nome)))
+    base_index.add('ARROZ INTEGRAL NOVO 1KG', {'NCM': '10063021', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': '0'})
+    pos = base_index.posicoes['ARROZ INTEGRAL NOVO 1KG']
+    assert base_index.keyword_match(get_keywords('arroz integral novo 1kg'), '10063021') == (pos, 90)
+
+@pytest.mark.parametrize('similarity_method,ncm_prefix', [(SIMILARITY_FUZZY, False), (SIMILARITY_TFIDF, False),
+                                                          (SIMILARITY_FUZZY, True)])
+def test_reauditoria_igual_a_auditoria_completa(similarity_method, ncm_prefix):
+    configs = generate_base(300, seed=51)
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = generate_audit(configs, 600, seed=52)
+    audit_df.loc[::37, 'Descrição item'] = None
+    opcoes = {'similarity_method': similarity_method, 'ncm_prefix': ncm_prefix}
+    estado = AuditState()
+    resultado = process_planilha(audit_df.copy(), configs, base_index, estado=estado, **opcoes)
+    rnd = random.Random(53)
+    descs_planilha = [desc for desc in audit_df['Descrição item'].dropna()]
+    ncms = sorted(set(base_index.ncms)) + ['99999999']
+    for rodada in range(4):
+        for _ in range(rnd.randint(1, 15)):
+            valores = {'NCM': rnd.choice(ncms), 'ALIQ_ICMS': rnd.choice(['0', '4', '7', '12', '18', '25']),
+                       'TRIBUTACAO': rnd.choice(['T', 'F', 'ST', 'I']), 'CEST': rnd.choice(['0', '1700100'])}
+            sorteio = rnd.random()
+            if sorteio < 0.4: # Atualiza um item existente (NCM e valores)
+                base_index.add(rnd.choice(base_index.descs), valores)
+            elif sorteio < 0.7: # Item novo com a descrição (ou outra escrita) de uma linha da planilha
+                desc = rnd.choice(descs_planilha)
+                base_index.add(desc.lower() + '.' if rnd.random() < 0.5 else desc + f' NOVO{rodada}', valores)
+            else: # Item novo qualquer
+                base_index.add(f'PRODUTO {rnd.randint(0, 10**6)} ' + rnd.choice(descs_planilha), valores)
+        resultado, estado, _ = reaudit_planilha(audit_df.copy(), resultado, estado)
+        completo = process_planilha(audit_df.copy(), None, base_index, **opcoes)
+        pd.testing.assert_frame_equal(resultado, completo, check_dtype=True, check_categorical=True)
+        assert estado.scores.tolist() == completo['SIMILARIDADE'].tolist()
+
+def test_group_rows():
+    primeiras, grupos = group_rows(['a', 'b', 'a', 'a', 'b', ''], ['1', '1', '1', '2', '1', '1'])
+    assert primeiras.tolist() == [0, 1, 3, 5]
+    assert grupos.tolist() == [0, 1, 0, 2, 1, 3]
+
+@pytest.mark.parametrize('similarity_method', [SIMILARITY_FUZZY, SIMILARITY_TFIDF])
+def test_match_distinct_igual_linha_a_linha(similarity_method):
+    configs = generate_base(300, seed=61)
+    base_index = BaseIndex.from_configs(configs)
+    unicas = generate_audit(configs, 120, seed=62)
+    rnd = random.Random(63)
+    ncms = sorted(set(base_index.ncms))[:5] + ['']
+    # Descrições repetidas com NCMs diferentes (e iguais), em ordem embaralhada
+    descs_item, ncms_item = [], []
+    for desc, ncm in zip(unicas['Descrição item'], unicas['NCM']):
+        for _ in range(rnd.randint(1, 4)):
+            descs_item.append(str(desc).strip().lower())
+            ncms_item.append(rnd.choice([str(ncm), *ncms]))
+    ordem = list(range(len(descs_item)))
+    rnd.shuffle(ordem)
+    descs_item, ncms_item = [descs_item[i] for i in ordem], [ncms_item[i] for i in ordem]
+
+    agrupado = match_distinct(descs_item, ncms_item, base_index, similarity_method=similarity_method)
+    linha_a_linha = match_rows(descs_item, ncms_item, base_index, similarity_method=similarity_method)
+    assert len(set(zip(descs_item, ncms_item))) < len(descs_item)
+    for obtido, esperado in zip(agrupado, linha_a_linha):
+        assert obtido.tolist() == esperado.tolist()
+
+def _niveis_forca_bruta(base_index, ncm_item):
+    """Níveis do NCM como em BaseIndex.ncm_levels, varrendo os NCMs da base sem o índice de prefixos."""
+    niveis = []
+    for prefixo in ncm_prefixes(ncm_item):
+        posicoes = {pos for pos, ncm in enumerate(base_index.ncms) if prefixo in ncm_prefixes(ncm)}
+        if posicoes and (not niveis or len(posicoes) > len(niveis[-1][1])):
+            niveis.append((prefixo, posicoes))
+    return niveis
+
+def _prefixo_ncm_forca_bruta(base_index, desc_item, ncm_item, similarity_method):
+    """Uma linha de match_rows com `ncm_prefix`: cada nível do NCM, do mais específico ao capítulo, e depois a base."""
+    if not desc_item:
+        return -1, 0, MATCH_SEM_DESCRICAO
+    pos = base_index.exact_match(desc_item)
+    if pos >= 0:
+        return pos, 100, MATCH_EXATO
+    palavras = get_keywords(desc_item)
+    niveis = _niveis_forca_bruta(base_index, ncm_item)
+    for _, permitidos in niveis + [(None, None)]:
+        pos, max_score = _palavras_ncm_forca_bruta(base_index, palavras, ncm_item, permitidos)
+        if pos >= 0 and base_index.descs[pos]:
+            return pos, max_score, MATCH_PALAVRAS
+    for _, permitidos in niveis + [(None, None)]:
+        colunas = None if permitidos is None else np.array(sorted(permitidos), dtype=np.int64)
+        posicoes, scores, _ = similarity_batch([desc_item], base_index, similarity_method=similarity_method,
+                                               colunas=colunas)
+        if posicoes[0] >= 0 and scores[0] > max_score:
+            return int(posicoes[0]), int(scores[0]), MATCH_SIMILARIDADE
+    return -1, 0, MATCH_NENHUM
+
+def test_ncm_prefixes():
+    assert NCM_LEVELS == (8, 6, 4, 2)
+    assert ncm_prefixes('84713012') == ['84713012', '847130', '8471', '84']
+    assert ncm_prefixes('8471.30.12') == ['84713012', '847130', '8471', '84']
+    assert ncm_prefixes('847130') == ['847130', '8471', '84']
+    assert ncm_prefixes('84713') == ['8471', '84']
+    assert ncm_prefixes('8') == []
+    assert ncm_prefixes('') == []
+
+def test_ncm_levels_do_item_ao_capitulo():
+    valores = {'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '0'}
+    ncms = ['84713012', '84713019', '84714000', '84800000', '22021000', '8471', '']
+    base_index = BaseIndex.from_configs({f'ITEM {i}': dict(valores, NCM=ncm) for i, ncm in enumerate(ncms)})
+    assert base_index.ncm_levels('84713012') == [('84713012', {0}), ('847130', {0, 1}), ('8471', {0, 1, 2, 5}),
+                                                 ('84', {0, 1, 2, 3, 5})]
+    # Sem item com o NCM ou a subposição: começa na posição
+    assert base_index.ncm_levels('84719999') == [('8471', {0, 1, 2, 5}), ('84', {0, 1, 2, 3, 5})]
+    # Capítulo com um único item: os níveis mais gerais repetiriam o mesmo conjunto
+    assert base_index.ncm_levels('22021000') == [('22021000', {4})]
+    assert base_index.ncm_levels('22030000') == [('22', {4})]
+    assert base_index.ncm_levels('99999999') == []
+    assert base_index.ncm_levels('') == []
+
+def test_ncm_prefix_prefere_o_mesmo_ncm():
+    valores = {'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '0'}
+    configs = {
+        'CABO USB TIPO C 1M PRETO': dict(valores, NCM='85444200'),
+        'CABO USB CARREGADOR': dict(valores, NCM='85444900'),
+        'CABO DE ACO GALVANIZADO': dict(valores, NCM='73121000'),
+    }
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = pd.DataFrame({'Descrição item': ['CABO USB TIPO C 1M BRANCO', 'CABO USB TIPO C 1M BRANCO', 'CABO ACO'],
+                             'NCM': ['85444990', '99999999', '73129000'], 'Aliq. ICMS': '18', 'TRIBUTACAO': 'T',
+                             'CEST': '0'})
+    prefixo = process_planilha(audit_df.copy(), None, base_index, ncm_prefix=True)
+    geral = process_planilha(audit_df.copy(), None, base_index)
+    # Da mesma subposição, o item 1 vence o item 0 (mais palavras em comum, mas de outra subposição)
+    assert prefixo['ITEM BASE'].tolist() == [1, 0, 2]
+    assert geral['ITEM BASE'].tolist() == [0, 0, 2]
+    # NCM sem nenhum item na base: recorre à base inteira, como sem o prefixo
+    assert prefixo.iloc[1].equals(geral.iloc[1])
+
+@pytest.mark.parametrize('similarity_method', [SIMILARITY_FUZZY, SIMILARITY_TFIDF])
+def test_ncm_prefix_igual_a_forca_bruta(similarity_method):
+    configs = generate_base(400, seed=71)
+    base_index = BaseIndex.from_configs(configs)
+    audit_df = generate_audit(configs, 300, seed=72)
+    rnd = random.Random(73)
+    # NCMs da mesma subposição, posição ou capítulo de algum item, e de fora da base
+    ncms = [ncm[:nivel] + ''.join(rnd.choice('0123456789') for _ in range(8 - nivel))
+            for ncm in sorted(set(base_index.ncms)) for nivel in NCM_LEVELS] + ['99999999', '']
+    audit_df['NCM'] = [rnd.choice(ncms) for _ in range(len(audit_df))]
+    audit_df.loc[::29, 'Descrição item'] = None
+    resultado = process_planilha(audit_df.copy(), None, base_index, similarity_method=similarity_method,
+                                 ncm_prefix=True)
+    esperado = [_prefixo_ncm_forca_bruta(base_index, '' if desc is None else str(desc).strip().lower(), ncm,
+                                         similarity_method)
+                for desc, ncm in zip(audit_df['Descrição item'], audit_df['NCM'])]
+    assert resultado['ITEM BASE'].tolist() == [pos for pos, _, _ in esperado]
+    assert resultado['SIMILARIDADE'].tolist() == [score for _, score, _ in esperado]
+    assert resultado['CORRESPONDENCIA'].tolist() == [MATCH_ROTULOS[tipo] for _, _, tipo in esperado]
+
+def test_indice_de_prefixos_acompanha_add():
+    configs = generate_base(200, seed=81)
+    base_index = BaseIndex.from_configs(configs)
+    base_index.ncm_prefix_index() # Montado antes das alterações, mantido por add()
+    rnd = random.Random(82)
+    ncms = sorted(set(base_index.ncms)) + ['84713012', '8471', '']
+    for i in range(150):
+        valores = {'NCM': rnd.choice(ncms), 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '0'}
+        desc = rnd.choice(base_index.descs) if rnd.random() < 0.6 else f'PRODUTO NOVO {i}'
+        base_index.add(desc, valores)
+    remontado = BaseIndex.from_configs({desc: base_index.values(pos) for pos, desc in enumerate(base_index.descs)})
+    atual = {prefixo: posicoes for prefixo, posicoes in base_index.ncm_prefix_index().items() if posicoes}
+    assert atual == remontado.ncm_prefix_index()
+    for ncm in ncms + ['84719999', '22']:
+        assert base_index.ncm_levels(ncm) == remontado.ncm_levels(ncm) == _niveis_forca_bruta(base_index, ncm)
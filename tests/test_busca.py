@@ -0,0 +1,120 @@
+"""Testes do índice de pesquisa da Aba 2 (busca.py) contra a varredura da base item a item."""
+import random
+
+import numpy as np
+import pytest
+
+import busca
+from auditoria import BaseIndex
+from busca import PREFIX_FIELDS, SEARCH_FIELDS, SearchIndex
+from dados_sinteticos import generate_base
+
+def _digitos(ncm):
+    return ''.join(ch for ch in ncm if ch.isdigit())
+
+def _ncm_chave(ncm):
+    return _digitos(ncm).ljust(8, '0') if _digitos(ncm) else ''
+
+def _varredura(base_index, condicao):
+    return [pos for pos in range(len(base_index.descs)) if condicao(pos)]
+
+def _contem(base_index, termo):
+    termo = termo.strip().lower()
+    return _varredura(base_index, lambda pos: any(termo in getattr(base_index, campo)[pos].lower()
+                                                  for campo in SEARCH_FIELDS))
+
+def _comeca(base_index, termo, campos=PREFIX_FIELDS):
+    termo = termo.strip().lower()
+    return _varredura(base_index, lambda pos: any(getattr(base_index, campo)[pos].lower().startswith(termo)
+                                                  for campo in campos))
+
+def _ncm_prefixo(base_index, prefixo):
+    prefixo = _digitos(prefixo)
+    if not prefixo:
+        return list(range(len(base_index.descs)))
+    return _varredura(base_index, lambda pos: bool(_ncm_chave(base_index.ncms[pos]))
+                      and _ncm_chave(base_index.ncms[pos]).startswith(prefixo))
+
+def _ncm_faixa(base_index, inicio, fim):
+    inicio, fim = _digitos(inicio).ljust(8, '0'), (_digitos(fim) or '9').ljust(8, '9')
+    return _varredura(base_index, lambda pos: bool(_ncm_chave(base_index.ncms[pos]))
+                      and inicio <= _ncm_chave(base_index.ncms[pos]) <= fim)
+
+def _confere(indice, base_index, rnd):
+    """Compara as consultas do índice com a varredura, para termos tirados da própria base."""
+    termos = ['', 'zzz inexistente', '5kg', 'ARROZ', ' leite ']
+    for _ in range(25):
+        pos = rnd.randrange(len(base_index.descs))
+        desc = base_index.descs[pos]
+        inicio = rnd.randrange(len(desc))
+        termos += [desc[inicio:inicio + rnd.randint(1, 6)], desc[:rnd.randint(1, len(desc))],
+                   base_index.ncms[pos][:rnd.randint(1, 8)], base_index.cests[pos], base_index.tributacoes[pos]]
+    for termo in termos:
+        esperado = _contem(base_index, termo) if termo.strip() else list(range(len(base_index.descs)))
+        assert indice.contains(termo).tolist() == esperado, termo
+        esperado = _comeca(base_index, termo) if termo.strip() else list(range(len(base_index.descs)))
+        assert indice.prefix(termo).tolist() == esperado, termo
+        assert indice.prefix(termo, ('descs',)).tolist() == (
+            _comeca(base_index, termo, ('descs',)) if termo.strip() else list(range(len(base_index.descs))))
+    ncms = sorted(set(base_index.ncms))
+    for ncm in rnd.sample(ncms, min(10, len(ncms))):
+        for nivel in (2, 4, 6, 8):
+            assert indice.ncm_prefix(ncm[:nivel]).tolist() == _ncm_prefixo(base_index, ncm[:nivel])
+        outro = rnd.choice(ncms)
+        inicio, fim = min(ncm, outro)[:rnd.choice((2, 4, 8))], max(ncm, outro)[:rnd.choice((2, 4, 8))]
+        assert indice.ncm_range(inicio, fim).tolist() == _ncm_faixa(base_index, inicio, fim)
+
+@pytest.fixture
+def blocos_pequenos(monkeypatch):
+    """Blocos de texto pequenos, para que a pesquisa atravesse vários blocos."""
+    monkeypatch.setattr(busca, 'SEARCH_BLOCK_SIZE', 37)
+
+def test_pesquisa_igual_a_varredura(blocos_pequenos):
+    base_index = BaseIndex.from_configs(generate_base(500, seed=91))
+    _confere(SearchIndex(base_index), base_index, random.Random(92))
+
+def test_ncm_curto_e_faixa_incompleta():
+    configs = {
+        'FEIJAO': {'NCM': '0713', 'ALIQ_ICMS': '7', 'TRIBUTACAO': 'T', 'CEST': ''},
+        'NOTEBOOK': {'NCM': '8471.30.12', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': '2106400'},
+        'IMPRESSORA': {'NCM': '84433299', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'ST', 'CEST': ''},
+        'SEM NCM': {'NCM': '', 'ALIQ_ICMS': '18', 'TRIBUTACAO': 'T', 'CEST': ''},
+    }
+    indice = SearchIndex(BaseIndex.from_configs(configs))
+    assert indice.ncm_prefix('071300').tolist() == [0] # '0713' vale como 07130000
+    assert indice.ncm_prefix('847130').tolist() == [1]
+    assert indice.ncm_prefix('').tolist() == [0, 1, 2, 3]
+    assert indice.ncm_range('8443', '8471').tolist() == [1, 2]
+    assert indice.ncm_range('0', '').tolist() == [0, 1, 2] # Itens sem NCM ficam fora das faixas
+    assert indice.prefix('st', ('tributacoes',)).tolist() == [2]
+    assert indice.contains('2106').tolist() == [1]
+
+def test_sync_aplica_itens_novos_e_alterados(blocos_pequenos):
+    base_index = BaseIndex.from_configs(generate_base(300, seed=93))
+    indice = SearchIndex(base_index)
+    rnd = random.Random(94)
+    ncms = sorted(set(base_index.ncms)) + ['0713', '8471.30.12', '']
+    for rodada in range(5):
+        for i in range(rnd.randint(1, 40)):
+            valores = {'NCM': rnd.choice(ncms), 'ALIQ_ICMS': rnd.choice(['4', '7', '12', '18']),
+                       'TRIBUTACAO': rnd.choice(['T', 'F', 'ST', 'I', '']), 'CEST': rnd.choice(['', '0', '1700100'])}
+            if rnd.random() < 0.5: # Atualiza um item existente, às vezes mais de uma vez antes do sync
+                base_index.add(rnd.choice(base_index.descs), valores)
+            else:
+                base_index.add(f'PRODUTO NOVO {rodada} {i} ' + rnd.choice(base_index.descs), valores)
+        indice.sync()
+        assert indice.versao == base_index.version()
+        novo = SearchIndex(base_index)
+        assert indice._registros == novo._registros
+        assert indice._ordenados == novo._ordenados
+        assert indice._ncms == novo._ncms
+        _confere(indice, base_index, rnd)
+
+def test_page():
+    posicoes = np.arange(25)
+    assert SearchIndex.page(posicoes, 1, 10)[0].tolist() == list(range(10))
+    assert SearchIndex.page(posicoes, 3, 10)[0].tolist() == list(range(20, 25))
+    pagina, total_paginas = SearchIndex.page(posicoes, 9, 10) # Página além do fim: a última
+    assert (pagina.tolist(), total_paginas) == (list(range(20, 25)), 3)
+    pagina, total_paginas = SearchIndex.page(posicoes[:0], 2, 10)
+    assert (pagina.tolist(), total_paginas) == ([], 1)
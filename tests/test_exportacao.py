@@ -0,0 +1,86 @@
+"""Testes da exportação Excel com destaque (exportacao.py) contra a gravação original (to_excel + openpyxl)."""
+import io
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.styles import PatternFill
+
+from exportacao import EXCEL_CONTROL_COLUMNS, EXCEL_HIGHLIGHTS, excel_download
+
+AMARELO = 'FFFFFF00'
+
+def _excel_original(df):
+    """Exportação como era antes: to_excel e, depois, o destaque célula a célula pelo rótulo do índice."""
+    buffer = io.BytesIO()
+    df_copy = df.rename(columns={'TRIBUTACAO': 'TRIBUTAÇÃO'})
+    df_final = df_copy.drop(columns=[col for col in EXCEL_CONTROL_COLUMNS if col in df_copy.columns])
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        df_final.to_excel(writer, index=False, sheet_name='Resultado Auditoria')
+        worksheet = writer.sheets['Resultado Auditoria']
+        yellow_fill = PatternFill(start_color=AMARELO, end_color=AMARELO, fill_type='solid')
+        cols_excel = {col: idx + 1 for idx, col in enumerate(df_final.columns)}
+        for row_idx, row_data in df.iterrows():
+            for coluna, flag in EXCEL_HIGHLIGHTS.items():
+                if row_data.get(flag, False):
+                    nome = 'TRIBUTAÇÃO' if coluna == 'TRIBUTACAO' else coluna
+                    worksheet.cell(row=row_idx + 2, column=cols_excel[nome]).fill = yellow_fill
+    return buffer.getvalue()
+
+def _celulas(dados):
+    """[[(valor, cor do preenchimento ou None), ...], ...] da primeira planilha."""
+    worksheet = openpyxl.load_workbook(io.BytesIO(dados)).active
+    return [[(celula.value, celula.fill.fgColor.rgb if celula.fill.fill_type else None) for celula in linha]
+            for linha in worksheet.iter_rows()]
+
+def _resultado():
+    return pd.DataFrame({
+        'Descrição item': ['ARROZ 5KG', None, 'FEIJAO 1KG', 'CAFE 500G', 'LEITE 1L'],
+        'NCM': ['10063021', '22021000', np.nan, '09012100', '04012010'],
+        'Aliq. ICMS': ['7', '12', '18', None, '7'],
+        'TRIBUTACAO': ['T', 'F', 'T', 'ST', 'T'],
+        'CEST': ['0', '1700100', '0', '0', '0'],
+        'Data': pd.to_datetime(['2024-01-02', None, '2024-03-04', '2024-05-06', '2024-07-08']),
+        'Quantidade': [1.5, np.nan, 3, 4, 5],
+        'NCM Alterado': [True, False, True, False, False],
+        'Aliq. ICMS Alterado': [False, True, True, False, False],
+        'TRIBUTACAO Alterado': [False, False, False, True, False],
+        'CEST Alterado': [False, False, False, False, True],
+        'ITEM CONSIDERADO': ['Descrição Exata: ARROZ 5KG', '', 'Palavras/NCM: FEIJAO', 'Nenhuma correspondência encontrada',
+                             'Similaridade (80%): LEITE'],
+        'SIMILARIDADE': [100.0, 0.0, 60.0, 0.0, 80.0],
+    })
+
+def test_excel_igual_ao_original():
+    df = _resultado()
+    novo, original = _celulas(excel_download(df)[0]), _celulas(_excel_original(df))
+    assert novo == original
+    assert novo[0] == [(nome, None) for nome in ['Descrição item', 'NCM', 'Aliq. ICMS', 'TRIBUTAÇÃO', 'CEST', 'Data',
+                                                   'Quantidade', 'ITEM CONSIDERADO']]
+    assert novo[2][1] == ('22021000', None) and novo[2][2] == ('12', AMARELO) # Só a alíquota mudou
+    assert novo[3][1] == (None, AMARELO) # NaN vira célula vazia, ainda destacada
+
+def test_excel_cabecalho_no_estilo_do_pandas():
+    worksheet = openpyxl.load_workbook(io.BytesIO(excel_download(_resultado())[0])).active
+    for celula in next(worksheet.iter_rows()):
+        assert celula.font.b
+        assert [celula.border.left.style, celula.border.right.style, celula.border.top.style,
+                celula.border.bottom.style] == ['thin'] * 4
+        assert (celula.alignment.horizontal, celula.alignment.vertical) == ('center', 'top')
+    # Só o cabeçalho: as linhas de dados ficam sem estilo
+    for celula in next(worksheet.iter_rows(min_row=2)):
+        assert not celula.font.b and celula.border.left.style is None and celula.alignment.horizontal is None
+
+def test_excel_destaca_pela_posicao_da_linha():
+    # Com um índice fora de 0..n-1 (ex.: planilha filtrada), o original destacava pela etiqueta do
+    # índice, ou seja, outras linhas; a exportação atual destaca a própria linha alterada
+    df = _resultado().set_axis([7, 2, 0, 1, 3])
+    celulas = _celulas(excel_download(df)[0])
+    colunas = celulas[0]
+    for linha, (_, registro) in zip(celulas[1:], df.iterrows()):
+        for coluna, flag in EXCEL_HIGHLIGHTS.items():
+            nome = 'TRIBUTAÇÃO' if coluna == 'TRIBUTACAO' else coluna
+            cor = linha[colunas.index((nome, None))][1]
+            assert cor == (AMARELO if registro[flag] else None)
+    assert len(celulas) == len(df) + 1
+    assert _celulas(_excel_original(df)) != celulas
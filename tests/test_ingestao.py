@@ -0,0 +1,40 @@
+"""Testes da leitura das planilhas (ingestao.py)."""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ingestao import read_table
+
+pytest.importorskip('pyarrow')
+
+def test_parquet_tipado_lido_como_o_csv():
+    df = pd.DataFrame({
+        'Descrição item': ['ARROZ', 'FEIJAO', None],
+        'NCM': pd.array([84713012, None, 10063021], dtype='Int64'),
+        'CEST': ['0100100', None, '1700100'],
+        'Aliq. ICMS': [7.0, np.nan, 18.5],
+    })
+    parquet = io.BytesIO()
+    df.to_parquet(parquet)
+    parquet.seek(0)
+    csv = io.BytesIO(df.to_csv(index=False).encode('utf-8'))
+
+    lido = read_table(parquet, 'base.parquet')
+    assert lido['NCM'].tolist()[::2] == ['84713012', '10063021']
+    assert lido['CEST'].tolist()[::2] == ['0100100', '1700100']
+    assert lido['NCM'].isna().tolist() == [False, True, False]
+    assert lido['CEST'].isna().tolist() == [False, True, False]
+    for coluna in ['NCM', 'CEST']:
+        assert lido[coluna].tolist()[::2] == read_table(csv, 'base.csv')[coluna].tolist()[::2]
+        csv.seek(0)
+
+def test_parquet_ncm_float_com_nulos_sem_sufixo():
+    df = pd.DataFrame({'NCM': [84713012.0, np.nan], 'CEST': [np.nan, 1700100.0]})
+    parquet = io.BytesIO()
+    df.to_parquet(parquet)
+    parquet.seek(0)
+    lido = read_table(parquet, 'base.parquet')
+    assert lido['NCM'].iloc[0] == '84713012' and pd.isna(lido['NCM'].iloc[1])
+    assert pd.isna(lido['CEST'].iloc[0]) and lido['CEST'].iloc[1] == '1700100'
@@ -0,0 +1,98 @@
+"""Testes do índice TF-IDF (similaridade.py) contra o cosseno calculado item a item."""
+import math
+import random
+
+import numpy as np
+import pytest
+
+from auditoria import (ALTERNATIVES_K, BaseIndex, fuzzy_match_batch, match_alternatives, normalize_description,
+                       tfidf_match_batch)
+from dados_sinteticos import generate_audit, generate_base
+from similaridade import TfidfIndex, char_ngrams
+
+def _vetor(texto, idf, n):
+    """Vetor TF-IDF (dicionário n-grama -> peso, norma L2) só com os n-gramas de `idf`."""
+    frequencias = {}
+    for ngrama in char_ngrams(texto, n):
+        if ngrama in idf:
+            frequencias[ngrama] = frequencias.get(ngrama, 0) + 1
+    vetor = {ngrama: (1 + math.log(c)) * idf[ngrama] for ngrama, c in frequencias.items()}
+    norma = math.sqrt(sum(peso * peso for peso in vetor.values()))
+    return {ngrama: peso / norma for ngrama, peso in vetor.items()} if norma else vetor
+
+def _cossenos_forca_bruta(base, consultas, n):
+    documentos = {}
+    for texto in base:
+        for ngrama in set(char_ngrams(texto, n)):
+            documentos[ngrama] = documentos.get(ngrama, 0) + 1
+    idf = {ngrama: math.log((1 + len(base)) / (1 + df)) + 1 for ngrama, df in documentos.items()}
+    vetores_base = [_vetor(texto, idf, n) for texto in base]
+    matriz = np.zeros((len(consultas), len(base)))
+    for i, consulta in enumerate(consultas):
+        vetor = _vetor(consulta, idf, n)
+        for j, item in enumerate(vetores_base):
+            matriz[i, j] = sum(peso * item.get(ngrama, 0.0) for ngrama, peso in vetor.items())
+    return matriz * 100
+
+def _top_k_forca_bruta(linha, k, colunas):
+    """(posições, pontuações) dos k maiores de `linha`, arredondados; empate: menor posição; só pontuação > 0."""
+    candidatos = sorted((-round(linha[j]), j) for j in colunas if round(linha[j]) > 0)[:k]
+    return [j for _, j in candidatos], [-s for s, _ in candidatos]
+
+def _ambigua(valores, pontuacoes, k):
+    """Alguma pontuação que decide o top-k está a menos de 1e-3 de x,5? (o arredondamento
+    depende então da precisão float32 da parte densa do índice)"""
+    piso = pontuacoes[-1] - 1 if len(pontuacoes) == k else 0
+    decisivas = valores[valores >= piso - 0.5]
+    return bool(np.any(np.abs(decisivas - np.floor(decisivas) - 0.5) < 1e-3))
+
+@pytest.mark.parametrize('k', [1, 5])
+def test_top_k_igual_a_forca_bruta(k):
+    configs = generate_base(400, seed=31)
+    base = [normalize_description(desc) for desc in configs]
+    consultas = [normalize_description(desc) for desc in generate_audit(configs, 150, seed=32)['Descrição item']]
+    consultas += ['', 'xyz', base[0], base[0]] # Vazia, sem n-gramas em comum e descrição duplicada
+    indice = TfidfIndex(base)
+    assert len(indice.matriz_densa) > 0 and len(indice.itens) > 0 # As duas partes do índice são usadas
+
+    esperado = _cossenos_forca_bruta(base, consultas, indice.n)
+    np.testing.assert_allclose(indice.scores(consultas) * 100, esperado, atol=1e-3)
+    rnd = random.Random(33)
+    subconjunto = sorted(rnd.sample(range(len(base)), 120))
+    for colunas in (None, subconjunto):
+        posicoes, scores = indice.top_k(consultas, k, batch_size=64, colunas=colunas)
+        comparadas = 0
+        for i, linha in enumerate(esperado):
+            concorrentes = range(len(base)) if colunas is None else colunas
+            pos, pts = _top_k_forca_bruta(linha, k, concorrentes)
+            if _ambigua(linha[list(concorrentes)], pts, k):
+                continue
+            assert posicoes[i].tolist() == pos + [-1] * (k - len(pos))
+            assert scores[i].tolist() == pts + [0] * (k - len(pts))
+            comparadas += 1
+        assert comparadas > len(consultas) * 0.9
+
+def test_tfidf_acerta_como_o_fuzzy():
+    # Planilha rotulada como em benchmarks/comparar_similaridade.py: só linhas que chegam à etapa de
+    # similaridade, cada uma com o item de origem ('' para itens desconhecidos)
+    configs = generate_base(1500, seed=41)
+    audit_df = generate_audit(configs, 600, seed=42, taxa_exata=0, taxa_variante=0.45, taxa_erro=0.45,
+                              taxa_divergencia=0, origem=True)
+    base_index = BaseIndex.from_configs(configs)
+    descs = [str(desc).strip().lower() for desc in audit_df['Descrição item']]
+    origem = np.array([base_index.posicoes[desc] if desc else -1 for desc in audit_df['Item de origem']])
+    conhecidas = origem >= 0
+    assert 0 < conhecidas.sum() < len(origem)
+
+    fuzzy = fuzzy_match_batch(descs, base_index.descs_lower)[0]
+    tfidf = tfidf_match_batch(descs, base_index)[0]
+    acertos_fuzzy = np.mean(fuzzy[conhecidas] == origem[conhecidas])
+    acertos_tfidf = np.mean(tfidf[conhecidas] == origem[conhecidas])
+    assert acertos_fuzzy >= 0.95
+    assert acertos_tfidf >= acertos_fuzzy - 0.03
+    # Poucas linhas conhecidas associadas a outro item e menos desconhecidos associados que no fuzzy
+    assert np.mean((tfidf[conhecidas] >= 0) & (tfidf[conhecidas] != origem[conhecidas])) <= 0.01
+    assert np.mean(tfidf[~conhecidas] >= 0) <= np.mean(fuzzy[~conhecidas] >= 0)
+    # O item de origem quase sempre entre as alternativas da revisão
+    candidatos = match_alternatives(descs, base_index, ALTERNATIVES_K)[0]
+    assert np.mean((candidatos == origem[:, None]).any(axis=1)[conhecidas]) >= 0.99
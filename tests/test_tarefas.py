@@ -0,0 +1,89 @@
+"""Testes da fila de tarefas em segundo plano (tarefas.py)."""
+import threading
+
+from tarefas import JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_RUNNING, JobCancelled, JobQueue, ReadWriteLock
+
+def _esperar(job, segundos=5):
+    for _ in range(int(segundos / 0.01)):
+        if job.finished:
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError(f"Tarefa não terminou: {job.status}")
+
+def _bloqueada(liberar, parcial):
+    """Tarefa que espera `liberar` e, se o cancelamento foi pedido e `parcial`, para cedo."""
+    def funcao(job):
+        liberar.wait(5)
+        if parcial and job.cancel_requested:
+            raise JobCancelled({'parcial': 'metade'})
+        return {'completo': True}
+    return funcao
+
+def test_cancelada_so_quando_a_funcao_para_cedo():
+    fila = JobQueue(workers=1)
+    liberar = threading.Event()
+    completa = fila.submit('s', _bloqueada(liberar, parcial=False))
+    parcial = fila.submit('s', _bloqueada(liberar, parcial=True))
+    while completa.status != JOB_RUNNING:
+        threading.Event().wait(0.01)
+    fila.cancel(completa.id) # Pedido tarde demais: a função termina o trabalho
+    liberar.set()
+    assert _esperar(completa).status == JOB_DONE and completa.resultado == {'completo': True}
+    assert _esperar(parcial).status == JOB_DONE # Sem pedido de cancelamento
+
+    liberar = threading.Event()
+    parcial = fila.submit('s', _bloqueada(liberar, parcial=True))
+    while parcial.status != JOB_RUNNING:
+        threading.Event().wait(0.01)
+    fila.cancel(parcial.id)
+    liberar.set()
+    assert _esperar(parcial).status == JOB_CANCELLED and parcial.resultado == {'parcial': 'metade'}
+
+def test_cancelada_na_fila_e_erro():
+    fila = JobQueue(workers=1)
+    liberar = threading.Event()
+    primeira = fila.submit('s', _bloqueada(liberar, parcial=True))
+    na_fila = fila.submit('s', _bloqueada(liberar, parcial=True))
+    fila.cancel(na_fila.id)
+    assert na_fila.status == JOB_CANCELLED and na_fila.resultado is None
+    falha = fila.submit('s', lambda job: 1 / 0)
+    liberar.set()
+    assert _esperar(primeira).status == JOB_DONE
+    assert _esperar(falha).status == JOB_FAILED and isinstance(falha.erro, ZeroDivisionError)
+
+def test_read_write_lock():
+    lock = ReadWriteLock()
+    eventos = []
+    lendo = threading.Event()
+    liberar_leitura = threading.Event()
+
+    def ler(nome, sinal=None):
+        with lock.reading():
+            eventos.append(f'{nome}+')
+            if sinal is not None:
+                sinal.set()
+                liberar_leitura.wait(5)
+            eventos.append(f'{nome}-')
+
+    def escrever():
+        with lock.writing():
+            with lock.writing(), lock.reading(): # Reentrante; a própria thread pode ler
+                eventos.append('escrita')
+
+    leitor = threading.Thread(target=ler, args=('leitura1', lendo))
+    leitor.start()
+    assert lendo.wait(5)
+    with lock.reading(): # Leituras simultâneas
+        eventos.append('leitura2')
+    escritor = threading.Thread(target=escrever)
+    escritor.start()
+    while not lock._escritas_esperando:
+        threading.Event().wait(0.01)
+    atrasada = threading.Thread(target=ler, args=('leitura3',)) # Espera a escrita pendente
+    atrasada.start()
+    threading.Event().wait(0.05)
+    assert eventos == ['leitura1+', 'leitura2']
+    liberar_leitura.set()
+    for thread in (leitor, escritor, atrasada):
+        thread.join(5)
+    assert eventos == ['leitura1+', 'leitura2', 'leitura1-', 'escrita', 'leitura3+', 'leitura3-']